@@ -0,0 +1,52 @@
+# Importing 10k tasks one POST /tasks at a time vs through POST /tasks/bulk.
+# Wipes the configured database, run it against a scratch instance:
+#   python -m bench.bulk_import [tasks] [batch]
+import asyncio
+import sys
+import time
+
+import httpx
+
+from bench.common import seed
+from src import main
+
+
+async def per_request(client: httpx.AsyncClient, token: str, tasks: int):
+    for i in range(tasks):
+        res = await client.post("/tasks", params={"token": token}, json={"text": f"task {i}"})
+        res.raise_for_status()
+
+
+async def bulk(client: httpx.AsyncClient, token: str, tasks: int, batch: int):
+    for start in range(0, tasks, batch):
+        operations = [{"op": "create", "task": {"text": f"task {i}"}} for i in range(start, min(start + batch, tasks))]
+        res = await client.post("/tasks/bulk", params={"token": token}, json=operations)
+        res.raise_for_status()
+
+
+async def bench(tasks: int, batch: int):
+    async with main.lifespan(main.app):
+        await main.startup.wait()
+        await measure(main.db_service.service, tasks, batch)
+
+
+async def measure(service, tasks: int, batch: int):
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for name, run in (
+            ("per request", lambda token: per_request(client, token, tasks)),
+            (f"bulk x{batch}", lambda token: bulk(client, token, tasks, batch)),
+        ):
+            seed(service, users=1, tasks_per_user=0)
+            token = str(service.get_users("root")[0].uuid)
+            start = time.perf_counter()
+            await run(token)
+            elapsed = time.perf_counter() - start
+            assert len(service.get_tasks(token)) == tasks
+            print(f"{name:>12}: {tasks / elapsed:10.1f} tasks/s ({elapsed:.2f}s)")
+    service.delete_data("root")
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    asyncio.run(bench(*(args or [10000, 1000])))
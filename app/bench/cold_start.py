@@ -0,0 +1,69 @@
+# Worker cold start: time from spawning uvicorn to /health/live and /health/ready answering 200.
+# The first start may migrate the schema, the ones after it should find it current and skip the DDL.
+# Uses the configured database, with sqlite on a temporary file unless SQLITE_PATH is set:
+#   python -m bench.cold_start [starts]
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+from dotenv import load_dotenv
+
+PORT = 8765
+
+
+def wait_for(client: httpx.Client, worker, path: str, start: float, timeout: float = 120) -> tuple[float, dict]:
+    while time.perf_counter() - start < timeout:
+        if worker.poll() is not None:
+            raise RuntimeError(f"Worker exited with {worker.returncode}")
+        try:
+            res = client.get(f"http://127.0.0.1:{PORT}{path}")
+            if res.status_code == 200:
+                return time.perf_counter() - start, res.json()
+        except httpx.TransportError:
+            pass
+        time.sleep(0.005)
+    raise TimeoutError(f"{path} not ready after {timeout}s")
+
+
+def cold_start(env: dict) -> tuple[float, float, float]:
+    start = time.perf_counter()
+    worker = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "src.main:app", "--port", str(PORT), "--log-level", "warning"],
+        env=env,
+    )
+    try:
+        with httpx.Client() as client:
+            live, _ = wait_for(client, worker, "/health/live", start)
+            ready, stats = wait_for(client, worker, "/health/ready", start)
+    finally:
+        worker.terminate()
+        worker.wait()
+    return live, ready, stats["startup_seconds"]
+
+
+def main(starts: int):
+    load_dotenv()
+    env = dict(os.environ)
+    with tempfile.TemporaryDirectory() as scratch:
+        if env.get("DB_MANAGER") == "sqlite":
+            env.setdefault("SQLITE_PATH", os.path.join(scratch, "tasks.db"))
+        runs = [cold_start(env) for _ in range(starts)]
+    print(f"{'start':>8} {'live ms':>9} {'ready ms':>9} {'init ms':>9}")
+    for i, (live, ready, init) in enumerate(runs):
+        print(f"{'first' if i == 0 else i + 1:>8} {live * 1000:>9.1f} {ready * 1000:>9.1f} {init * 1000:>9.1f}")
+    if len(runs) > 1:
+        later = runs[1:]
+        print(
+            f"{'median':>8} {statistics.median(r[0] for r in later) * 1000:>9.1f}"
+            f" {statistics.median(r[1] for r in later) * 1000:>9.1f}"
+            f" {statistics.median(r[2] for r in later) * 1000:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*(args or [5]))
@@ -0,0 +1,115 @@
+import os
+import statistics
+import time
+from datetime import datetime
+from uuid import UUID, uuid4
+
+from dotenv import load_dotenv
+
+from src.models.task import TaskCreate
+from src.models.user import UserLogin
+from src.services.factory import create_service
+from src.services.instrumentation import RequestStats, current_request
+
+
+TASK_FIELDS = ("id", "user_id", "text", "created_at", "updated_at", "is_checked", "is_important")
+
+
+def make_service():
+    load_dotenv()
+    service = create_service(os.getenv("DB_MANAGER"))
+    service.init_db()
+    return service
+
+
+def server_round_trips(service) -> int:
+    # Counted on the server so the numbers don't depend on how the service talks to the driver
+    if service.name == "mongo":
+        counters = service.client.admin.command("serverStatus")["opcounters"]
+        return sum(counters[op] for op in ("query", "getmore", "command", "insert", "update", "delete"))
+    with service.pool.cursor() as cursor:
+        cursor.execute("SHOW GLOBAL STATUS LIKE 'Questions'")
+        return int(cursor.fetchone()[1])
+
+
+def count_round_trips(service, fn):
+    if service.name == "sqlite":
+        # Embedded, there is no server to ask, count the statements the instrumented cursor sees
+        stats = RequestStats()
+        token = current_request.set(stats)
+        try:
+            return fn(), stats.queries
+        finally:
+            current_request.reset(token)
+    before = server_round_trips(service)
+    result = fn()
+    # The second status query is counted by the server too
+    return result, server_round_trips(service) - before - 1
+
+
+def seed(service, users: int, tasks_per_user: int):
+    service.delete_data("root")
+    for i in range(users):
+        login = UserLogin(id=f"bench-{i}@example.com", password="bench")
+        user = service.create_user(login)
+        for j in range(tasks_per_user):
+            service.create_task(TaskCreate(text=f"task {j}"), str(user.uuid))
+
+
+def timed(fn, repeat: int) -> list[float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def summary(samples: list[float]) -> str:
+    ordered = sorted(samples)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    return f"p50={statistics.median(ordered) * 1000:.2f}ms p99={p99 * 1000:.2f}ms"
+
+
+def bulk_seed(
+    service, users: int, tasks_per_user: int, batch: int = 10000, text=None
+) -> tuple[list[str], list[UUID]]:
+    # Writes straight to storage so seeding a million tasks doesn't take a million requests.
+    # text(user_id, j) picks each task's text, the default is unique per task.
+    service.delete_data("root")
+    text = text or (lambda user_id, j: f"task {j} of {user_id}")
+    now = datetime.now()
+    user_rows = [(f"bench-{i}@example.com", "bench", uuid4()) for i in range(users)]
+    task_rows = [
+        (uuid4(), user_id, text(user_id, j), now, now, j % 2 == 0, j % 5 == 0)
+        for user_id, _, _ in user_rows
+        for j in range(tasks_per_user)
+    ]
+    if service.name == "mongo":
+        for i in range(0, len(user_rows), batch):
+            service.users.insert_many(
+                [{"id": id, "password": password, "uuid": uuid, "tasks": []} for id, password, uuid in user_rows[i : i + batch]]
+            )
+        for i in range(0, len(task_rows), batch):
+            rows = task_rows[i : i + batch]
+            first = service._next_seq(len(rows))
+            service.tasks.insert_many(
+                [
+                    dict(zip(TASK_FIELDS, (id, user_id, text, str(created_at), str(updated_at), checked, important)))
+                    | {"seq": first + j}
+                    for j, (id, user_id, text, created_at, updated_at, checked, important) in enumerate(rows)
+                ]
+            )
+    else:
+        with service.pool.cursor() as cursor:
+            for i in range(0, len(user_rows), batch):
+                cursor.executemany(
+                    "INSERT INTO users (id, password, uuid) VALUES (%s, %s, %s)",
+                    [(id, password, uuid.bytes) for id, password, uuid in user_rows[i : i + batch]],
+                )
+            for i in range(0, len(task_rows), batch):
+                cursor.executemany(
+                    "INSERT INTO tasks (id, user_id, text, created_at, updated_at, is_checked, is_important) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                    [(row[0].bytes, *row[1:]) for row in task_rows[i : i + batch]],
+                )
+    return [str(uuid) for _, _, uuid in user_rows], [row[0] for row in task_rows]
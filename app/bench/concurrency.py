@@ -0,0 +1,53 @@
+# Throughput of GET /tasks as the number of in-flight requests grows.
+# Drives the ASGI app in-process, so a handler that blocks the event loop shows up as flat throughput.
+# Wipes the configured database, run it against a scratch instance:
+#   python -m bench.concurrency
+import asyncio
+import sys
+import time
+
+import httpx
+
+from bench.common import seed
+from src import main
+
+
+async def run_level(client: httpx.AsyncClient, token: str, in_flight: int, requests: int) -> float:
+    semaphore = asyncio.Semaphore(in_flight)
+
+    async def one():
+        async with semaphore:
+            res = await client.get("/tasks", params={"token": token})
+            res.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return requests / (time.perf_counter() - start)
+
+
+async def bench(levels: list[int], requests: int = 500):
+    async with main.lifespan(main.app):
+        await main.startup.wait()
+        await measure(main.db_service, levels, requests)
+
+
+async def measure(db_service, levels: list[int], requests: int):
+    service = db_service.service
+    seed(service, users=1, tasks_per_user=50)
+    token = str(service.get_users("root")[0].uuid)
+
+    # The async wrapper must hand back exactly what the blocking service does
+    assert await db_service.get_tasks(token) == service.get_tasks(token)
+    assert await db_service.get_users("root") == service.get_users("root")
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        print(f"{'in flight':>10} {'req/s':>10}")
+        for in_flight in levels:
+            rps = await run_level(client, token, in_flight, requests)
+            print(f"{in_flight:>10} {rps:>10.1f}")
+    service.delete_data("root")
+
+
+if __name__ == "__main__":
+    asyncio.run(bench([int(arg) for arg in sys.argv[1:]] or [1, 2, 4, 8, 16, 32]))
@@ -0,0 +1,133 @@
+# Drives every endpoint in main.py against each backend and reports p50/p99 latency and requests/s of
+# the requests served, and how many admission control turned away (ADMISSION_* to tune it).
+# sqlite needs no running database. Wipes the other backends, run them against scratch instances:
+#   python -m bench.endpoints [sqlite mariadb mongo] [--requests N] [--concurrency C]
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+import httpx
+
+from src import main
+from src.models.task import TaskCreate
+from src.models.user import UserLogin
+from src.services.factory import DB_MANAGERS
+
+
+class Fixture:
+    def __init__(self, service, requests: int):
+        service.delete_data("root")
+        self.user = service.create_user(UserLogin(id="bench@example.com", password="bench"))
+        self.token = str(self.user.uuid)
+        self.tasks = [service.create_task(TaskCreate(text=f"task {i}"), self.token) for i in range(100)]
+        # A client that synced once and has everything since to catch up on
+        self.sync_token = service.sync_tasks(self.token).next
+        # Destructive endpoints get their own rows so every request does real work
+        self.doomed_tasks = [service.create_task(TaskCreate(text="doomed"), self.token) for _ in range(requests)]
+        self.doomed_users = [
+            service.create_user(UserLogin(id=f"doomed-{i}@example.com", password="bench")) for i in range(requests)
+        ]
+
+
+def scenarios(f: Fixture):
+    login = {"id": f.user.id, "password": "bench"}
+    task = lambda i: f.tasks[i % len(f.tasks)].id  # noqa: E731
+    return [
+        ("GET /health/ready", lambda c, i: c.get("/health/ready")),
+        ("POST /users/get_token", lambda c, i: c.post("/users/get_token", json=login)),
+        ("POST /users", lambda c, i: c.post("/users", json={"id": f"new-{i}@example.com", "password": "bench"})),
+        ("GET /users/{id}", lambda c, i: c.get(f"/users/{f.user.id}", params={"token": "root"})),
+        ("PUT /users/{id}", lambda c, i: c.put(f"/users/{f.user.id}", params={"token": f.token}, json=login)),
+        ("GET /users", lambda c, i: c.get("/users", params={"token": "root"})),
+        ("GET /tasks", lambda c, i: c.get("/tasks", params={"token": f.token})),
+        ("GET /tasks root", lambda c, i: c.get("/tasks", params={"token": "root"})),
+        ("GET /tasks/sync", lambda c, i: c.get("/tasks/sync", params={"token": f.token, "since": f.sync_token})),
+        ("GET /tasks/search", lambda c, i: c.get("/tasks/search", params={"token": f.token, "q": f"task {i % 100}"})),
+        ("GET /tasks/{id}", lambda c, i: c.get(f"/tasks/{task(i)}", params={"token": f.token})),
+        ("POST /tasks", lambda c, i: c.post("/tasks", params={"token": f.token}, json={"text": f"new {i}"})),
+        (
+            "PUT /tasks/{id}",
+            lambda c, i: c.put(f"/tasks/{task(i)}", params={"token": f.token}, json={"text": f"updated {i}"}),
+        ),
+        (
+            "POST /tasks/bulk",
+            lambda c, i: c.post(
+                "/tasks/bulk",
+                params={"token": f.token},
+                json=[{"op": "create", "task": {"text": f"bulk {i} {j}"}} for j in range(100)],
+            ),
+        ),
+        ("DELETE /tasks/{id}", lambda c, i: c.delete(f"/tasks/{f.doomed_tasks[i].id}", params={"token": f.token})),
+        ("DELETE /users/{id}", lambda c, i: c.delete(f"/users/{f.doomed_users[i].id}", params={"token": "root"})),
+        ("GET /export/tasks", lambda c, i: c.get("/export/tasks", params={"token": "root"})),
+        ("GET /metrics", lambda c, i: c.get("/metrics")),
+    ]
+
+
+async def run(client: httpx.AsyncClient, request, requests: int, concurrency: int) -> tuple[list[float], int, float]:
+    # Latencies of the requests served, and how many admission control turned away with a 503
+    latencies = []
+    rejected = 0
+    next_index = iter(range(requests))
+
+    async def worker():
+        nonlocal rejected
+        for i in next_index:
+            start = time.perf_counter()
+            res = await request(client, i)
+            if res.status_code == 503 and "Retry-After" in res.headers:
+                rejected += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+            res.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, rejected, time.perf_counter() - start
+
+
+async def bench_backend(name: str, requests: int, concurrency: int):
+    os.environ["DB_MANAGER"] = name
+    async with main.lifespan(main.app):
+        await main.startup.wait()
+        await measure(name, main.db_service.service, requests, concurrency)
+
+
+async def measure(name: str, service, requests: int, concurrency: int):
+    fixture = Fixture(service, requests)
+    transport = httpx.ASGITransport(app=main.app)
+    print(f"\n{name} ({requests} requests, {concurrency} in flight)")
+    print(f"{'endpoint':<22} {'p50 ms':>9} {'p99 ms':>9} {'req/s':>9} {'rejected':>9}")
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for label, request in scenarios(fixture):
+            latencies, rejected, elapsed = await run(client, request, requests, concurrency)
+            if not latencies:
+                print(f"{label:<22} {'-':>9} {'-':>9} {'-':>9} {rejected:>9}")
+                continue
+            ordered = sorted(latencies)
+            p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+            served = len(latencies) / elapsed
+            print(
+                f"{label:<22} {statistics.median(ordered) * 1000:>9.2f} {p99 * 1000:>9.2f} {served:>9.1f} {rejected:>9}"
+            )
+        res = await client.delete("/buster_call", params={"token": "root"})
+        res.raise_for_status()
+
+
+async def bench(backends: list[str], requests: int, concurrency: int):
+    for name in backends:
+        await bench_backend(name, requests, concurrency)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("backends", nargs="*", help=f"any of {', '.join(DB_MANAGERS)} (default sqlite)")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+    for name in args.backends:
+        if name not in DB_MANAGERS:
+            parser.error(f"unknown backend {name}")
+    asyncio.run(bench(args.backends or ["sqlite"], args.requests, args.concurrency))
@@ -0,0 +1,21 @@
+# Round trips and latency of GET /users as the number of users grows.
+# Wipes the configured database, run it against a scratch instance:
+#   python -m bench.get_users
+import sys
+
+from bench.common import count_round_trips, make_service, seed, summary, timed
+
+
+def main(sizes: list[int], tasks_per_user: int = 5, repeat: int = 10):
+    service = make_service()
+    print(f"{'users':>8} {'round trips':>12}  latency")
+    for users in sizes:
+        seed(service, users, tasks_per_user)
+        _, round_trips = count_round_trips(service, lambda: service.get_users("root"))
+        samples = timed(lambda: service.get_users("root"), repeat)
+        print(f"{users:>8} {round_trips:>12}  {summary(samples)}")
+    service.delete_data("root")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10, 100, 1000, 10000])
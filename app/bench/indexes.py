@@ -0,0 +1,53 @@
+# Token and task lookup latency at 1M tasks, without and with the indexes init_db creates.
+# Wipes the configured database, run it against a scratch instance:
+#   python -m bench.indexes [users] [tasks_per_user]
+import random
+import sys
+
+from bench.common import bulk_seed, make_service, summary, timed
+
+
+def drop_indexes(service):
+    if service.name == "mongo":
+        service.users.drop_indexes()
+        service.tasks.drop_indexes()
+        return
+    with service.pool.cursor() as cursor:
+        # The foreign key keeps its own index on tasks.user_id
+        for index, table in (("users_uuid", "users"), ("tasks_user_created", "tasks"), ("tasks_created", "tasks")):
+            # SQLite index names are global to the database, its DROP INDEX takes no table
+            on = "" if service.name == "sqlite" else f" ON {table}"
+            cursor.execute(f"DROP INDEX IF EXISTS {index}{on}")
+
+
+def measure(service, tokens, task_ids, repeat: int):
+    def get_tasks():
+        # Every call has to resolve its token against the users table
+        service.token_cache.clear()
+        service.get_tasks(random.choice(tokens))
+
+    def get_task():
+        service.get_task(random.choice(task_ids), "root")
+
+    print(f"  get_tasks by token: {summary(timed(get_tasks, repeat))}")
+    print(f"  get_task by id:     {summary(timed(get_task, repeat))}")
+
+
+def main(users: int, tasks_per_user: int, repeat: int = 200):
+    service = make_service()
+    print(f"seeding {users} users x {tasks_per_user} tasks")
+    tokens, task_ids = bulk_seed(service, users, tasks_per_user)
+
+    drop_indexes(service)
+    print("without indexes")
+    measure(service, tokens, task_ids, repeat)
+
+    service.init_db(force=True)
+    print("with indexes")
+    measure(service, tokens, task_ids, repeat)
+    service.delete_data("root")
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*(args or [10000, 100]))
@@ -0,0 +1,60 @@
+# Migration throughput in rows/s from the configured database (DB_MANAGER) to MIGRATION_TARGET at
+# MIGRATION_TARGET_LOCATION (a fresh SQLite file by default), for a few worker counts and batch sizes,
+# against the row-by-row create_user/create_task copy it replaces.
+# Wipes both databases, run it against scratch instances:
+#   python -m bench.migration [users] [tasks_per_user]
+import os
+import sys
+import tempfile
+import time
+
+from bench.common import bulk_seed, make_service
+from src.models.task import TaskCreate
+from src.models.user import UserLogin
+from src.services.factory import create_backend
+from src.services.migration import Migration
+
+CONFIGS = [(1, 1000), (1, 5000), (4, 5000), (8, 5000), (8, 20000)]
+
+
+def row_by_row(source, target, users: int) -> float:
+    # What moving data took before: through the public methods, new ids and timestamps on the other side
+    start = time.perf_counter()
+    for user in source.get_users("root"):
+        target.create_user(UserLogin(id=user.id, password=user.password))
+        token = target.get_token(UserLogin(id=user.id, password=user.password))
+        for task in user.tasks:
+            target.create_task(TaskCreate(text=task.text, is_checked=task.is_checked, is_important=task.is_important), token)
+    return time.perf_counter() - start
+
+
+def main(users: int, tasks_per_user: int):
+    source = make_service()
+    location = os.getenv("MIGRATION_TARGET_LOCATION") or os.path.join(tempfile.mkdtemp(), "target.db")
+    target = create_backend(os.getenv("MIGRATION_TARGET", "sqlite"), location)
+    target.init_db()
+    rows = users * (tasks_per_user + 1)
+    print(f"seeding {users} users x {tasks_per_user} tasks on {source.name}, copying to {target.name}")
+    bulk_seed(source, users, tasks_per_user)
+
+    for workers, batch_size in CONFIGS:
+        target.delete_data("root")
+        result = Migration(source, target, ranges=max(64, workers), workers=workers, batch_size=batch_size).run()
+        print(f"workers={workers:<2} batch={batch_size:<5}  {result['rows_per_second']:10.1f} rows/s ({result['seconds']:.2f}s)")
+    report = Migration(source, target, workers=8).verify()
+    print(f"verified: {report['ok']}")
+
+    # Only a sample, a million rows one at a time takes too long to wait for
+    sample = min(users, 100)
+    bulk_seed(source, sample, tasks_per_user)
+    target.delete_data("root")
+    elapsed = row_by_row(source, target, sample)
+    print(f"row by row:           {sample * (tasks_per_user + 1) / elapsed:10.1f} rows/s ({sample} users)")
+    print(f"{rows} rows in the full runs")
+    source.delete_data("root")
+    target.delete_data("root")
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*(args or [10000, 100]))
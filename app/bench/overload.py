@@ -0,0 +1,67 @@
+# Latency under overload with and without admission control. Requests arrive at a fixed rate whatever
+# happens to earlier ones (open loop), mostly point reads with some per-user lists and a few root scans, at
+# a rate the database can't keep up with. Without admission control every class queues behind everything
+# else and the tail grows for as long as the overload lasts. With it, p99 of what gets served stays near
+# ADMISSION_MAX_WAIT_MS plus the query itself, the excess gets a quick 503, and point reads go first.
+# Wipes the configured database, run it against a scratch instance:
+#   python -m bench.overload [requests_per_second] [seconds]
+import asyncio
+import random
+import sys
+import time
+
+import httpx
+
+from bench.common import bulk_seed, summary
+from src import main
+
+MIX = [("point", 0.7), ("default", 0.2), ("scan", 0.1)]
+
+
+async def run(client: httpx.AsyncClient, tokens: list[str], task_ids: list, rate: float, seconds: float) -> dict:
+    requests = {
+        "point": lambda: client.get(f"/tasks/{random.choice(task_ids)}", params={"token": "root"}),
+        "default": lambda: client.get("/tasks", params={"token": random.choice(tokens), "limit": 500}),
+        "scan": lambda: client.get("/tasks", params={"token": "root", "limit": 1000, "is_checked": random.random() < 0.5}),
+    }
+    results = {kind: {"ok": [], "rejected": []} for kind, _ in MIX}
+
+    async def one(kind: str):
+        start = time.perf_counter()
+        res = await requests[kind]()
+        results[kind]["rejected" if res.status_code == 503 else "ok"].append(time.perf_counter() - start)
+
+    pending = []
+    started = time.perf_counter()
+    for i in range(int(rate * seconds)):
+        # Arrivals on schedule, late ones catch up at once like a backlog of clients would
+        delay = started + i / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        kind = random.choices([kind for kind, _ in MIX], [weight for _, weight in MIX])[0]
+        pending.append(asyncio.create_task(one(kind)))
+    await asyncio.gather(*pending)
+    return results
+
+
+async def bench(rate: float, seconds: float):
+    async with main.lifespan(main.app):
+        await main.startup.wait()
+        service = main.db_service.service
+        tokens, task_ids = bulk_seed(service, users=200, tasks_per_user=500)
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for label, admission in (("without admission control", None), ("with admission control", main.admission)):
+                main.admission = admission
+                random.seed(0)
+                results = await run(client, tokens, task_ids, rate, seconds)
+                print(f"{label}, {rate:.0f} req/s for {seconds:.0f}s")
+                for kind, outcome in results.items():
+                    served = summary(outcome["ok"]) if outcome["ok"] else "none served"
+                    print(f"  {kind:>8}: {len(outcome['ok']):5} ok {served}, {len(outcome['rejected']):5} rejected")
+        service.delete_data("root")
+
+
+if __name__ == "__main__":
+    args = [float(arg) for arg in sys.argv[1:]]
+    asyncio.run(bench(*(args or [400, 10])))
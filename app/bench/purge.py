@@ -0,0 +1,76 @@
+# Foreground latency while a user with many tasks is deleted: inline in one statement, as DELETE /users
+# used to, and as a batched background job at a few duty cycles. The foreground reads and updates
+# another user's tasks, so only locks, I/O and worker threads are shared with the deletion.
+# Wipes the configured database, run it against a scratch instance:
+#   python -m bench.purge [tasks] [in flight]
+import asyncio
+import random
+import sys
+import time
+from uuid import UUID
+
+import httpx
+
+from bench.common import bulk_seed, summary
+from src import main
+
+
+async def foreground(client: httpx.AsyncClient, token: str, task_ids: list, in_flight: int, done) -> tuple[list, int]:
+    samples, errors = [], 0
+
+    async def worker():
+        nonlocal errors
+        while not done():
+            task_id = random.choice(task_ids)
+            start = time.perf_counter()
+            if random.random() < 0.5:
+                res = await client.get(f"/tasks/{task_id}", params={"token": token})
+            else:
+                res = await client.put(f"/tasks/{task_id}", params={"token": token}, json={"text": "updated"})
+            if res.is_success:
+                samples.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    await asyncio.gather(*(worker() for _ in range(in_flight)))
+    return samples, errors
+
+
+async def measure(client: httpx.AsyncClient, tasks: int, in_flight: int):
+    service = main.db_service.service
+    for name, duty_cycle in (("idle", None), ("inline", None), ("job 100%", 1.0), ("job 50%", 0.5), ("job 20%", 0.2)):
+        (_, token), task_ids = bulk_seed(service, 2, tasks)
+        # Only the second user's tasks, the first one is the user being deleted
+        task_ids = task_ids[tasks:][:1000]
+        start = time.perf_counter()
+        if name == "idle":
+            deadline = start + 2
+            samples, errors = await foreground(client, token, task_ids, in_flight, lambda: time.perf_counter() > deadline)
+        elif name == "inline":
+            deletion = asyncio.create_task(main.db_service.delete_user("bench-0@example.com", "root"))
+            samples, errors = await foreground(client, token, task_ids, in_flight, deletion.done)
+        else:
+            main.jobs.duty_cycle = duty_cycle
+            res = await client.delete("/users/bench-0@example.com", params={"token": "root"})
+            assert res.status_code == 202, res.text
+            job = main.jobs.local(UUID(res.json()["job"]["id"]))
+            samples, errors = await foreground(client, token, task_ids, in_flight, lambda: job.status != "running")
+            assert job.status == "done", job
+        elapsed = time.perf_counter() - start
+        print(f"{name:>9}: {summary(samples)} over {len(samples)} requests, {errors} failed, deletion took {elapsed:.2f}s")
+    service.delete_data("root")
+
+
+async def bench(tasks: int, in_flight: int):
+    async with main.lifespan(main.app):
+        await main.startup.wait()
+        # Requests that time out waiting for the database come back as 500s instead of raising here
+        transport = httpx.ASGITransport(app=main.app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            await measure(client, tasks, in_flight)
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    tasks, in_flight = args + [200000, 4][len(args) :]
+    asyncio.run(bench(tasks, in_flight))
@@ -0,0 +1,49 @@
+# Read throughput with the configured read replicas (DB_REPLICAS, or MONGO_READ_PREFERENCE=secondaryPreferred)
+# under a mostly-read mix, and where the reads went. Run it once per replica count to see capacity grow.
+# Wipes the configured database, run it against a scratch instance:
+#   python -m bench.replicas [threads] [seconds]
+import random
+import sys
+import threading
+import time
+
+from bench.common import bulk_seed, make_service
+from src.models.task import TaskCreate
+
+
+def main(threads: int = 16, seconds: float = 10.0, write_ratio: float = 0.05):
+    service = make_service()
+    tokens, _ = bulk_seed(service, users=1000, tasks_per_user=20)
+    # Reads through an uncached token go to the primary, warm the cache the way earlier requests would
+    for token in tokens:
+        service.token_cache.put(token, service.get_tasks(token)[0]["user_id"], service.token_cache.generation)
+    time.sleep(getattr(service, "read_your_writes", 0))
+
+    reads, writes = [0] * threads, [0] * threads
+    deadline = time.monotonic() + seconds
+
+    def worker(i: int):
+        while time.monotonic() < deadline:
+            token = random.choice(tokens)
+            if random.random() < write_ratio:
+                service.create_task(TaskCreate(text="write"), token)
+                writes[i] += 1
+            else:
+                service.get_tasks(token)
+                reads[i] += 1
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    print(f"{sum(reads) / seconds:.1f} reads/s, {sum(writes) / seconds:.1f} writes/s with {threads} threads")
+    replicas = getattr(service, "replicas", None)
+    if replicas is not None:
+        print(f"replicas: {replicas.stats()}")
+    service.delete_data("root")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(int(args[0]) if args else 16, float(args[1]) if len(args) > 1 else 10.0)
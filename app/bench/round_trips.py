@@ -0,0 +1,80 @@
+# Checks how many round trips each point endpoint costs, counted by the database server.
+# Exits non-zero when an endpoint goes over its budget.
+# Wipes the configured database, run it against a scratch instance:
+#   python -m bench.round_trips
+import sys
+from uuid import uuid4
+
+from bench.common import count_round_trips, make_service
+from src.models.task import TaskCreate
+from src.models.user import UserLogin
+
+# (cached token, cold token cache)
+BUDGETS = {
+    "create_user": (1, 1),
+    "update_user": (1, 1),
+    # Its tasks are deleted explicitly inside a transaction, so the triggers leave tombstones,
+    # and its stats row goes with them
+    "delete_user": (5, 5),
+    "create_task": (1, 2),
+    "get_task": (1, 2),
+    "update_task": (2, 3),
+    "delete_task": (1, 2),
+}
+# Mongo has no triggers, the service reserves change sequence values, writes tombstones
+# and updates the stats counters itself
+MONGO_BUDGETS = {
+    **BUDGETS,
+    "create_task": (3, 4),
+    "update_task": (3, 4),
+    "delete_task": (4, 5),
+}
+
+
+def main() -> int:
+    service = make_service()
+    service.delete_data("root")
+    budgets = MONGO_BUDGETS if service.name == "mongo" else BUDGETS
+    login = UserLogin(id="round-trips@example.com", password="bench")
+    token = None
+    task_id = None
+
+    def run(name: str, fn, cold: bool):
+        if cold:
+            service.token_cache.clear()
+        else:
+            # Warm the cache the way any earlier request would have
+            service.get_tasks(token)
+        return count_round_trips(service, fn)
+
+    failures = 0
+    for cold in (False, True):
+        steps = [
+            ("create_user", lambda: service.create_user(login)),
+            ("update_user", lambda: service.update_user(login.id, token, login)),
+            ("create_task", lambda: service.create_task(TaskCreate(text="task"), token)),
+            ("get_task", lambda: service.get_task(task_id, token)),
+            ("update_task", lambda: service.update_task(task_id, token, TaskCreate(text="updated"))),
+            ("delete_task", lambda: service.delete_task(task_id, token)),
+            ("delete_user", lambda: service.delete_user(login.id, "root")),
+        ]
+        print("cold token cache" if cold else "cached token")
+        for name, fn in steps:
+            if name == "create_user":
+                # Warming the cache needs the user to exist already
+                result, round_trips = count_round_trips(service, fn)
+                token = str(result.uuid)
+            else:
+                result, round_trips = run(name, fn, cold)
+            if name == "create_task":
+                task_id = result.id
+            budget = budgets[name][cold]
+            status = "ok" if round_trips <= budget else "OVER BUDGET"
+            failures += round_trips > budget
+            print(f"  {name:>12}: {round_trips} (budget {budget}) {status}")
+        login = UserLogin(id=f"round-trips-{uuid4()}@example.com", password="bench")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,51 @@
+# Search latency at 1M tasks, indexed search against fetching the user's tasks and filtering them here,
+# which is what clients had to do before. On MariaDB and Mongo the index is keyed by owner, so a search
+# costs what the user's own matches do. SQLite's is shared by all users, a common word costs the same
+# whoever searches. Filtering costs what the user's list does: compare 10000 x 100 with 100 x 10000.
+# Wipes the configured database, run it against a scratch instance:
+#   python -m bench.search [users] [tasks_per_user]
+import random
+import sys
+
+from bench.common import bulk_seed, make_service, summary, timed
+
+# Word frequencies fall off like natural text, so there are common, middling and rare words to search for
+VOCABULARY = [f"word{i}" for i in range(5000)]
+WEIGHTS = [1 / (rank + 1) for rank in range(len(VOCABULARY))]
+
+
+def task_text(user_id: str, j: int) -> str:
+    return " ".join(random.choices(VOCABULARY, WEIGHTS, k=random.randint(3, 12)))
+
+
+def main(users: int, tasks_per_user: int, repeat: int = 200):
+    random.seed(0)
+    service = make_service()
+    print(f"seeding {users} users x {tasks_per_user} tasks")
+    tokens, _ = bulk_seed(service, users, tasks_per_user, text=task_text)
+
+    for label, words in (("common", VOCABULARY[:10]), ("middling", VOCABULARY[100:200]), ("rare", VOCABULARY[2000:])):
+
+        def search():
+            service.search_tasks(random.choice(tokens), random.choice(words), limit=20)
+
+        def filter_client_side():
+            word = random.choice(words)
+            matches = [task for task in service.get_tasks(random.choice(tokens)) if word in task["text"].split()]
+            return matches[:20]
+
+        print(f"{label} words")
+        print(f"  search_tasks:          {summary(timed(search, repeat))}")
+        print(f"  get_tasks + filter:    {summary(timed(filter_client_side, repeat))}")
+
+    # Everyone's matches are ranked, the worst case for the shared index
+    def search_all():
+        service.search_tasks("root", random.choice(VOCABULARY[100:200]), limit=20)
+
+    print(f"root, middling words:    {summary(timed(search_all, repeat))}")
+    service.delete_data("root")
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*(args or [10000, 100]))
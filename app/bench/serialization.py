@@ -0,0 +1,69 @@
+# CPU time to turn 10k task rows into a GET /tasks response body: validated models through FastAPI's
+# response_model pass and the stdlib encoder, vs plain dicts of the rows written out by orjson.
+# Needs no database, the rows are generated in the shape the MariaDB driver returns them:
+#   python -m bench.serialization [tasks] [repeat]
+import asyncio
+import json
+import sys
+import time
+from datetime import datetime
+from uuid import UUID, uuid4
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from src.models.task import Task
+from src.services.mariadb_service import MariaDBService
+from src.services.serialization import FastJSONResponse
+
+
+def make_rows(tasks: int) -> list[tuple]:
+    now = datetime.now()
+    return [(uuid4().bytes, "bench@example.com", f"task {i}", now, now, i % 2, 0) for i in range(tasks)]
+
+
+def validated_task(task) -> Task:
+    return Task(
+        id=UUID(bytes=task[0]),
+        user_id=task[1],
+        text=task[2],
+        created_at=str(task[3]),
+        updated_at=str(task[4]),
+        is_checked=task[5],
+        is_important=task[6],
+    )
+
+
+def before(rows: list[tuple], field) -> bytes:
+    tasks = [validated_task(row) for row in rows]
+    content = asyncio.run(serialize_response(field=field, response_content=tasks))
+    return JSONResponse(content).body
+
+
+def after(rows: list[tuple], field) -> bytes:
+    tasks = [MariaDBService._task_fields(row) for row in rows]
+    return FastJSONResponse(tasks).body
+
+
+def main(tasks: int, repeat: int):
+    rows = make_rows(tasks)
+    field = create_response_field("Response_get_tasks", list[Task] | dict, mode="serialization")
+    results = {}
+    for name, run in (("before", before), ("after", after)):
+        body = run(rows, field)
+        cpu = []
+        for _ in range(repeat):
+            start = time.process_time()
+            run(rows, field)
+            cpu.append(time.process_time() - start)
+        best = min(cpu)
+        results[name] = (body, best)
+        print(f"{name:>7}: {best * 1000 / tasks * 10000:8.1f} ms CPU per 10k tasks ({len(body)} bytes)")
+    assert json.loads(results["before"][0]) == json.loads(results["after"][0])
+    print(f"speedup: {results['before'][1] / results['after'][1]:.1f}x")
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*(args or [10000, 5]))
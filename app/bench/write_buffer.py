@@ -0,0 +1,43 @@
+# Inserts/s for concurrent create_task calls with group commit off and on.
+# Wipes the configured database, run it against a scratch instance:
+#   python -m bench.write_buffer [tasks] [in flight] [buffer size] [delay ms]
+import asyncio
+import sys
+import time
+
+from bench.common import make_service, seed
+from src.models.task import TaskCreate
+from src.services.async_service import AsyncDBService
+
+
+async def create(db_service: AsyncDBService, token: str, tasks: int, in_flight: int):
+    next_index = iter(range(tasks))
+
+    async def worker():
+        for i in next_index:
+            res = await db_service.create_task(TaskCreate(text=f"task {i}"), token)
+            assert type(res) is not str, res
+
+    await asyncio.gather(*(worker() for _ in range(in_flight)))
+
+
+async def main(tasks: int, in_flight: int, size: int, delay_ms: float):
+    service = make_service()
+    for name, buffer_size in (("off", 0), (f"on x{size} {delay_ms}ms", size)):
+        seed(service, users=1, tasks_per_user=0)
+        token = str(service.get_users("root")[0].uuid)
+        db_service = AsyncDBService(service, write_buffer_size=buffer_size, write_buffer_delay=delay_ms / 1000)
+        start = time.perf_counter()
+        await create(db_service, token, tasks, in_flight)
+        elapsed = time.perf_counter() - start
+        assert len(service.get_tasks(token)) == tasks
+        batches = f", {db_service.write_buffer.stats()['batch_size_avg']:.1f} per batch" if db_service.write_buffer else ""
+        print(f"{name:>16}: {tasks / elapsed:10.1f} inserts/s ({elapsed:.2f}s{batches})")
+        db_service.close()
+    service.delete_data("root")
+
+
+if __name__ == "__main__":
+    args = [float(arg) for arg in sys.argv[1:]]
+    tasks, in_flight, size, delay_ms = args + [10000, 256, 100, 5.0][len(args) :]
+    asyncio.run(main(int(tasks), int(in_flight), int(size), delay_ms))
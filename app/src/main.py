@@ -1,29 +1,303 @@
+import asyncio
+import logging
 import os
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Literal
 from uuid import UUID
 
 from dotenv import load_dotenv
-from fastapi import FastAPI
+from fastapi import FastAPI, Query, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.routing import Match
 
-from src.models.task import Task, TaskCreate
+from src.models.job import Job
+from src.models.task import Task, TaskCreate, TaskOperation, TaskOperationResult, TaskQuery, TaskSearch, TaskStats, TaskSync
 from src.models.user import User, UserLogin
-from src.services.mariadb_service import MariaDBService
-from src.services.mongo_service import MongoService
-
-app = FastAPI()
+from src.services.admission import DEFAULT, POINT, SCAN, AdmissionControl, Overloaded
+from src.services.async_service import AsyncDBService
+from src.services.backend import root_token
+from src.services.bulk import MAX_OPERATIONS
+from src.services.cache import ResponseCache, TokenCache, Versions
+from src.services.export import ndjson_chunks
+from src.services.factory import create_service
+from src.services.instrumentation import Instrumentation, RequestStats, current_request
+from src.services.jobs import Jobs
+from src.services.pagination import task_cursor, user_cursor
+from src.services.pool import PoolTimeout
+from src.services.replicas import client_wrote_at
+from src.services.serialization import FastJSONResponse
+from src.services.startup import Startup
 
 load_dotenv()
-db_manager = os.getenv("DB_MANAGER")
-if db_manager == "mongo":
-    db_service = MongoService(os.getenv("MONGO_USER"), os.getenv("MONGO_PASS"))
-elif db_manager == "mariadb":
-    db_service = MariaDBService(os.getenv("MARIADB_USER"), os.getenv("MARIADB_PASS"), os.getenv("MARIADB_DATABASE"))
-else:
-    raise ValueError(f"Invalid DB_MANAGER: {db_manager}")
-
-
-@app.get("/")
-async def root() -> dict:
-    return db_service.is_alive()
+logger = logging.getLogger("src.main")
+# Several workers (WEB_CONCURRENCY, read by uvicorn too) each keep their own token cache, and a worker
+# only hears of the writes made through it
+web_concurrency = int(os.getenv("WEB_CONCURRENCY", 1))
+# A worker only forgets the tokens of users deleted or changed through it, and another could hand a dead
+# token the account of a user registered again under the same id. With several workers the token cache
+# is off unless TOKEN_CACHE_SIZE is set, and then entries last TOKEN_CACHE_TTL, 1 second by default.
+token_cache = TokenCache(
+    max_entries=int(os.getenv("TOKEN_CACHE_SIZE", 10000 if web_concurrency == 1 else 0)),
+    ttl=float(os.getenv("TOKEN_CACHE_TTL", 60 if web_concurrency == 1 else 1)),
+)
+slow_query_ms = os.getenv("SLOW_QUERY_MS")
+instrumentation = Instrumentation(slow_query_ms=float(slow_query_ms) if slow_query_ms else None)
+versions = Versions()
+# Cached bodies and ETags are keyed on a version every worker reads alike from the primary. A body read
+# from a replica can be older than that version, so with replicas keys also change every
+# RESPONSE_CACHE_TTL seconds, MAX_REPLICA_LAG by default. RESPONSE_CACHE_SIZE=0 turns them off.
+replica_reads = bool(os.getenv("DB_REPLICAS")) or os.getenv("MONGO_READ_PREFERENCE") == "secondaryPreferred"
+max_replica_lag = float(os.getenv("MAX_REPLICA_LAG", 90 if os.getenv("DB_MANAGER") == "mongo" else 5))
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", 1000)),
+    max_bytes=int(os.getenv("RESPONSE_CACHE_MB", 64)) * 1024 * 1024,
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", max_replica_lag if replica_reads else 0)),
+)
+startup = Startup(
+    retries=int(os.getenv("STARTUP_RETRIES", 10)),
+    backoff=float(os.getenv("STARTUP_BACKOFF", 0.5)),
+    max_backoff=float(os.getenv("STARTUP_BACKOFF_MAX", 10)),
+)
+jobs = Jobs(
+    duty_cycle=float(os.getenv("PURGE_DUTY_CYCLE", 0.5)),
+    stale_after=float(os.getenv("JOB_STALE_SECONDS", 60)),
+)
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", 1000))
+# Tombstones of deleted tasks are kept this long, a client that last synced before then has to sync from
+# scratch. 0 keeps them forever.
+TOMBSTONE_RETENTION_DAYS = float(os.getenv("TOMBSTONE_RETENTION_DAYS", 30))
+TOMBSTONE_PRUNE_SECONDS = float(os.getenv("TOMBSTONE_PRUNE_SECONDS", 3600))
+# Requests working on the database at once, by default as many as there are DB_WORKERS threads, and no
+# more than MariaDB's pool has connections: past that they'd wait for a connection inside the service
+# instead, and time out there. 0 turns it off.
+admission_capacity = int(os.getenv("DB_WORKERS", 16))
+if os.getenv("DB_MANAGER") == "mariadb":
+    admission_capacity = min(admission_capacity, int(os.getenv("MARIADB_POOL_MAX", 10)))
+admission_capacity = int(os.getenv("ADMISSION_CAPACITY", admission_capacity))
+admission = None
+if admission_capacity:
+    admission = AdmissionControl(
+        admission_capacity,
+        limits={SCAN: int(os.getenv("ADMISSION_SCAN_LIMIT", max(1, admission_capacity // 4)))},
+        max_queue=int(os.getenv("ADMISSION_QUEUE", 256)),
+        max_wait=float(os.getenv("ADMISSION_MAX_WAIT_MS", 1000)) / 1000,
+    )
+instrumentation.add_gauges("token_cache", token_cache.stats)
+instrumentation.add_gauges("response_cache", response_cache.stats)
+instrumentation.add_gauges("startup", startup.stats)
+instrumentation.add_gauges("jobs", jobs.stats)
+if admission is not None:
+    instrumentation.add_gauges("admission", admission.stats)
+
+# Built on startup, see lifespan()
+db_service: AsyncDBService | None = None
+
+
+def build_service() -> AsyncDBService:
+    # Doesn't touch the database, the drivers connect on first use
+    service = create_service(
+        os.getenv("DB_MANAGER"), token_cache=token_cache, instrumentation=instrumentation, versions=versions
+    )
+    async_service = AsyncDBService(
+        service,
+        max_workers=int(os.getenv("DB_WORKERS", 16)),
+        write_buffer_size=int(os.getenv("WRITE_BUFFER_SIZE", 0)),
+        write_buffer_delay=float(os.getenv("WRITE_BUFFER_DELAY_MS", 5)) / 1000,
+    )
+    if async_service.write_buffer is not None:
+        instrumentation.add_gauges("write_buffer", async_service.write_buffer.stats)
+    return async_service
+
+
+async def prune_tombstones():
+    # Every worker runs it, the ones that come after the first find next to nothing left to delete
+    try:
+        await startup.wait()
+    except RuntimeError:
+        return
+    while True:
+        try:
+            pruned = await db_service.prune_tombstones(datetime.now() - timedelta(days=TOMBSTONE_RETENTION_DAYS))
+            if pruned:
+                logger.info("pruned %d tombstones", pruned)
+        except Exception as e:
+            logger.warning("pruning tombstones failed: %r", e)
+        await asyncio.sleep(TOMBSTONE_PRUNE_SECONDS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global db_service
+    db_service = build_service()
+    jobs.store = db_service
+    connecting = asyncio.create_task(startup.run(db_service))
+    pruning = asyncio.create_task(prune_tombstones()) if TOMBSTONE_RETENTION_DAYS else None
+    yield
+    connecting.cancel()
+    if pruning is not None:
+        pruning.cancel()
+    await jobs.cancel_all()
+    db_service.close()
+
+
+app = FastAPI(default_response_class=FastJSONResponse, lifespan=lifespan)
+
+MAX_PAGE_SIZE = 1000
+
+
+# Admission class of the routes that aren't DEFAULT, None for those that never wait for the database
+ROUTE_CLASSES = {
+    ("GET", "/health/live"): None,
+    ("GET", "/health/ready"): None,
+    ("GET", "/metrics"): None,
+    ("POST", "/users/get_token"): POINT,
+    ("GET", "/jobs"): POINT,
+    ("GET", "/jobs/{job_id}"): POINT,
+    ("GET", "/tasks/{task_id}"): POINT,
+    ("GET", "/users"): SCAN,
+    ("POST", "/tasks/stats/recompute"): SCAN,
+    ("GET", "/export/users"): SCAN,
+    ("GET", "/export/tasks"): SCAN,
+    ("DELETE", "/buster_call"): SCAN,
+}
+# Routes that read everyone's tasks with the root token
+ROOT_SCANS = {("GET", "/tasks"), ("GET", "/tasks/sync"), ("GET", "/tasks/search")}
+
+
+def admission_class(request: Request) -> str | None:
+    for route in app.router.routes:
+        if route.matches(request.scope)[0] == Match.FULL:
+            key = (request.method, route.path)
+            if key in ROOT_SCANS and request.query_params.get("token") == root_token:
+                return SCAN
+            return ROUTE_CLASSES.get(key, DEFAULT)
+    return None
+
+
+class AdmissionMiddleware:
+    # Sheds load before it reaches the database: a quick 503 instead of a slow answer for everyone.
+    # Plain ASGI rather than @app.middleware, so the slot is held until the response has been sent in
+    # full and a streamed export keeps it for as long as it reads from the database.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        control = admission
+        kind = admission_class(Request(scope)) if scope["type"] == "http" and control is not None else None
+        if kind is None:
+            return await self.app(scope, receive, send)
+        try:
+            started = await control.acquire(kind)
+        except Overloaded as e:
+            response = FastJSONResponse({"error": "Overloaded"}, status_code=503, headers={"Retry-After": e.retry_after_header})
+            return await response(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            control.release(kind, started)
+
+
+app.add_middleware(AdmissionMiddleware)
+
+
+# Added after AdmissionMiddleware so it runs first, a request turned away here never takes a slot
+@app.middleware("http")
+async def require_ready(request: Request, call_next):
+    if not startup.ready and not request.url.path.startswith(("/health/", "/metrics")):
+        return FastJSONResponse({"error": "Service starting"}, status_code=503, headers={"Retry-After": "1"})
+    return await call_next(request)
+
+
+@app.exception_handler(PoolTimeout)
+async def pool_timeout(request: Request, e: PoolTimeout):
+    # Every connection stayed busy for the whole acquire timeout, as good as turned away by admission
+    return FastJSONResponse({"error": "Overloaded"}, status_code=503, headers={"Retry-After": "1"})
+
+
+# Tells whichever worker gets a client's next request that it wrote a moment ago, so its reads skip
+# the replicas for as long as they could be behind
+LAST_WRITE_COOKIE = "last_write"
+
+
+@app.middleware("http")
+async def read_your_writes(request: Request, call_next):
+    try:
+        client_wrote_at.set(float(request.cookies[LAST_WRITE_COOKIE]))
+    except (KeyError, ValueError):
+        pass
+    response = await call_next(request)
+    if request.method not in ("GET", "HEAD", "OPTIONS"):
+        response.set_cookie(LAST_WRITE_COOKIE, f"{time.time():.3f}", httponly=True, samesite="lax")
+    return response
+
+
+@app.middleware("http")
+async def track_db_usage(request: Request, call_next):
+    stats = RequestStats()
+    current_request.set(stats)
+    response = await call_next(request)
+    instrumentation.observe_request(stats)
+    response.headers["X-DB-Time-Ms"] = f"{stats.db_time * 1000:.2f}"
+    response.headers["X-DB-Queries"] = str(stats.queries)
+    return response
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+async def cached_read(request: Request, token: str, user_id: str | None, read):
+    # One small query for the version of the data the response shows, then an ETag, a 304 or a cached
+    # body without running the read itself
+    if not response_cache.max_entries:
+        return await read()
+    data_version = await db_service.data_version(token, user_id)
+    if data_version is None:
+        return await read()
+    scope, version = data_version
+    window = response_cache.window()
+    etag = f'"{version}-{window}"'
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    key = (scope, version, window, request.url.path, request.url.query)
+    cached = response_cache.get(key)
+    if cached is not None:
+        body, headers = cached
+        return Response(body, media_type="application/json", headers=headers)
+    res = await read()
+    if isinstance(res, Response):
+        res.headers["ETag"] = etag
+        headers = {name: value for name, value in res.headers.items() if name not in ("content-length", "content-type")}
+        response_cache.put(key, res.body, headers)
+    return res
+
+
+@app.get("/health/live")
+async def live(response: Response) -> dict:
+    # Only fails once startup gave up on the database, so restarting the worker is the next step
+    if startup.failed:
+        response.status_code = 503
+    return startup.stats()
+
+
+@app.get("/health/ready")
+async def ready(response: Response) -> dict:
+    res = startup.stats()
+    if startup.ready:
+        res.update(await db_service.is_alive())
+    if not res.get("is_alive"):
+        response.status_code = 503
+    return res
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> str:
+    return instrumentation.render()
 
 
 """
@@ -32,24 +306,34 @@ async def root() -> dict:
 
 
 @app.get("/users")
-async def get_users(token: str) -> list[User] | dict:
-    res = db_service.get_users(token)
+async def get_users(
+    token: str,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    after: str | None = None,
+) -> list[User] | dict:
+    res = await db_service.get_users(token, limit, after)
     if type(res) is list:
-        return res
+        headers = {"X-Next-Cursor": user_cursor(res[-1])} if len(res) == limit else None
+        return FastJSONResponse(res, headers=headers)
     return {"error": res}
 
 
 @app.get("/users/{user_id}")
-async def get_user(user_id: str, token: str) -> User | dict:
-    res = db_service.get_user(user_id, token)
-    if type(res) is User:
-        return res
-    return {"error": res}
+async def get_user(user_id: str, token: str, request: Request) -> User | dict:
+    async def read():
+        res = await db_service.get_user(user_id, token)
+        if type(res) is User:
+            return FastJSONResponse(res)
+        return {"error": res}
+
+    if token != root_token:
+        return await read()
+    return await cached_read(request, token, user_id, read)
 
 
 @app.post("/users/get_token")
 async def get_token(user: UserLogin) -> dict:
-    res = db_service.get_token(user)
+    res = await db_service.get_token(user)
     if res:
         return {"token": res}
     return {"error": "Invalid credentials"}
@@ -57,23 +341,33 @@ async def get_token(user: UserLogin) -> dict:
 
 @app.post("/users")
 async def create_user(user: UserLogin) -> User | dict:
-    res = db_service.create_user(user)
+    res = await db_service.create_user(user)
     if type(res) is User:
         return res
     return {"error": res}
 
 
 @app.delete("/users/{user_id}")
-async def delete_user(user_id: str, token: str) -> User | dict:
-    res = db_service.delete_user(user_id, token)
-    if res == True:
-        return {"message": "User deleted"}
+async def delete_user(user_id: str, token: str) -> dict:
+    # The user's tasks go in batches in the background, follow the job on GET /jobs/{id}
+    res = await db_service.purge_user(user_id, token, PURGE_BATCH_SIZE)
+    if type(res) is str:
+        return {"error": res}
+    job = await jobs.start("delete_user", user_id, res)
+    return FastJSONResponse({"message": "User deletion started", "job": job}, status_code=202)
+
+
+@app.get("/users/{user_id}/stats")
+async def get_user_stats(user_id: str, token: str) -> TaskStats | dict:
+    res = await db_service.get_stats(token, user_id)
+    if type(res) is TaskStats:
+        return FastJSONResponse(res)
     return {"error": res}
 
 
 @app.put("/users/{user_id}")
 async def update_user(user_id: str, token: str, user: UserLogin) -> UserLogin | dict:
-    res = db_service.update_user(user_id, token, user)
+    res = await db_service.update_user(user_id, token, user)
     if type(res) is UserLogin:
         return res
     return {"error": res}
@@ -85,24 +379,103 @@ async def update_user(user_id: str, token: str, user: UserLogin) -> UserLogin |
 
 
 @app.get("/tasks")
-async def get_tasks(token: str) -> list[Task] | dict:
-    res = db_service.get_tasks(token)
+async def get_tasks(
+    token: str,
+    request: Request,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    after: str | None = None,
+    is_checked: bool | None = None,
+    is_important: bool | None = None,
+    updated_since: datetime | None = None,
+    order: Literal["asc", "desc"] = "asc",
+) -> list[Task] | dict:
+    query = TaskQuery(
+        limit=limit,
+        after=after,
+        is_checked=is_checked,
+        is_important=is_important,
+        updated_since=updated_since,
+        order=order,
+    )
+
+    async def read():
+        res = await db_service.get_tasks(token, query)
+        if type(res) is list:
+            headers = {"X-Next-Cursor": task_cursor(res[-1])} if len(res) == limit else None
+            return FastJSONResponse(res, headers=headers)
+        return {"error": res}
+
+    # A token is only tied to its user without a query once it is in the token cache
+    return await cached_read(request, token, None, read)
+
+
+@app.post("/tasks/bulk")
+async def bulk_tasks(operations: list[TaskOperation], token: str) -> list[TaskOperationResult] | dict:
+    if len(operations) > MAX_OPERATIONS:
+        return {"error": f"Too many operations, the limit is {MAX_OPERATIONS}"}
+    res = await db_service.bulk_tasks(operations, token)
     if type(res) is list:
         return res
     return {"error": res}
 
 
+@app.get("/tasks/sync")
+async def sync_tasks(
+    token: str,
+    since: str | None = None,
+    limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+) -> TaskSync | dict:
+    res = await db_service.sync_tasks(token, since, limit)
+    if type(res) is TaskSync:
+        return FastJSONResponse(res)
+    return {"error": res}
+
+
+@app.get("/tasks/search")
+async def search_tasks(
+    token: str,
+    q: str,
+    request: Request,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    after: str | None = None,
+) -> TaskSearch | dict:
+    async def read():
+        res = await db_service.search_tasks(token, q, limit, after)
+        if type(res) is TaskSearch:
+            return FastJSONResponse(res)
+        return {"error": res}
+
+    # Repeated searches between writes are answered from the response cache like GET /tasks
+    return await cached_read(request, token, None, read)
+
+
+@app.get("/tasks/stats")
+async def get_stats(token: str) -> TaskStats | dict:
+    res = await db_service.get_stats(token)
+    if type(res) is TaskStats:
+        return FastJSONResponse(res)
+    return {"error": res}
+
+
+@app.post("/tasks/stats/recompute")
+async def recompute_stats(token: str) -> TaskStats | dict:
+    res = await db_service.recompute_stats(token)
+    if type(res) is TaskStats:
+        return FastJSONResponse(res)
+    return {"error": res}
+
+
 @app.get("/tasks/{task_id}")
 async def get_task(task_id: UUID, token: str) -> Task | dict:
-    res = db_service.get_task(task_id, token)
+    res = await db_service.get_task(task_id, token)
     if type(res) is Task:
-        return res
+        return FastJSONResponse(res)
     return {"error": res}
 
 
 @app.post("/tasks")
 async def create_task(task: TaskCreate, token: str) -> Task | dict:
-    res = db_service.create_task(task, token)
+    res = await db_service.create_task(task, token)
     if type(res) is Task:
         return res
     return {"error": res}
@@ -110,7 +483,7 @@ async def create_task(task: TaskCreate, token: str) -> Task | dict:
 
 @app.delete("/tasks/{task_id}")
 async def delete_task(task_id: UUID, token: str) -> Task | dict:
-    res = db_service.delete_task(task_id, token)
+    res = await db_service.delete_task(task_id, token)
     if res == True:
         return {"message": "Task deleted"}
     return {"error": res}
@@ -118,12 +491,38 @@ async def delete_task(task_id: UUID, token: str) -> Task | dict:
 
 @app.put("/tasks/{task_id}")
 async def update_task(task_id: UUID, token: str, task: TaskCreate) -> Task | dict:
-    res = db_service.update_task(task_id, token, task)
+    res = await db_service.update_task(task_id, token, task)
     if type(res) is Task:
         return res
     return {"error": res}
 
 
+"""
+    Export (newline delimited JSON, streamed)
+"""
+
+
+def ndjson_response(rows, gzip: bool) -> StreamingResponse:
+    headers = {"Content-Encoding": "gzip"} if gzip else {}
+    return StreamingResponse(ndjson_chunks(rows, gzip), media_type="application/x-ndjson", headers=headers)
+
+
+@app.get("/export/users", response_model=None)
+async def export_users(token: str, gzip: bool = False) -> StreamingResponse | dict:
+    res = db_service.export_users(token)
+    if type(res) is str:
+        return {"error": res}
+    return ndjson_response(res, gzip)
+
+
+@app.get("/export/tasks", response_model=None)
+async def export_tasks(token: str, gzip: bool = False) -> StreamingResponse | dict:
+    res = db_service.export_tasks(token)
+    if type(res) is str:
+        return {"error": res}
+    return ndjson_response(res, gzip)
+
+
 """
     BUSTER CALL (delete everything)
 """
@@ -131,7 +530,30 @@ async def update_task(task_id: UUID, token: str, task: TaskCreate) -> Task | dic
 
 @app.delete("/buster_call")
 async def buster_call(token: str) -> dict:
-    res = db_service.delete_data(token)
-    if res:
-        return {"message": "All data deleted"}
-    return {"error": "Unauthorized"}
+    res = await db_service.purge_data(token, PURGE_BATCH_SIZE)
+    if type(res) is str:
+        return {"error": res}
+    job = await jobs.start("delete_data", None, res)
+    return FastJSONResponse({"message": "Data deletion started", "job": job}, status_code=202)
+
+
+"""
+    Jobs (background deletions, kept in the database so every worker sees them)
+"""
+
+
+@app.get("/jobs")
+async def get_jobs(token: str) -> list[Job] | dict:
+    if token != root_token:
+        return {"error": "Unauthorized"}
+    return FastJSONResponse(await jobs.list())
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: UUID, token: str) -> Job | dict:
+    if token != root_token:
+        return {"error": "Unauthorized"}
+    job = await jobs.get(job_id)
+    if job is None:
+        return {"error": "Job not found"}
+    return FastJSONResponse(job)
@@ -0,0 +1,48 @@
+# Copies every user and task from one database to another, keeping ids, tokens and timestamps:
+#   python -m src.migrate mongo mariadb [--source-location mongo:27017] [--target-location mariadb] [--verify]
+# Connection settings come from the same environment as the app. Run it again with the same --checkpoint
+# to resume an interrupted copy. For a cutover without downtime: start the app with DB_MIRROR set to the
+# target, run this with --verify, then --repair until it reports ok, switch DB_MANAGER and drop DB_MIRROR.
+# Sync tokens don't carry over, clients sync from scratch after the switch.
+import argparse
+import json
+import sys
+
+from dotenv import load_dotenv
+
+from src.services.factory import DB_MANAGERS, create_backend
+from src.services.migration import Migration
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m src.migrate", description="Copy users and tasks between databases")
+    parser.add_argument("source", choices=DB_MANAGERS)
+    parser.add_argument("target", choices=DB_MANAGERS)
+    parser.add_argument("--source-location", help="Mongo host:port, MariaDB host[:port] or SQLite path")
+    parser.add_argument("--target-location", help="Mongo host:port, MariaDB host[:port] or SQLite path")
+    parser.add_argument("--checkpoint", default="migration.json", help="progress file, resumed from when it exists")
+    parser.add_argument("--ranges", type=int, default=64, help="slices of the id space")
+    parser.add_argument("--workers", type=int, default=8, help="slices copied at the same time")
+    parser.add_argument("--batch-size", type=int, default=5000, help="rows per read and write")
+    parser.add_argument("--verify", action="store_true", help="compare both databases after copying")
+    parser.add_argument("--verify-only", action="store_true", help="compare without copying")
+    parser.add_argument("--repair", action="store_true", help="compare without copying and fix what differs")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    source = create_backend(args.source, args.source_location)
+    target = create_backend(args.target, args.target_location)
+    source.init_db()
+    target.init_db()
+    migration = Migration(source, target, args.checkpoint, ranges=args.ranges, workers=args.workers, batch_size=args.batch_size)
+    if not (args.verify_only or args.repair):
+        print(json.dumps(migration.run()))
+    if args.verify or args.verify_only or args.repair:
+        report = migration.verify(repair=args.repair)
+        print(json.dumps(report))
+        return 0 if report["ok"] else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
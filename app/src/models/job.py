@@ -0,0 +1,17 @@
+from typing import Literal
+from uuid import UUID
+
+from pydantic import BaseModel
+
+
+class Job(BaseModel):
+    id: UUID
+    kind: str
+    target: str | None = None
+    status: Literal["running", "done", "failed", "cancelled"] = "running"
+    total: int = 0
+    deleted: int = 0
+    batches: int = 0
+    started_at: str
+    finished_at: str | None = None
+    error: str | None = None
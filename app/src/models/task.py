@@ -1,6 +1,9 @@
-from pydantic import BaseModel
+from datetime import datetime
+from typing import Literal
 from uuid import UUID
 
+from pydantic import BaseModel
+
 
 class Task(BaseModel):
     id: UUID
@@ -16,3 +19,45 @@ class TaskCreate(BaseModel):
     text: str
     is_checked: bool = False
     is_important: bool = False
+
+
+class TaskQuery(BaseModel):
+    limit: int | None = None
+    after: str | None = None
+    is_checked: bool | None = None
+    is_important: bool | None = None
+    updated_since: datetime | None = None
+    order: Literal["asc", "desc"] = "asc"
+
+
+class TaskOperation(BaseModel):
+    op: Literal["create", "update", "delete"]
+    id: UUID | None = None
+    task: TaskCreate | None = None
+
+
+class TaskOperationResult(BaseModel):
+    op: str
+    id: UUID | None = None
+    task: Task | None = None
+    error: str | None = None
+
+
+class TaskSync(BaseModel):
+    changes: list[Task]
+    deleted: list[UUID]
+    next: str
+    has_more: bool
+
+
+class TaskStats(BaseModel):
+    user_id: str | None = None
+    total: int
+    checked: int
+    important: int
+    last_updated_at: str | None = None
+
+
+class TaskSearch(BaseModel):
+    tasks: list[Task]
+    next: str | None = None
@@ -0,0 +1,127 @@
+import asyncio
+import itertools
+import math
+import time
+
+# Admission classes, lower priority values are served first when requests wait for a slot
+POINT = "point"
+DEFAULT = "default"
+SCAN = "scan"
+PRIORITIES = {POINT: 0, DEFAULT: 1, SCAN: 2}
+
+
+class Overloaded(Exception):
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class Waiter:
+    def __init__(self, kind: str, seq: int, deadline: float):
+        self.kind = kind
+        self.priority = PRIORITIES[kind]
+        self.seq = seq
+        self.deadline = deadline
+        self.future = asyncio.get_running_loop().create_future()
+
+
+# Caps the requests working on the database at once, per worker. Over the cap requests wait in a bounded
+# queue, cheapest class first. One that can't expect a slot before max_wait is turned away straight
+# away, and when the queue is full a newcomer takes the place of the most expensive waiter behind it.
+# Everything runs on the event loop, so none of it needs a lock.
+class AdmissionControl:
+    def __init__(self, capacity: int, limits: dict[str, int] | None = None, max_queue: int = 256, max_wait: float = 1.0):
+        self.capacity = capacity
+        # Per class caps within capacity, scans alone can't take every slot
+        self.limits = {kind: capacity for kind in PRIORITIES} | (limits or {})
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = {kind: 0 for kind in PRIORITIES}
+        # Moving average of how long each class holds a slot, for the wait estimate
+        self.hold_time = {kind: 0.01 for kind in PRIORITIES}
+        self._queue: list[Waiter] = []
+        self._seq = itertools.count()
+        self.counts = {(kind, outcome): 0 for kind in PRIORITIES for outcome in ("admitted", "queued", "rejected", "shed", "timed_out")}
+
+    def _can_start(self, kind: str) -> bool:
+        return sum(self.active.values()) < self.capacity and self.active[kind] < self.limits[kind]
+
+    def _expected_wait(self, priority: int) -> float:
+        # The slot time of everyone served before it, spread over all slots
+        ahead = sum(self.hold_time[waiter.kind] for waiter in self._queue if waiter.priority <= priority)
+        return ahead / self.capacity
+
+    def _reject(self, kind: str, outcome: str, retry_after: float) -> Overloaded:
+        self.counts[kind, outcome] += 1
+        return Overloaded(retry_after)
+
+    async def acquire(self, kind: str) -> float:
+        # Returns when the request may start, for release(). Raises Overloaded when it shouldn't wait.
+        if not self._queue and self._can_start(kind):
+            return self._start(kind)
+        priority = PRIORITIES[kind]
+        expected = self._expected_wait(priority)
+        if expected > self.max_wait:
+            raise self._reject(kind, "rejected", expected)
+        if len(self._queue) >= self.max_queue:
+            worst = max(self._queue, key=lambda waiter: (waiter.priority, waiter.seq))
+            if worst.priority <= priority:
+                raise self._reject(kind, "rejected", expected)
+            self._queue.remove(worst)
+            worst.future.set_exception(self._reject(worst.kind, "shed", self._expected_wait(worst.priority)))
+        waiter = Waiter(kind, next(self._seq), time.monotonic() + self.max_wait)
+        self._queue.append(waiter)
+        self.counts[kind, "queued"] += 1
+        # Only the capped classes may be waiting, a slot could be free for this one
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.max_wait)
+        except asyncio.TimeoutError:
+            if waiter in self._queue:
+                self._queue.remove(waiter)
+                raise self._reject(kind, "timed_out", self._expected_wait(priority))
+            # Granted or turned away just as the wait ran out, the future says which
+        except asyncio.CancelledError:
+            # The client went away while waiting
+            if waiter in self._queue:
+                self._queue.remove(waiter)
+            elif waiter.future.done() and not waiter.future.exception():
+                self.release(kind, waiter.future.result())
+            raise
+        return waiter.future.result()
+
+    def _start(self, kind: str) -> float:
+        self.active[kind] += 1
+        self.counts[kind, "admitted"] += 1
+        return time.monotonic()
+
+    def release(self, kind: str, started: float):
+        self.active[kind] -= 1
+        self.hold_time[kind] = 0.9 * self.hold_time[kind] + 0.1 * (time.monotonic() - started)
+        self._dispatch()
+
+    def _dispatch(self):
+        now = time.monotonic()
+        while self._queue:
+            ready = [waiter for waiter in self._queue if self._can_start(waiter.kind)]
+            if not ready:
+                return
+            waiter = min(ready, key=lambda waiter: (waiter.priority, waiter.seq))
+            self._queue.remove(waiter)
+            if waiter.deadline < now:
+                # Its own timeout is about to fire, a slot now would be wasted on it
+                waiter.future.set_exception(self._reject(waiter.kind, "timed_out", self._expected_wait(waiter.priority)))
+                continue
+            waiter.future.set_result(self._start(waiter.kind))
+
+    def stats(self) -> dict:
+        stats = {"capacity": self.capacity, "queue_depth": len(self._queue), "active": sum(self.active.values())}
+        for kind in PRIORITIES:
+            stats[f"{kind}_active"] = self.active[kind]
+            stats[f"{kind}_queued_now"] = sum(waiter.kind == kind for waiter in self._queue)
+        for (kind, outcome), value in self.counts.items():
+            stats[f"{kind}_{outcome}"] = value
+        return stats
@@ -0,0 +1,140 @@
+import asyncio
+import contextvars
+from collections.abc import Iterator
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from uuid import UUID
+
+from src.models.job import Job
+from src.models.task import Task, TaskCreate, TaskOperation, TaskOperationResult, TaskQuery, TaskSearch, TaskStats, TaskSync
+from src.models.user import User, UserLogin
+from src.services.backend import StorageBackend
+from src.services.write_buffer import WriteBuffer
+
+
+# The drivers are blocking, run them on a bounded thread pool so handlers don't stall the event loop
+class AsyncDBService:
+    def __init__(
+        self,
+        service: StorageBackend,
+        max_workers: int = 16,
+        write_buffer_size: int = 0,
+        write_buffer_delay: float = 0.005,
+    ):
+        self.service = service
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db")
+        # Group commit for create_task: waiting callers hold no worker thread, only the flushes do
+        self.write_buffer = None
+        if write_buffer_size > 1:
+            self.write_buffer = WriteBuffer(self.create_tasks, write_buffer_size, write_buffer_delay)
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        # run_in_executor doesn't carry contextvars over, the per-request query stats live in one
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.executor, partial(context.run, fn, *args))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    async def init_db(self):
+        return await self._run(self.service.init_db)
+
+    async def is_alive(self) -> dict:
+        return await self._run(self.service.is_alive)
+
+    async def get_users(self, token: str, limit: int | None = None, after: str | None = None) -> list[User] | str:
+        return await self._run(self.service.get_users, token, limit, after)
+
+    async def get_user(self, user_id: str, token: str) -> User | str:
+        return await self._run(self.service.get_user, user_id, token)
+
+    async def get_token(self, user: UserLogin) -> str | None:
+        return await self._run(self.service.get_token, user)
+
+    async def create_user(self, user: UserLogin) -> User | str:
+        return await self._run(self.service.create_user, user)
+
+    async def delete_user(self, user_id: str, token: str) -> bool | str:
+        return await self._run(self.service.delete_user, user_id, token)
+
+    async def update_user(self, user_id: str, token: str, user: UserLogin) -> UserLogin | str:
+        return await self._run(self.service.update_user, user_id, token, user)
+
+    # Nothing is read until the caller iterates, so there is nothing to offload here.
+    # StreamingResponse already pulls sync iterators from a worker thread.
+    def export_users(self, token: str) -> Iterator[dict] | str:
+        return self.service.export_users(token)
+
+    def export_tasks(self, token: str) -> Iterator[dict] | str:
+        return self.service.export_tasks(token)
+
+    async def get_tasks(self, token: str, query: TaskQuery | None = None) -> list[dict] | str:
+        return await self._run(self.service.get_tasks, token, query)
+
+    async def get_task(self, task_id: UUID, token: str) -> Task | str:
+        return await self._run(self.service.get_task, task_id, token)
+
+    async def create_task(self, task: TaskCreate, token: str) -> Task | str:
+        if self.write_buffer is not None:
+            return await self.write_buffer.submit((task, token))
+        return await self._run(self.service.create_task, task, token)
+
+    async def create_tasks(self, requests: list[tuple[TaskCreate, str]]) -> list[Task | str]:
+        return await self._run(self.service.create_tasks, requests)
+
+    async def delete_task(self, task_id: UUID, token: str) -> bool | str:
+        return await self._run(self.service.delete_task, task_id, token)
+
+    async def update_task(self, task_id: UUID, token: str, task: TaskCreate) -> Task | str:
+        return await self._run(self.service.update_task, task_id, token, task)
+
+    async def bulk_tasks(self, operations: list[TaskOperation], token: str) -> list[TaskOperationResult] | str:
+        return await self._run(self.service.bulk_tasks, operations, token)
+
+    async def sync_tasks(self, token: str, since: str | None = None, limit: int = 1000) -> TaskSync | str:
+        return await self._run(self.service.sync_tasks, token, since, limit)
+
+    async def prune_tombstones(self, deleted_before: datetime) -> int:
+        return await self._run(self.service.prune_tombstones, deleted_before)
+
+    async def search_tasks(self, token: str, q: str, limit: int = 100, after: str | None = None) -> TaskSearch | str:
+        return await self._run(self.service.search_tasks, token, q, limit, after)
+
+    async def get_stats(self, token: str, user_id: str | None = None) -> TaskStats | str:
+        return await self._run(self.service.get_stats, token, user_id)
+
+    async def data_version(self, token: str, user_id: str | None = None) -> tuple[str, str] | None:
+        return await self._run(self.service.data_version, token, user_id)
+
+    async def recompute_stats(self, token: str) -> TaskStats | str:
+        return await self._run(self.service.recompute_stats, token)
+
+    async def delete_data(self, token: str) -> bool:
+        return await self._run(self.service.delete_data, token)
+
+    async def purge_user(self, user_id: str, token: str, batch_size: int = 1000) -> Iterator[int] | str:
+        return await self._run(self.service.purge_user, user_id, token, batch_size)
+
+    async def purge_data(self, token: str, batch_size: int = 1000) -> Iterator[int] | str:
+        return await self._run(self.service.purge_data, token, batch_size)
+
+    async def claim_job(self, job: Job, stale_before: datetime) -> Job:
+        return await self._run(self.service.claim_job, job, stale_before)
+
+    async def save_job(self, job: Job) -> bool:
+        return await self._run(self.service.save_job, job)
+
+    async def get_job(self, job_id: UUID) -> Job | None:
+        return await self._run(self.service.get_job, job_id)
+
+    async def list_jobs(self, limit: int = 100) -> list[Job]:
+        return await self._run(self.service.list_jobs, limit)
+
+    async def prune_jobs(self, finished_before: datetime):
+        return await self._run(self.service.prune_jobs, finished_before)
+
+    async def step(self, batches: Iterator):
+        # Advances one of the iterators above, None once it is exhausted
+        return await self._run(next, batches, None)
@@ -0,0 +1,110 @@
+from collections.abc import Iterator
+from datetime import datetime
+from typing import Protocol
+from uuid import UUID
+
+from src.models.job import Job
+from src.models.task import Task, TaskCreate, TaskOperation, TaskOperationResult, TaskQuery, TaskSearch, TaskStats, TaskSync
+from src.models.user import User, UserLogin
+from src.services.cache import TokenCache, Versions
+from src.services.instrumentation import Instrumentation
+
+root_token = "root"
+
+
+# Errors come back as strings, the HTTP layer turns them into {"error": ...}
+class StorageBackend(Protocol):
+    name: str
+    token_cache: TokenCache
+    versions: Versions
+    instrumentation: Instrumentation
+
+    # Connects and brings the schema up to date, nothing touches the database before it runs
+    def init_db(self, force: bool = False): ...
+
+    def is_alive(self) -> dict: ...
+
+    def get_users(self, token: str, limit: int | None = None, after: str | None = None) -> list[User] | str: ...
+
+    def get_user(self, user_id: str, token: str) -> User | str: ...
+
+    def get_token(self, user: UserLogin) -> str | None: ...
+
+    def create_user(self, user: UserLogin) -> User | str: ...
+
+    def delete_user(self, user_id: str, token: str) -> bool | str: ...
+
+    def update_user(self, user_id: str, token: str, user: UserLogin) -> UserLogin | str: ...
+
+    def export_users(self, token: str) -> Iterator[dict] | str: ...
+
+    def export_tasks(self, token: str) -> Iterator[dict] | str: ...
+
+    # Up to limit rows, as export_* streams them, with uuid (users) or id (tasks) in [start, end), in that order
+    def scan_users(self, token: str, start: UUID | None, end: UUID | None, limit: int = 1000) -> list[dict] | str: ...
+
+    def scan_tasks(self, token: str, start: UUID | None, end: UUID | None, limit: int = 1000) -> list[dict] | str: ...
+
+    # Upserts rows read by scan_* from any backend, keeping their ids, tokens and timestamps
+    def import_users(self, token: str, users: list[dict]) -> int | str: ...
+
+    def import_tasks(self, token: str, tasks: list[dict]) -> int | str: ...
+
+    # Lists and syncs hand back a Task's fields as plain dicts: building models was most of their CPU time
+    def get_tasks(self, token: str, query: TaskQuery | None = None) -> list[dict] | str: ...
+
+    def get_task(self, task_id: UUID, token: str) -> Task | str: ...
+
+    def create_task(self, task: TaskCreate, token: str) -> Task | str: ...
+
+    # Many create_task calls, possibly with different tokens, committed together
+    def create_tasks(self, requests: list[tuple[TaskCreate, str]]) -> list[Task | str]: ...
+
+    def delete_task(self, task_id: UUID, token: str) -> bool | str: ...
+
+    def update_task(self, task_id: UUID, token: str, task: TaskCreate) -> Task | str: ...
+
+    def bulk_tasks(self, operations: list[TaskOperation], token: str) -> list[TaskOperationResult] | str: ...
+
+    # Tasks created, updated or deleted since the change token a previous sync handed out
+    def sync_tasks(self, token: str, since: str | None = None, limit: int = 1000) -> TaskSync | str: ...
+
+    # Deletes the tombstones of tasks deleted before deleted_before and returns how many. Syncs from a token
+    # older than the newest of them are refused from then on, the client has to sync from scratch.
+    def prune_tombstones(self, deleted_before: datetime) -> int: ...
+
+    # Tasks whose text matches any of the words in q, best match first
+    def search_tasks(self, token: str, q: str, limit: int = 100, after: str | None = None) -> TaskSearch | str: ...
+
+    # Counts for every task with the root token, for the token's own tasks otherwise, or for user_id's (root only)
+    def get_stats(self, token: str, user_id: str | None = None) -> TaskStats | str: ...
+
+    # The user a cached read shows ("*" for root's reads over every user, user_id for root's reads of one)
+    # and a version of their data that changes with every write to it, None when there's nothing to cache
+    def data_version(self, token: str, user_id: str | None = None) -> tuple[str, str] | None: ...
+
+    # Rebuilds the counters get_stats reads from the tasks themselves
+    def recompute_stats(self, token: str) -> TaskStats | str: ...
+
+    def delete_data(self, token: str) -> bool: ...
+
+    # Batched versions of delete_user and delete_data for background jobs. The iterator first yields the
+    # number of rows it expects to delete, then how many each batch deleted, holding no connection in between.
+    def purge_user(self, user_id: str, token: str, batch_size: int = 1000) -> Iterator[int] | str: ...
+
+    def purge_data(self, token: str, batch_size: int = 1000) -> Iterator[int] | str: ...
+
+    # Background job records, shared by every worker. claim_job records job as running unless one of the
+    # same kind and target already runs, taking over one last saved before stale_before, and returns
+    # whichever runs. save_job returns False once the job was taken over.
+    def claim_job(self, job: Job, stale_before: datetime) -> Job: ...
+
+    def save_job(self, job: Job) -> bool: ...
+
+    def get_job(self, job_id: UUID) -> Job | None: ...
+
+    # Newest first
+    def list_jobs(self, limit: int = 100) -> list[Job]: ...
+
+    # Deletes the jobs that finished before finished_before
+    def prune_jobs(self, finished_before: datetime): ...
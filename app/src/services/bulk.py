@@ -0,0 +1,24 @@
+from src.models.task import TaskOperation
+
+
+MAX_OPERATIONS = 10000
+
+
+def validate_operations(operations: list[TaskOperation]) -> list[str | None]:
+    errors = []
+    seen = set()
+    for operation in operations:
+        if operation.op == "create":
+            error = None if operation.task else "Missing task"
+        elif operation.id is None:
+            error = "Missing id"
+        elif operation.op == "update" and operation.task is None:
+            error = "Missing task"
+        elif operation.id in seen:
+            # Writes are grouped by kind, so two operations on one task would not apply in order
+            error = "Duplicate task id"
+        else:
+            seen.add(operation.id)
+            error = None
+        errors.append(error)
+    return errors
@@ -0,0 +1,173 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenCache:
+    def __init__(self, max_entries: int = 10000, ttl: float = 60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # token -> (user_id, expires_at), oldest first
+        self._entries = OrderedDict()
+        self._tokens_by_user = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, token: str) -> str | None:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    self._remove(token)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return entry[0]
+
+    def peek(self, token: str) -> str | None:
+        # get() without counting towards the hit rate or the LRU order
+        entry = self._entries.get(token)
+        if entry is None or entry[1] < time.monotonic():
+            return None
+        return entry[0]
+
+    def put(self, token: str, user_id: str, generation: int):
+        if not self.max_entries:
+            return
+        with self._lock:
+            # Something was invalidated while the caller was reading, its value may be stale
+            if generation != self._generation:
+                return
+            if token in self._entries:
+                self._remove(token)
+            self._entries[token] = (user_id, time.monotonic() + self.ttl)
+            self._tokens_by_user.setdefault(user_id, set()).add(token)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, token: str):
+        user_id, _ = self._entries.pop(token)
+        tokens = self._tokens_by_user.get(user_id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[user_id]
+
+    def invalidate_user(self, user_id: str):
+        with self._lock:
+            self._generation += 1
+            for token in self._tokens_by_user.pop(user_id, ()):
+                self._entries.pop(token, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._tokens_by_user.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class Versions:
+    # When each user was last written, for reads that must see their own writes. Per process: a write
+    # through another worker isn't known here. Cached responses are keyed on data_version instead.
+    def __init__(self, max_users: int = 100000):
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        # user_id -> when it was last bumped, least recently bumped first
+        self._written_at = OrderedDict()
+        self._last_write = float("-inf")
+        self._all_written_at = float("-inf")
+
+    def bump(self, *user_ids: str):
+        with self._lock:
+            now = time.monotonic()
+            for user_id in user_ids:
+                self._written_at[user_id] = now
+                self._written_at.move_to_end(user_id)
+            if user_ids:
+                self._last_write = now
+            while len(self._written_at) > self.max_users:
+                self._written_at.popitem(last=False)
+
+    def bump_all(self):
+        with self._lock:
+            self._written_at.clear()
+            self._last_write = self._all_written_at = time.monotonic()
+
+    def written_within(self, user_id: str | None, seconds: float) -> bool:
+        # user_id None asks about any user
+        if user_id is None:
+            written_at = self._last_write
+        else:
+            written_at = max(self._written_at.get(user_id, float("-inf")), self._all_written_at)
+        return time.monotonic() - written_at < seconds
+
+
+class ResponseCache:
+    # Serialized response bodies keyed by (scope, version, window, ...), stale versions age out as LRU.
+    # With a ttl, keys also change every ttl seconds, for bodies read from a replica behind the version.
+    def __init__(self, max_entries: int = 1000, max_bytes: int = 64 * 1024 * 1024, ttl: float = 0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def window(self) -> int:
+        return int(time.monotonic() // self.ttl) if self.ttl else 0
+
+    def get(self, key: tuple) -> tuple[bytes, dict] | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: tuple, body: bytes, headers: dict):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous[0])
+            self._entries[key] = (body, headers)
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
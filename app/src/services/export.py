@@ -0,0 +1,24 @@
+import zlib
+from collections.abc import Iterable, Iterator
+
+from src.services.serialization import dumps
+
+CHUNK_SIZE = 64 * 1024
+# Rows fetched from the database per round trip while streaming
+BATCH_SIZE = 1000
+
+
+def ndjson_chunks(rows: Iterable[dict], gzip: bool = False) -> Iterator[bytes]:
+    # Rows are buffered into ~64KB chunks so each write to the socket carries many of them
+    compressor = zlib.compressobj(wbits=31) if gzip else None
+    buffer = bytearray()
+    for row in rows:
+        buffer += dumps(row)
+        buffer += b"\n"
+        if len(buffer) >= CHUNK_SIZE:
+            yield compressor.compress(bytes(buffer)) if compressor else bytes(buffer)
+            buffer.clear()
+    if compressor:
+        yield compressor.compress(bytes(buffer)) + compressor.flush()
+    elif buffer:
+        yield bytes(buffer)
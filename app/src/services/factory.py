@@ -0,0 +1,139 @@
+import os
+from functools import partial
+from uuid import uuid4
+
+from src.services.backend import StorageBackend
+from src.services.cache import TokenCache, Versions
+from src.services.instrumentation import Instrumentation
+
+DB_MANAGERS = ("mongo", "mariadb", "sqlite")
+
+
+def create_service(
+    db_manager: str | None,
+    token_cache: TokenCache | None = None,
+    instrumentation: Instrumentation | None = None,
+    versions: Versions | None = None,
+) -> StorageBackend:
+    # DB_SHARDS lists one MariaDB host[:port], Mongo host:port or SQLite path per shard.
+    # DB_REPLICAS lists MariaDB read replicas as host[:port], with ; between the shards' lists.
+    shards = os.getenv("DB_SHARDS")
+    replicas = os.getenv("DB_REPLICAS", "").split(";")
+    if not shards:
+        return with_mirror(create_backend(db_manager, None, token_cache, instrumentation, versions, replicas=replicas[0]))
+    from src.services.sharded_service import ShardedService, shard_uuid
+
+    # Shared by every shard: tokens and user ids are unique across all of them
+    token_cache = token_cache or TokenCache()
+    instrumentation = instrumentation or Instrumentation()
+    versions = versions or Versions()
+    return ShardedService(
+        [
+            with_mirror(
+                create_backend(
+                    db_manager,
+                    location.strip(),
+                    token_cache,
+                    instrumentation,
+                    versions,
+                    new_id=partial(shard_uuid, shard),
+                    replicas=replicas[shard] if shard < len(replicas) else "",
+                    suffix=f"_shard{shard}",
+                ),
+                shard,
+            )
+            for shard, location in enumerate(shards.split(","))
+        ],
+        token_cache,
+        instrumentation,
+        versions,
+    )
+
+
+def with_mirror(service: StorageBackend, shard: int = 0) -> StorageBackend:
+    # DB_MIRROR names a second DB_MANAGER that every write is repeated on while moving to it, and
+    # DB_MIRROR_LOCATIONS its database like DB_SHARDS does, one per shard. Off unless DB_MIRROR is set.
+    db_mirror = os.getenv("DB_MIRROR")
+    if not db_mirror:
+        return service
+    from src.services.mirrored_service import MirroredService
+
+    locations = os.getenv("DB_MIRROR_LOCATIONS", "").split(",")
+    location = locations[shard].strip() if shard < len(locations) else ""
+    suffix = f"_mirror_shard{shard}" if os.getenv("DB_SHARDS") else "_mirror"
+    # Its own token cache and versions: it serves no reads, and its writes mustn't count as the primary's
+    mirror = create_backend(db_mirror, location or None, instrumentation=service.instrumentation, suffix=suffix)
+    mirrored = MirroredService(service, mirror)
+    service.instrumentation.add_gauges(suffix[1:], mirrored.stats)
+    return mirrored
+
+
+def create_backend(
+    db_manager: str | None,
+    location: str | None,
+    token_cache: TokenCache | None = None,
+    instrumentation: Instrumentation | None = None,
+    versions: Versions | None = None,
+    new_id=uuid4,
+    replicas: str = "",
+    suffix: str = "",
+) -> StorageBackend:
+    # Imported on demand so only the selected backend and its driver get loaded
+    if db_manager == "mongo":
+        from src.services.mongo_service import MongoService
+
+        return MongoService(
+            os.getenv("MONGO_USER"),
+            os.getenv("MONGO_PASS"),
+            location or "mongo:27017",
+            token_cache=token_cache,
+            instrumentation=instrumentation,
+            versions=versions,
+            new_id=new_id,
+            secondary_reads=os.getenv("MONGO_READ_PREFERENCE") == "secondaryPreferred",
+            max_staleness=float(os.getenv("MAX_REPLICA_LAG", 90)),
+            read_your_writes=float(os.getenv("READ_YOUR_WRITES_SECONDS", 5)),
+            sync_grace=float(os.getenv("SYNC_GRACE_SECONDS", 5)),
+        )
+    if db_manager == "mariadb":
+        from src.services.mariadb_service import MariaDBService
+
+        host, port = parse_host(location or "mariadb")
+        service = MariaDBService(
+            os.getenv("MARIADB_USER"),
+            os.getenv("MARIADB_PASS"),
+            os.getenv("MARIADB_DATABASE"),
+            host=host,
+            port=port,
+            pool_min=int(os.getenv("MARIADB_POOL_MIN", 1)),
+            pool_max=int(os.getenv("MARIADB_POOL_MAX", 10)),
+            pool_timeout=float(os.getenv("MARIADB_POOL_TIMEOUT", 5)),
+            pool_recycle=float(os.getenv("MARIADB_POOL_RECYCLE", 3600)),
+            token_cache=token_cache,
+            instrumentation=instrumentation,
+            versions=versions,
+            new_id=new_id,
+            replicas=[parse_host(replica.strip()) for replica in replicas.split(",") if replica.strip()],
+            max_replica_lag=float(os.getenv("MAX_REPLICA_LAG", 5)),
+            sync_grace=float(os.getenv("SYNC_GRACE_SECONDS", 5)),
+        )
+        service.instrumentation.add_gauges(f"db_pool{suffix}", service.pool.stats)
+        if service.replicas is not None:
+            service.instrumentation.add_gauges(f"db_replicas{suffix}", service.replicas.stats)
+        return service
+    if db_manager == "sqlite":
+        from src.services.sqlite_service import SQLiteService
+
+        return SQLiteService(
+            location or os.getenv("SQLITE_PATH", ":memory:"),
+            token_cache=token_cache,
+            instrumentation=instrumentation,
+            versions=versions,
+            new_id=new_id,
+        )
+    raise ValueError(f"Invalid DB_MANAGER: {db_manager}")
+
+
+def parse_host(location: str) -> tuple[str, int]:
+    host, _, port = location.partition(":")
+    return host, int(port or 3306)
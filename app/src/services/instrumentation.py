@@ -0,0 +1,179 @@
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from pymongo import monitoring
+
+logger = logging.getLogger("src.db.slow")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+ROUND_TRIP_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+
+@dataclass
+class RequestStats:
+    db_time: float = 0.0
+    queries: int = 0
+    rows: int = 0
+
+
+# Set by the HTTP middleware, shared with the worker threads that run the queries
+current_request: ContextVar[RequestStats | None] = ContextVar("current_request", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: str) -> list[str]:
+        lines, cumulative = [], 0
+        sep = "," if labels else ""
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def sql_shape(sql: str) -> str:
+    # Placeholder lists of any length (IN (...), VALUES) collapse into one shape
+    sql = re.sub(r"\s+", " ", sql).strip()
+    return re.sub(r"\(\s*%s(\s*,\s*%s)+\s*\)", "(...)", sql)
+
+
+class Instrumentation:
+    def __init__(self, slow_query_ms: float | None = None):
+        self.slow_query_ms = slow_query_ms
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._rows = {}
+        # By the server that answered, so a slow replica stands out from the rest
+        self._targets = {}
+        self._round_trips = Histogram(ROUND_TRIP_BUCKETS)
+        self._gauges = []
+
+    def record(self, backend: str, shape: str, seconds: float, rows: int, target: str = "primary"):
+        key = (backend, shape)
+        with self._lock:
+            histogram = self._latency.get(key)
+            if histogram is None:
+                histogram = self._latency[key] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(seconds)
+            self._rows[key] = self._rows.get(key, 0) + rows
+            histogram = self._targets.get((backend, target))
+            if histogram is None:
+                histogram = self._targets[(backend, target)] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(seconds)
+        stats = current_request.get()
+        if stats is not None:
+            stats.db_time += seconds
+            stats.queries += 1
+            stats.rows += rows
+        if self.slow_query_ms is not None and seconds * 1000 >= self.slow_query_ms:
+            logger.warning("slow query backend=%s time=%.1fms rows=%d: %s", backend, seconds * 1000, rows, shape)
+
+    def observe_request(self, stats: RequestStats):
+        with self._lock:
+            self._round_trips.observe(stats.queries)
+
+    def add_gauges(self, prefix: str, collect):
+        # collect() returns a dict of numeric stats, exported as {prefix}_{key}
+        self._gauges.append((prefix, collect))
+
+    def render(self) -> str:
+        lines = ["# TYPE db_query_duration_seconds histogram"]
+        with self._lock:
+            latency = sorted(self._latency.items())
+            for (backend, shape), histogram in latency:
+                labels = f'backend="{backend}",query="{_label(shape)}"'
+                lines.extend(histogram.render("db_query_duration_seconds", labels))
+            lines.append("# TYPE db_query_rows_total counter")
+            for (backend, shape), rows in sorted(self._rows.items()):
+                lines.append(f'db_query_rows_total{{backend="{backend}",query="{_label(shape)}"}} {rows}')
+            lines.append("# TYPE db_target_duration_seconds histogram")
+            for (backend, target), histogram in sorted(self._targets.items()):
+                labels = f'backend="{backend}",target="{_label(target)}"'
+                lines.extend(histogram.render("db_target_duration_seconds", labels))
+            lines.append("# TYPE http_request_db_round_trips histogram")
+            lines.extend(self._round_trips.render("http_request_db_round_trips", ""))
+        for prefix, collect in self._gauges:
+            for key, value in collect().items():
+                if isinstance(value, (int, float)):
+                    lines.append(f"# TYPE {prefix}_{key} gauge")
+                    lines.append(f"{prefix}_{key} {float(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class InstrumentedCursor:
+    def __init__(self, cursor, instrumentation: Instrumentation, backend: str = "mariadb", target: str = "primary"):
+        self._cursor = cursor
+        self._instrumentation = instrumentation
+        self._backend = backend
+        self._target = target
+
+    def execute(self, sql: str, params=()):
+        start = time.perf_counter()
+        try:
+            return self._cursor.execute(sql, params)
+        finally:
+            rows = max(self._cursor.rowcount, 0)
+            self._instrumentation.record(self._backend, sql_shape(sql), time.perf_counter() - start, rows, self._target)
+
+    def executemany(self, sql: str, params):
+        start = time.perf_counter()
+        try:
+            return self._cursor.executemany(sql, params)
+        finally:
+            self._instrumentation.record(
+                self._backend, sql_shape(sql), time.perf_counter() - start, len(params), self._target
+            )
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    # pymongo calls listeners synchronously on the thread that issued the command
+    def __init__(self, instrumentation: Instrumentation):
+        self._instrumentation = instrumentation
+        self._shapes = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        shape = f"{event.command_name} {collection}" if isinstance(collection, str) else event.command_name
+        self._shapes[(event.connection_id, event.request_id)] = shape
+
+    def _finish(self, event, rows: int):
+        shape = self._shapes.pop((event.connection_id, event.request_id), event.command_name)
+        host, port = event.connection_id
+        self._instrumentation.record("mongo", shape, event.duration_micros / 1_000_000, rows, f"{host}:{port}")
+
+    def succeeded(self, event):
+        reply = event.reply
+        cursor = reply.get("cursor")
+        if cursor is not None:
+            rows = len(cursor.get("firstBatch", cursor.get("nextBatch", ())))
+        else:
+            rows = reply.get("n", 0)
+        self._finish(event, rows)
+
+    def failed(self, event):
+        self._finish(event, 0)
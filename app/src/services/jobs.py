@@ -0,0 +1,120 @@
+import asyncio
+import contextvars
+import logging
+import time
+from collections import OrderedDict
+from collections.abc import Iterator
+from datetime import datetime, timedelta
+from uuid import UUID, uuid4
+
+from src.models.job import Job
+
+logger = logging.getLogger("src.jobs")
+
+# Error of a job whose worker stopped saving progress, it may have died or been killed
+JOB_ABANDONED = "Abandoned by its worker"
+
+
+def job_key(kind: str, target: str | None) -> str:
+    # Kinds have no colon, so this tells every kind and target apart
+    return f"{kind}:{target or ''}"
+
+
+class Jobs:
+    # Runs long deletions one batch at a time on the database thread pool. After each batch the job sleeps
+    # so it keeps the database busy at most duty_cycle of the time, and backs off by itself when foreground
+    # load makes its batches slower. Jobs are kept in the database (store, the service), so every worker
+    # sees them and only one of each kind and target runs at a time. A running job saves its progress
+    # after every batch, one that hasn't for stale_after seconds is taken over by the next request for it.
+    def __init__(self, duty_cycle: float = 0.5, max_finished: int = 100, stale_after: float = 60.0, keep_finished: float = 86400.0):
+        self.duty_cycle = duty_cycle
+        self.max_finished = max_finished
+        self.stale_after = stale_after
+        self.keep_finished = keep_finished
+        # Set once the service is built
+        self.store = None
+        # The jobs this worker ran, for the metrics and for cancelling them on shutdown
+        self._jobs = OrderedDict()
+        self._tasks = {}
+        self.rows_deleted = 0
+
+    async def start(self, kind: str, target: str | None, batches: Iterator[int]) -> Job:
+        # batches is advanced on the thread pool. Its first value is the number of rows the job expects to
+        # delete, every later one how many a batch deleted. Returns the job already running instead, if
+        # there is one, and batches is dropped without being started.
+        now = datetime.now()
+        await self.store.prune_jobs(now - timedelta(seconds=self.keep_finished))
+        job = Job(id=uuid4(), kind=kind, target=target, started_at=str(now))
+        claimed = await self.store.claim_job(job, now - timedelta(seconds=self.stale_after))
+        if claimed.id != job.id:
+            return claimed
+        self._jobs[job.id] = job
+        self._prune()
+        # A fresh context, so the job's queries aren't charged to the request that started it
+        task = asyncio.get_running_loop().create_task(self._run(job, batches), context=contextvars.Context())
+        self._tasks[job.id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job.id, None))
+        return job
+
+    async def _run(self, job: Job, batches: Iterator[int]):
+        try:
+            job.total = await self.store.step(batches)
+            while await self.store.save_job(job):
+                start = time.perf_counter()
+                deleted = await self.store.step(batches)
+                if deleted is None:
+                    job.status = "done"
+                    break
+                job.deleted += deleted
+                self.rows_deleted += deleted
+                job.batches += 1
+                elapsed = time.perf_counter() - start
+                await asyncio.sleep(elapsed * (1 - self.duty_cycle) / self.duty_cycle)
+            else:
+                # Saving took longer than stale_after and another worker gave up on it, that one's job now
+                logger.warning("job %s (%s %s) was taken over, stopping", job.id, job.kind, job.target)
+                job.status = "failed"
+                job.error = JOB_ABANDONED
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            raise
+        except Exception as e:
+            logger.exception("job %s (%s %s) failed", job.id, job.kind, job.target)
+            job.status = "failed"
+            job.error = repr(e)
+        finally:
+            job.finished_at = str(datetime.now())
+            try:
+                await self.store.save_job(job)
+            except Exception:
+                logger.exception("job %s (%s %s) couldn't be saved", job.id, job.kind, job.target)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status != "running"]
+        for job_id in finished[: max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+    def local(self, job_id: UUID) -> Job | None:
+        # This worker's own copy of a job it runs, current without a round trip to the database
+        return self._jobs.get(job_id)
+
+    async def get(self, job_id: UUID) -> Job | None:
+        return await self.store.get_job(job_id)
+
+    async def list(self) -> list[Job]:
+        return await self.store.list_jobs(self.max_finished)
+
+    async def cancel_all(self):
+        # Waits for the jobs to record that they were cancelled, before the service goes away
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        statuses = [job.status for job in self._jobs.values()]
+        return {
+            "running": statuses.count("running"),
+            "failed": statuses.count("failed"),
+            "rows_deleted": self.rows_deleted,
+        }
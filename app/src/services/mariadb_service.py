@@ -1,272 +1,1317 @@
+import logging
+from collections.abc import Iterator
 from datetime import datetime
 from uuid import UUID, uuid4
+from zlib import crc32
 
-from mariadb import connect
-
-from src.models.task import Task, TaskCreate
+from src.models.job import Job
+from src.models.task import Task, TaskCreate, TaskOperation, TaskOperationResult, TaskQuery, TaskSearch, TaskStats, TaskSync
 from src.models.user import User, UserLogin
+from src.services.backend import root_token
+from src.services.bulk import validate_operations
+from src.services.cache import TokenCache, Versions
+from src.services.export import BATCH_SIZE
+from src.services.instrumentation import Instrumentation, InstrumentedCursor
+from src.services.jobs import JOB_ABANDONED, job_key
+from src.services.pagination import decode_cursor, decode_search_cursor, decode_sync_token, search_page, sync_page
+from src.services.pool import ConnectionPool
+from src.services.replicas import ReplicaSet, client_wrote_within
+from src.services.search import search_terms
+from src.services.serialization import construct
+
 
+USER_COLUMNS = "id, password, uuid"
+TASK_COLUMNS = "id, user_id, text, created_at, updated_at, is_checked, is_important"
+JOB_COLUMNS = "id, kind, target, status, total, deleted, batches, started_at, finished_at, error"
+# Bumped with every schema change, workers that find it current skip the DDL entirely
+SCHEMA_VERSION = 9
+# Seqs written in the same microsecond that stay distinct
+SEQ_SPREAD = 1024
 
-root_token = "root"
+logger = logging.getLogger("src.db")
 
 
 class MariaDBService:
-    def __init__(self, user, passwd, db):
-        self.conn = connect(
-            user=user,
-            password=passwd,
-            host="mariadb",
-            port=3306,
-            database=db,
-            autocommit=True,
-        )
-        self.cursor = self.conn.cursor()
-        self.init_db()
+    name = "mariadb"
+    # Rows the overall task counters are spread over
+    stats_slots = 16
+    # A fresh random version for a stats row, 40 bits so stats_slots of them sum without overflowing
+    new_version = "FLOOR(RAND() * 1099511627776)"
+
+    def __init__(
+        self,
+        user,
+        passwd,
+        db,
+        host="mariadb",
+        port=3306,
+        pool_min=1,
+        pool_max=10,
+        pool_timeout=5.0,
+        pool_recycle=3600.0,
+        token_cache: TokenCache | None = None,
+        instrumentation: Instrumentation | None = None,
+        versions: Versions | None = None,
+        new_id=uuid4,
+        replicas: list[tuple[str, int]] | None = None,
+        max_replica_lag: float = 5.0,
+        sync_grace: float = 5.0,
+    ):
+        # Imported here rather than at the top, SQLiteService shares this module and runs without the driver
+        import mariadb
+        from mariadb.constants import CLIENT
+
+        self.integrity_error = mariadb.IntegrityError
+        self.database_error = mariadb.Error
+        self.token_cache = token_cache or TokenCache()
+        self.versions = versions or Versions()
+        self.instrumentation = instrumentation or Instrumentation()
+        # Makes every user token and task id, the sharded service stamps its shard into them
+        self.new_id = new_id
+        self.sync_grace = sync_grace
+        self._sync_grace_warned = False
+
+        def make_pool(host: str, port: int, min_size: int, target: str) -> ConnectionPool:
+            return ConnectionPool(
+                lambda: mariadb.connect(
+                    user=user,
+                    password=passwd,
+                    host=host,
+                    port=port,
+                    database=db,
+                    autocommit=True,
+                    # UPDATE counts the rows it matched, not only those it changed, so rewriting a row
+                    # with its own values still tells found from missing
+                    client_flag=CLIENT.FOUND_ROWS,
+                ),
+                min_size=min_size,
+                max_size=pool_max,
+                acquire_timeout=pool_timeout,
+                max_lifetime=pool_recycle,
+                wrap_cursor=lambda cursor: InstrumentedCursor(cursor, self.instrumentation, self.name, target),
+            )
+
+        self.pool = make_pool(host, port, pool_min, "primary")
+        # Reads that can't tell a replica that is a few seconds behind from the primary go to the replicas
+        self.replicas = None
+        self.read_your_writes = max_replica_lag
+        if replicas:
+            self.replicas = ReplicaSet(
+                [(f"{host}:{port}", make_pool(host, port, 0, f"{host}:{port}")) for host, port in replicas],
+                self._replica_lag,
+                max_lag=max_replica_lag,
+            )
+
+    def init_db(self, force: bool = False):
+        # Called by every worker on startup. The first to find the schema out of date migrates it under
+        # a lock, the others wait for the lock and then find it current.
+        self.pool.fill()
+        with self.pool.cursor() as cursor:
+            # Logs the warning now, rather than on the first sync, if syncs have to fall back to sync_grace
+            self._sync_until(cursor)
+            if not force and self._schema_version(cursor) == SCHEMA_VERSION:
+                return
+            cursor.execute("SELECT GET_LOCK('tasks_schema', 60)")
+            if not cursor.fetchone()[0]:
+                raise TimeoutError("Timed out waiting for the schema lock")
+            try:
+                if force or self._schema_version(cursor) != SCHEMA_VERSION:
+                    self._create_schema(cursor)
+                    cursor.execute("CREATE TABLE IF NOT EXISTS schema_version (version INT NOT NULL)")
+                    cursor.execute("DELETE FROM schema_version")
+                    cursor.execute("INSERT INTO schema_version (version) VALUES (%s)", (SCHEMA_VERSION,))
+            finally:
+                cursor.execute("SELECT RELEASE_LOCK('tasks_schema')")
+                cursor.fetchone()
 
-    def init_db(self):
-        self.cursor.execute(
+    @staticmethod
+    def _schema_version(cursor) -> int | None:
+        from mariadb import ProgrammingError
+
+        try:
+            cursor.execute("SELECT version FROM schema_version")
+        except ProgrammingError:
+            return None
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def _create_schema(self, cursor):
+        cursor.execute(
             """
                 CREATE TABLE IF NOT EXISTS users (
                     id VARCHAR(255) PRIMARY KEY,
                     password VARCHAR(255) NOT NULL,
-                    uuid VARCHAR(36) NOT NULL
-                );     
+                    uuid BINARY(16) NOT NULL
+                );
             """
         )
 
-        self.cursor.execute(
+        cursor.execute(
             """
                 CREATE TABLE IF NOT EXISTS tasks (
-                    id VARCHAR(36) PRIMARY KEY,
+                    id BINARY(16) PRIMARY KEY,
                     user_id VARCHAR(255) NOT NULL,
                     text VARCHAR(500) NOT NULL,
-                    created_at VARCHAR(255) NOT NULL,
-                    updated_at VARCHAR(255) NOT NULL,
+                    created_at DATETIME(6) NOT NULL,
+                    updated_at DATETIME(6) NOT NULL,
                     is_checked BOOLEAN NOT NULL,
                     is_important BOOLEAN NOT NULL,
+                    seq BIGINT NOT NULL DEFAULT 0,
                     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE ON UPDATE CASCADE
                 );
             """
         )
 
+        self._migrate(cursor)
+        self._create_search(cursor)
+        self._create_change_log(cursor)
+        self._create_stats(cursor)
+        self._create_jobs(cursor)
+
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS users_uuid ON users (uuid)")
+        # Also serves every lookup by user_id, so tasks needs no separate user_id index
+        cursor.execute("CREATE INDEX IF NOT EXISTS tasks_user_created ON tasks (user_id, created_at)")
+        # InnoDB appends the primary key to secondary indexes, so both index orders match (created_at, id)
+        cursor.execute("CREATE INDEX IF NOT EXISTS tasks_created ON tasks (created_at)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS tasks_user_seq ON tasks (user_id, seq)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS tasks_seq ON tasks (seq)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS tombstones_user_seq ON tombstones (user_id, seq)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS tombstones_deleted ON tombstones (deleted_at)")
+
+    @staticmethod
+    def _column_types(cursor, table: str) -> dict:
+        cursor.execute(
+            "SELECT COLUMN_NAME, DATA_TYPE FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+            (table,),
+        )
+        return dict(cursor.fetchall())
+
+    def _migrate(self, cursor):
+        # Tables created before the typed schema stored UUIDs and timestamps as strings.
+        # Every step checks the current column type first, so this is safe to run on every start.
+        if self._column_types(cursor, "users")["uuid"] == "varchar":
+            cursor.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS uuid_bin BINARY(16)")
+            cursor.execute("UPDATE users SET uuid_bin = UNHEX(REPLACE(uuid, '-', '')) WHERE uuid_bin IS NULL")
+            cursor.execute("ALTER TABLE users DROP COLUMN uuid, CHANGE uuid_bin uuid BINARY(16) NOT NULL")
+
+        if self._column_types(cursor, "tasks")["id"] == "varchar":
+            cursor.execute("ALTER TABLE tasks ADD COLUMN IF NOT EXISTS id_bin BINARY(16)")
+            cursor.execute("UPDATE tasks SET id_bin = UNHEX(REPLACE(id, '-', '')) WHERE id_bin IS NULL")
+            cursor.execute(
+                "ALTER TABLE tasks DROP PRIMARY KEY, DROP COLUMN id, CHANGE id_bin id BINARY(16) NOT NULL FIRST, ADD PRIMARY KEY (id)"
+            )
+
+        tasks = self._column_types(cursor, "tasks")
+        if tasks["created_at"] == "varchar" or tasks["updated_at"] == "varchar":
+            cursor.execute(
+                "ALTER TABLE tasks MODIFY created_at DATETIME(6) NOT NULL, MODIFY updated_at DATETIME(6) NOT NULL"
+            )
+
+        if "seq" not in tasks:
+            # Existing tasks enter the change sequence in creation order, before the triggers exist
+            cursor.execute("ALTER TABLE tasks ADD COLUMN seq BIGINT NOT NULL DEFAULT 0")
+            cursor.execute("SET @seq = 0")
+            cursor.execute("UPDATE tasks SET seq = (@seq := @seq + 1) ORDER BY created_at, id")
+
+    def _stats_tables(self, cursor):
+        recompute = False
+        for table, key in (("user_task_stats", "user_id VARCHAR(255) PRIMARY KEY"), ("task_stats", "id INT PRIMARY KEY")):
+            cursor.execute(
+                f"""
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        {key},
+                        total BIGINT NOT NULL DEFAULT 0,
+                        checked BIGINT NOT NULL DEFAULT 0,
+                        important BIGINT NOT NULL DEFAULT 0,
+                        last_updated_at DATETIME(6),
+                        version BIGINT NOT NULL DEFAULT 0
+                    );
+                """
+            )
+            if "version" not in self._column_types(cursor, table):
+                # From before the versions, the recompute gives every user a row and every row a version
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN version BIGINT NOT NULL DEFAULT 0")
+                recompute = True
+        cursor.execute("SELECT COUNT(*) FROM task_stats")
+        if cursor.fetchone()[0] != self.stats_slots or recompute:
+            self._recompute_stats(cursor)
+
+    def _recompute_stats(self, cursor):
+        cursor.execute("DELETE FROM user_task_stats")
+        cursor.execute(
+            f"""
+                INSERT INTO user_task_stats (user_id, total, checked, important, last_updated_at, version)
+                SELECT u.id, COUNT(t.id), COALESCE(SUM(t.is_checked), 0), COALESCE(SUM(t.is_important), 0), MAX(t.updated_at), {self.new_version}
+                FROM users u LEFT JOIN tasks t ON t.user_id = u.id GROUP BY u.id
+            """
+        )
+        # Only the sum over the slots means anything, so the whole count can start out in the first one
+        cursor.execute("DELETE FROM task_stats")
+        cursor.execute(
+            f"""
+                INSERT INTO task_stats (id, total, checked, important, last_updated_at, version)
+                SELECT 0, COUNT(*), COALESCE(SUM(is_checked), 0), COALESCE(SUM(is_important), 0), MAX(updated_at), {self.new_version} FROM tasks
+            """
+        )
+        cursor.executemany("INSERT INTO task_stats (id) VALUES (%s)", [(slot,) for slot in range(1, self.stats_slots)])
+
+    def _create_stats(self, cursor):
+        # Counters kept by the same triggers that write tasks, so reading them costs one row per user and
+        # stats_slots rows overall whatever the table size. The overall counters are spread over slot rows
+        # by user so concurrent writers don't all wait on one row lock. last_updated_at only moves
+        # forward: deleting the latest task leaves it in place. Every change also gives the rows it touches
+        # a new version, which data_version reads.
+        self._stats_tables(cursor)
+        latest = "GREATEST(COALESCE(last_updated_at, NEW.updated_at), NEW.updated_at)"
+        version = f"version = {self.new_version}"
+        added = f"total = total + 1, checked = checked + NEW.is_checked, important = important + NEW.is_important, last_updated_at = {latest}, {version}"
+        changed = f"checked = checked + NEW.is_checked - OLD.is_checked, important = important + NEW.is_important - OLD.is_important, last_updated_at = {latest}, {version}"
+        removed = f"total = total - 1, checked = checked - OLD.is_checked, important = important - OLD.is_important, {version}"
+        new_slot = f"id = CRC32(NEW.user_id) % {self.stats_slots}"
+        old_slot = f"id = CRC32(OLD.user_id) % {self.stats_slots}"
+        triggers = {
+            "INSERT": f"""
+                INSERT INTO user_task_stats (user_id, total, checked, important, last_updated_at, version)
+                    VALUES (NEW.user_id, 1, NEW.is_checked, NEW.is_important, NEW.updated_at, {self.new_version})
+                    ON DUPLICATE KEY UPDATE {added};
+                UPDATE task_stats SET {added} WHERE {new_slot};
+            """,
+            "UPDATE": f"UPDATE user_task_stats SET {changed} WHERE user_id = NEW.user_id; UPDATE task_stats SET {changed} WHERE {new_slot};",
+            "DELETE": f"UPDATE user_task_stats SET {removed} WHERE user_id = OLD.user_id; UPDATE task_stats SET {removed} WHERE {old_slot};",
+        }
+        for event, body in triggers.items():
+            cursor.execute(
+                f"CREATE OR REPLACE TRIGGER tasks_stats_{event.lower()} AFTER {event} ON tasks FOR EACH ROW BEGIN {body} END"
+            )
+        # get_user shows the user's own fields too. A rename moves the user's tasks by cascade, which fires
+        # no trigger, so it changes the overall version here.
+        cursor.execute(
+            f"CREATE OR REPLACE TRIGGER users_stats_insert AFTER INSERT ON users FOR EACH ROW "
+            f"INSERT INTO user_task_stats (user_id, version) VALUES (NEW.id, {self.new_version}) ON DUPLICATE KEY UPDATE {version}"
+        )
+        cursor.execute(
+            f"""
+                CREATE OR REPLACE TRIGGER users_stats_update AFTER UPDATE ON users FOR EACH ROW BEGIN
+                    UPDATE user_task_stats SET {version} WHERE user_id = OLD.id;
+                    UPDATE task_stats SET {version} WHERE NEW.id <> OLD.id AND id = CRC32(NEW.id) % {self.stats_slots};
+                END
+            """
+        )
+
+    @staticmethod
+    def _owner_key(user_id: str) -> str:
+        # What _owner_words glues to the front of a user's words
+        return f"{crc32(user_id.encode()):08X}"
+
+    @staticmethod
+    def _owner_words(text: str, user_id: str) -> str:
+        # (*UCP) makes \w the Unicode word characters, like search_terms' and the fulltext parser's
+        return f"REGEXP_REPLACE({text}, '(*UCP)(\\\\w+)', CONCAT(LPAD(HEX(CRC32({user_id})), 8, '0'), '\\\\1'))"
+
+    def _create_search(self, cursor):
+        # InnoDB updates both as part of every transaction that writes tasks.text. tasks_text serves root's
+        # searches over everyone. owner_text holds the text with a key of the owner's glued to every word,
+        # so a user's search only reads the postings of their own words, however many everyone else has.
+        # Two users' keys can collide, the search filters on user_id as well.
+        cursor.execute("CREATE FULLTEXT INDEX IF NOT EXISTS tasks_text ON tasks (text)")
+        if "owner_text" not in self._column_types(cursor, "tasks"):
+            cursor.execute("ALTER TABLE tasks ADD COLUMN owner_text TEXT NOT NULL DEFAULT ''")
+            # Dropped so the backfill isn't taken for a change to every task, _create_change_log and
+            # _create_stats create them again right after
+            cursor.execute("DROP TRIGGER IF EXISTS tasks_seq_update")
+            cursor.execute("DROP TRIGGER IF EXISTS tasks_stats_update")
+            cursor.execute(f"UPDATE tasks SET owner_text = {self._owner_words('text', 'user_id')}")
+        for event in ("INSERT", "UPDATE"):
+            cursor.execute(
+                f"CREATE OR REPLACE TRIGGER tasks_owner_text_{event.lower()} BEFORE {event} ON tasks FOR EACH ROW "
+                f"SET NEW.owner_text = {self._owner_words('NEW.text', 'NEW.user_id')}"
+            )
+        cursor.execute("CREATE FULLTEXT INDEX IF NOT EXISTS tasks_owner_text ON tasks (owner_text)")
+
+    def _rekey_search(self, cursor, user_id: str):
+        # A rename moves the tasks by cascade, which fires no trigger. Any update makes the trigger
+        # key their words again.
+        cursor.execute("UPDATE tasks SET owner_text = '' WHERE user_id = %s", (user_id,))
+
+    def _create_jobs(self, cursor):
+        # active_key holds kind and target while the job runs and NULL after, so only one of each runs
+        cursor.execute(
+            """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id BINARY(16) PRIMARY KEY,
+                    kind VARCHAR(32) NOT NULL,
+                    target VARCHAR(255),
+                    status VARCHAR(16) NOT NULL,
+                    total BIGINT NOT NULL,
+                    deleted BIGINT NOT NULL,
+                    batches BIGINT NOT NULL,
+                    started_at DATETIME(6) NOT NULL,
+                    finished_at DATETIME(6),
+                    error TEXT,
+                    heartbeat_at DATETIME(6) NOT NULL,
+                    active_key VARCHAR(300) UNIQUE
+                );
+            """
+        )
+
+    def _create_change_log(self, cursor):
+        # A seq is the microsecond its row was written at, with the low bits taken from a sequence so
+        # writes in the same microsecond stay apart. A sequence hands out values without any row lock, so
+        # writes don't queue behind each other, and seqs are well above the counter's old values.
+        cursor.execute("CREATE SEQUENCE IF NOT EXISTS change_ids")
+        cursor.execute(
+            """
+                CREATE TABLE IF NOT EXISTS tombstones (
+                    seq BIGINT PRIMARY KEY,
+                    id BINARY(16) NOT NULL,
+                    user_id VARCHAR(255) NOT NULL,
+                    deleted_at DATETIME(6) NOT NULL
+                );
+            """
+        )
+        # SYSDATE() rather than NOW(), the time of the write itself and not of the start of its statement
+        next_seq = f"FLOOR(UNIX_TIMESTAMP(SYSDATE(6)) * 1000000) * {SEQ_SPREAD} + MOD(NEXT VALUE FOR change_ids, {SEQ_SPREAD})"
+        # Replaced in place, dropping them first would let writes through unstamped
+        for event in ("INSERT", "UPDATE"):
+            cursor.execute(
+                f"CREATE OR REPLACE TRIGGER tasks_seq_{event.lower()} BEFORE {event} ON tasks FOR EACH ROW SET NEW.seq = {next_seq}"
+            )
+        # Foreign key cascades don't fire triggers, so tasks are always deleted explicitly
+        cursor.execute(
+            f"""
+                CREATE OR REPLACE TRIGGER tasks_tombstone AFTER DELETE ON tasks FOR EACH ROW
+                INSERT INTO tombstones (seq, id, user_id, deleted_at) VALUES ({next_seq}, OLD.id, OLD.user_id, NOW(6))
+            """
+        )
+        cursor.execute("DROP TABLE IF EXISTS change_seq")
+        self._create_sync_horizon(cursor)
+
+    @staticmethod
+    def _create_sync_horizon(cursor):
+        # The newest seq whose tombstone was pruned. A sync token from before it could have missed deletes.
+        cursor.execute("CREATE TABLE IF NOT EXISTS sync_horizon (seq BIGINT NOT NULL)")
+        cursor.execute("SELECT 1 FROM sync_horizon")
+        if not cursor.fetchone():
+            cursor.execute("INSERT INTO sync_horizon (seq) VALUES (0)")
+
+    def _sync_until(self, cursor) -> int:
+        # The highest seq a sync may hand out: every change at or below it has committed. A transaction
+        # still open wrote its rows after it started, so seqs from before the oldest open one are settled.
+        # trx_started only has whole seconds and a transaction is registered just after its first trigger
+        # runs, hence the extra second.
+        # Reading INNODB_TRX needs the PROCESS privilege. Without it syncs fall back to holding back
+        # sync_grace seconds (SYNC_GRACE_SECONDS), which relies on seqs following the wall clock and on
+        # every write committing within sync_grace of taking its seq: a longer transaction's changes can
+        # be skipped by a sync that already went past them. init_db logs a warning when that is the case.
+        try:
+            cursor.execute(
+                f"""
+                    SELECT (FLOOR(UNIX_TIMESTAMP(LEAST(SYSDATE(6), COALESCE(MIN(trx_started), SYSDATE(6)))) * 1000000) - 1000000)
+                        * {SEQ_SPREAD} - 1
+                    FROM information_schema.INNODB_TRX
+                """
+            )
+        except self.database_error as e:
+            if not self._sync_grace_warned:
+                self._sync_grace_warned = True
+                logger.warning(
+                    "Can't read open transactions (%s), syncs hold back %ss instead and can miss changes from "
+                    "transactions that take longer. Grant the PROCESS privilege to avoid it.",
+                    e,
+                    self.sync_grace,
+                )
+            cursor.execute(
+                f"SELECT (FLOOR(UNIX_TIMESTAMP(SYSDATE(6)) * 1000000) - %s) * {SEQ_SPREAD} - 1", (int(self.sync_grace * 1000000),)
+            )
+        return int(cursor.fetchone()[0])
+
+    @staticmethod
+    def _task_fields(task) -> dict:
+        # What lists and syncs return: a Task's fields, written out by orjson as the model would be
+        return {
+            "id": UUID(bytes=task[0]),
+            "user_id": task[1],
+            "text": task[2],
+            "created_at": str(task[3]),
+            "updated_at": str(task[4]),
+            "is_checked": bool(task[5]),
+            "is_important": bool(task[6]),
+        }
+
+    @classmethod
+    def _task_from_row(cls, task) -> Task:
+        # Rows come from our own schema, so the models skip validation
+        return construct(Task, cls._task_fields(task))
+
+    @staticmethod
+    def _user_from_row(user, tasks: list[Task] | None = None) -> User:
+        return construct(User, {"id": user[0], "password": user[1], "uuid": UUID(bytes=user[2]), "tasks": tasks or []})
+
+    @staticmethod
+    def _token_bytes(token: str) -> bytes | None:
+        try:
+            return UUID(token).bytes
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _replica_lag(pool: ConnectionPool) -> float | None:
+        with pool.cursor() as cursor:
+            cursor.execute("SHOW REPLICA STATUS")
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            lag = row[[column[0] for column in cursor.description].index("Seconds_Behind_Master")]
+            # NULL while replication is stopped or broken
+            return None if lag is None else float(lag)
+
+    def _read_pool(self, token: str | None = None, user_id: str | None = None) -> ConnectionPool:
+        # A replica, unless the read might miss a write the client or this process made less than
+        # max_replica_lag ago.
+        # user_id None with the root token is a read over every user.
+        if self.replicas is None:
+            return self.pool
+        if token is not None and token != root_token:
+            user_id = self.token_cache.peek(token)
+            if user_id is None:
+                # Resolving the token is a read too, one that has to find a user created a moment ago
+                return self.pool
+        if client_wrote_within(self.read_your_writes) or self.versions.written_within(user_id, self.read_your_writes):
+            return self.pool
+        return self.replicas.pick() or self.pool
+
     def is_alive(self) -> dict:
         try:
-            self.cursor.execute("SELECT 1")
-            return {"is_alive": True, "db": "mariadb"}
+            with self.pool.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            is_alive = True
         except Exception:
-            return {"is_alive": False, "db": "mariadb"}
+            is_alive = False
+        return {
+            "is_alive": is_alive,
+            "db": self.name,
+            "pool": self.pool.stats(),
+            "token_cache": self.token_cache.stats(),
+        }
 
-    def get_users(self, token: str) -> list[User] | str:
+    def get_users(self, token: str, limit: int | None = None, after: str | None = None) -> list[User] | str:
         if token != root_token:
             return "Unauthorized"
-        self.cursor.execute("SELECT * FROM users")
-        users = self.cursor.fetchall()
-        users_with_tasks = []
-        for user in users:
-            user = User(id=user[0], password=user[1], uuid=UUID(user[2]))
-            self.cursor.execute("SELECT * FROM tasks WHERE user_id = %s", (user.id,))
-            tasks = self.cursor.fetchall()
-            user.tasks = [
-                Task(
-                    id=UUID(task[0]),
-                    user_id=task[1],
-                    text=task[2],
-                    created_at=task[3],
-                    updated_at=task[4],
-                    is_checked=task[5],
-                    is_important=task[6],
+        sql, params = f"SELECT {USER_COLUMNS} FROM users", []
+        if after:
+            try:
+                (after_id,) = decode_cursor(after, 1)
+            except ValueError:
+                return "Invalid cursor"
+            sql += " WHERE id > %s"
+            params.append(after_id)
+        sql += " ORDER BY id"
+        if limit:
+            sql += " LIMIT %s"
+            params.append(limit)
+        with self._read_pool(token).cursor() as cursor:
+            cursor.execute(sql, params)
+            users = cursor.fetchall()
+            if limit is None and after is None:
+                cursor.execute(f"SELECT {TASK_COLUMNS} FROM tasks")
+            elif users:
+                placeholders = ", ".join(["%s"] * len(users))
+                cursor.execute(
+                    f"SELECT {TASK_COLUMNS} FROM tasks WHERE user_id IN ({placeholders})",
+                    [user[0] for user in users],
                 )
-                for task in tasks
-            ]
-            users_with_tasks.append(user)
-        return users_with_tasks
+            else:
+                return []
+            tasks_by_user = {}
+            for task in cursor.fetchall():
+                tasks_by_user.setdefault(task[1], []).append(self._task_from_row(task))
+            return [self._user_from_row(user, tasks_by_user.get(user[0])) for user in users]
 
     def get_user(self, user_id: str, token: str) -> User | str:
         if token != root_token:
             return "Unauthorized"
-        self.cursor.execute("SELECT * FROM users WHERE id = %s", (user_id,))
-        user = self.cursor.fetchone()
-        if user:
-            user = User(id=user[0], password=user[1], uuid=UUID(user[2]))
-            self.cursor.execute("SELECT * FROM tasks WHERE user_id = %s", (user.id,))
-            tasks = self.cursor.fetchall()
-            user.tasks = [Task(*task) for task in tasks]
-            return user
-        return "User not found"
+        with self._read_pool(user_id=user_id).cursor() as cursor:
+            cursor.execute(f"SELECT {USER_COLUMNS} FROM users WHERE id = %s", (user_id,))
+            user = cursor.fetchone()
+            if user:
+                user = self._user_from_row(user)
+                cursor.execute(f"SELECT {TASK_COLUMNS} FROM tasks WHERE user_id = %s", (user.id,))
+                tasks = cursor.fetchall()
+                user.tasks = [self._task_from_row(task) for task in tasks]
+                return user
+            return "User not found"
 
     def get_token(self, user: UserLogin) -> str | None:
-        self.cursor.execute(
-            "SELECT uuid FROM users WHERE id = %s AND password = %s",
-            (user.id, user.password),
-        )
-        match = self.cursor.fetchone()
-        if match:
-            return match[0]
-        return None
+        # Always the primary: a client that just registered or changed its password must be able to log in
+        with self.pool.cursor() as cursor:
+            cursor.execute(
+                "SELECT uuid FROM users WHERE id = %s AND password = %s",
+                (user.id, user.password),
+            )
+            match = cursor.fetchone()
+            if match:
+                return str(UUID(bytes=match[0]))
+            return None
 
     def create_user(self, user: UserLogin) -> User | str:
-        self.cursor.execute("SELECT * FROM users WHERE id = %s", (user.id,))
-        if self.cursor.fetchone():
-            return "Email already registered"
-        new_user = User(**user.model_dump(), uuid=uuid4())
-        self.cursor.execute(
-            "INSERT INTO users (id, password, uuid) VALUES (%s, %s, %s)",
-            (new_user.id, new_user.password, str(new_user.uuid)),
-        )
+        new_user = User(**user.model_dump(), uuid=self.new_id())
+        with self.pool.cursor() as cursor:
+            try:
+                cursor.execute(
+                    "INSERT INTO users (id, password, uuid) VALUES (%s, %s, %s)",
+                    (new_user.id, new_user.password, new_user.uuid.bytes),
+                )
+            except self.integrity_error:
+                return "Email already registered"
+        self.versions.bump(new_user.id)
         return new_user
 
     def delete_user(self, user_id: str, token: str) -> bool | str:
         if token != root_token:
             return "Unauthorized"
-        self.cursor.execute("SELECT * FROM users WHERE id = %s", (user_id,))
-        if self.cursor.fetchone():
-            self.cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
-            return True
-        return "User not found"
+        with self.pool.cursor() as cursor:
+            cursor.execute("START TRANSACTION")
+            cursor.execute("DELETE FROM tasks WHERE user_id = %s", (user_id,))
+            cursor.execute("DELETE FROM users WHERE id = %s RETURNING id", (user_id,))
+            deleted = cursor.fetchone()
+            cursor.execute("DELETE FROM user_task_stats WHERE user_id = %s", (user_id,))
+            cursor.execute("COMMIT")
+            if deleted:
+                self.token_cache.invalidate_user(user_id)
+                self.versions.bump(user_id)
+                return True
+            return "User not found"
 
     def update_user(self, user_id: str, token: str, user: UserLogin) -> UserLogin | str:
-        self.cursor.execute("SELECT * FROM users WHERE id = %s", (user_id,))
-        existing_user = self.cursor.fetchone()
-        if existing_user:
-            if token != root_token and token != existing_user[2]:
-                return "Unauthorized"
-            self.cursor.execute(
-                "UPDATE users SET id = %s, password = %s WHERE id = %s",
-                (user.id, user.password, user_id),
+        sql, params = "UPDATE users SET id = %s, password = %s WHERE id = %s", [user.id, user.password, user_id]
+        if token != root_token:
+            sql += " AND uuid = %s"
+            params.append(self._token_bytes(token))
+        with self.pool.cursor() as cursor:
+            cursor.execute(sql, params)
+            if cursor.rowcount:
+                if user.id != user_id:
+                    # The tasks follow through the foreign key cascade, their counters have to be moved by hand
+                    cursor.execute("UPDATE user_task_stats SET user_id = %s WHERE user_id = %s", (user.id, user_id))
+                    self._rekey_search(cursor, user.id)
+                self.token_cache.invalidate_user(user_id)
+                self.versions.bump(user_id, user.id)
+                return user
+            # Only failures pay for a second round trip to tell the two errors apart
+            cursor.execute("SELECT 1 FROM users WHERE id = %s", (user_id,))
+            return "Unauthorized" if cursor.fetchone() else "User not found"
+
+    @staticmethod
+    def _user_dict(user) -> dict:
+        return {"id": user[0], "password": user[1], "uuid": str(UUID(bytes=user[2]))}
+
+    @staticmethod
+    def _task_dict(task) -> dict:
+        return {
+            "id": str(UUID(bytes=task[0])),
+            "user_id": task[1],
+            "text": task[2],
+            "created_at": str(task[3]),
+            "updated_at": str(task[4]),
+            "is_checked": bool(task[5]),
+            "is_important": bool(task[6]),
+        }
+
+    def _stream(self, sql: str, convert) -> Iterator[dict]:
+        # Unbuffered, so rows come off the socket as they are consumed instead of all at once.
+        # The connection stays checked out until the generator finishes or is closed.
+        with self.pool.cursor(buffered=False) as cursor:
+            cursor.execute(sql)
+            while rows := cursor.fetchmany(BATCH_SIZE):
+                for row in rows:
+                    yield convert(row)
+
+    def export_users(self, token: str) -> Iterator[dict] | str:
+        if token != root_token:
+            return "Unauthorized"
+        return self._stream(f"SELECT {USER_COLUMNS} FROM users", self._user_dict)
+
+    def export_tasks(self, token: str) -> Iterator[dict] | str:
+        if token != root_token:
+            return "Unauthorized"
+        return self._stream(f"SELECT {TASK_COLUMNS} FROM tasks", self._task_dict)
+
+    @staticmethod
+    def _range_sql(sql: str, key: str, start: UUID | None, end: UUID | None, limit: int) -> tuple[str, list]:
+        conditions, params = [], []
+        if start is not None:
+            conditions.append(f"{key} >= %s")
+            params.append(start.bytes)
+        if end is not None:
+            conditions.append(f"{key} < %s")
+            params.append(end.bytes)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        return f"{sql} ORDER BY {key} LIMIT %s", [*params, limit]
+
+    def scan_users(self, token: str, start: UUID | None, end: UUID | None, limit: int = BATCH_SIZE) -> list[dict] | str:
+        if token != root_token:
+            return "Unauthorized"
+        sql, params = self._range_sql(f"SELECT {USER_COLUMNS} FROM users", "uuid", start, end, limit)
+        with self.pool.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [self._user_dict(row) for row in cursor.fetchall()]
+
+    def scan_tasks(self, token: str, start: UUID | None, end: UUID | None, limit: int = BATCH_SIZE) -> list[dict] | str:
+        if token != root_token:
+            return "Unauthorized"
+        sql, params = self._range_sql(f"SELECT {TASK_COLUMNS} FROM tasks", "id", start, end, limit)
+        with self.pool.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [self._task_dict(row) for row in cursor.fetchall()]
+
+    @staticmethod
+    def _upsert_sql(table: str, columns: str, key: str) -> str:
+        names = columns.split(", ")
+        updates = ", ".join(f"{name} = VALUES({name})" for name in names if name != key)
+        placeholders = ", ".join("%s" for _ in names)
+        return f"INSERT INTO {table} ({columns}) VALUES ({placeholders}) ON DUPLICATE KEY UPDATE {updates}"
+
+    def import_users(self, token: str, users: list[dict]) -> int | str:
+        if token != root_token:
+            return "Unauthorized"
+        if not users:
+            return 0
+        rows = [(user["id"], user["password"], UUID(str(user["uuid"])).bytes) for user in users]
+        with self.pool.cursor() as cursor:
+            try:
+                cursor.execute("START TRANSACTION")
+                cursor.executemany(self._upsert_sql("users", USER_COLUMNS, "id"), rows)
+                cursor.execute("COMMIT")
+            except self.integrity_error as e:
+                cursor.execute("ROLLBACK")
+                return str(e)
+        self.versions.bump(*(user["id"] for user in users))
+        return len(users)
+
+    def import_tasks(self, token: str, tasks: list[dict]) -> int | str:
+        # The stats and change log triggers see an existing task's upsert as an update
+        if token != root_token:
+            return "Unauthorized"
+        if not tasks:
+            return 0
+        rows = [
+            (
+                UUID(str(task["id"])).bytes,
+                task["user_id"],
+                task["text"],
+                datetime.fromisoformat(str(task["created_at"])),
+                datetime.fromisoformat(str(task["updated_at"])),
+                task["is_checked"],
+                task["is_important"],
             )
-            return user
-        return "User not found"
+            for task in tasks
+        ]
+        with self.pool.cursor() as cursor:
+            try:
+                cursor.execute("START TRANSACTION")
+                cursor.executemany(self._upsert_sql("tasks", TASK_COLUMNS, "id"), rows)
+                cursor.execute("COMMIT")
+            except self.integrity_error as e:
+                # Most likely a task whose user isn't there (yet)
+                cursor.execute("ROLLBACK")
+                return str(e)
+        self.versions.bump(*{task["user_id"] for task in tasks})
+        return len(tasks)
 
-    def get_tasks(self, token: str) -> list[Task] | str:
+    def _resolve_token(self, cursor, token: str) -> str | None:
+        user_id = self.token_cache.get(token)
+        if user_id is None:
+            token_bytes = self._token_bytes(token)
+            if token_bytes is None:
+                return None
+            generation = self.token_cache.generation
+            cursor.execute("SELECT id FROM users WHERE uuid = %s", (token_bytes,))
+            user = cursor.fetchone()
+            if user is None:
+                return None
+            user_id = user[0]
+            self.token_cache.put(token, user_id, generation)
+        return user_id
+
+    def _resolve_tokens(self, cursor, tokens: set[str]) -> dict[str, str | None]:
+        # _resolve_token for a batch: one query for all the tokens the cache doesn't know
+        user_ids, missing = {}, {}
+        for token in tokens:
+            user_ids[token] = self.token_cache.get(token)
+            if user_ids[token] is None and (token_bytes := self._token_bytes(token)) is not None:
+                missing.setdefault(token_bytes, []).append(token)
+        if missing:
+            generation = self.token_cache.generation
+            placeholders = ", ".join("%s" for _ in missing)
+            cursor.execute(f"SELECT uuid, id FROM users WHERE uuid IN ({placeholders})", list(missing))
+            for token_bytes, user_id in cursor.fetchall():
+                # Differently spelled tokens can name the same user
+                for token in missing[bytes(token_bytes)]:
+                    user_ids[token] = user_id
+                    self.token_cache.put(token, user_id, generation)
+        return user_ids
+
+    def _owner_condition(self, token: str) -> tuple[str, list]:
+        # Ownership goes into the WHERE clause so a single statement checks and reads/writes the task
         if token == root_token:
-            self.cursor.execute("SELECT * FROM tasks")
-            tasks = self.cursor.fetchall()
-            return [
-                Task(
-                    id=UUID(task[0]),
-                    user_id=task[1],
-                    text=task[2],
-                    created_at=task[3],
-                    updated_at=task[4],
-                    is_checked=task[5],
-                    is_important=task[6],
-                )
-                for task in tasks
-            ]
-        self.cursor.execute("SELECT * FROM users WHERE uuid = %s", (token,))
-        user = self.cursor.fetchone()
-        if user:
-            self.cursor.execute("SELECT * FROM tasks WHERE user_id = %s", (user[0],))
-            tasks = self.cursor.fetchall()
-            return [
-                Task(
-                    id=UUID(task[0]),
-                    user_id=task[1],
-                    text=task[2],
-                    created_at=task[3],
-                    updated_at=task[4],
-                    is_checked=task[5],
-                    is_important=task[6],
-                )
-                for task in tasks
-            ]
-        return "Invalid token"
+            return "", []
+        user_id = self.token_cache.get(token)
+        if user_id is not None:
+            return " AND user_id = %s", [user_id]
+        token_bytes = self._token_bytes(token)
+        if token_bytes is None:
+            return " AND FALSE", []
+        return " AND user_id = (SELECT id FROM users WHERE uuid = %s)", [token_bytes]
+
+    @staticmethod
+    def _missing_task_error(cursor, task_id: UUID) -> str:
+        cursor.execute("SELECT 1 FROM tasks WHERE id = %s", (task_id.bytes,))
+        return "Unauthorized" if cursor.fetchone() else "Task not found"
+
+    @staticmethod
+    def _tasks_sql(query: TaskQuery, user_id: str | None) -> tuple[str, list]:
+        conditions, params = [], []
+        if user_id is not None:
+            conditions.append("user_id = %s")
+            params.append(user_id)
+        if query.is_checked is not None:
+            conditions.append("is_checked = %s")
+            params.append(query.is_checked)
+        if query.is_important is not None:
+            conditions.append("is_important = %s")
+            params.append(query.is_important)
+        if query.updated_since is not None:
+            conditions.append("updated_at >= %s")
+            params.append(query.updated_since)
+        direction, op = ("ASC", ">") if query.order == "asc" else ("DESC", "<")
+        if query.after:
+            created_at, task_id = decode_cursor(query.after, 2)
+            created_at, task_id = datetime.fromisoformat(created_at), UUID(task_id).bytes
+            # Spelled out instead of a row comparison so it can use the (user_id, created_at) / (created_at, id) indexes
+            conditions.append(f"(created_at {op} %s OR (created_at = %s AND id {op} %s))")
+            params.extend([created_at, created_at, task_id])
+        sql = f"SELECT {TASK_COLUMNS} FROM tasks"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += f" ORDER BY created_at {direction}, id {direction}"
+        if query.limit:
+            sql += " LIMIT %s"
+            params.append(query.limit)
+        return sql, params
+
+    def get_tasks(self, token: str, query: TaskQuery | None = None) -> list[dict] | str:
+        query = query or TaskQuery()
+        with self._read_pool(token).cursor() as cursor:
+            if token == root_token:
+                user_id = None
+            else:
+                user_id = self._resolve_token(cursor, token)
+                if not user_id:
+                    return "Invalid token"
+            try:
+                sql, params = self._tasks_sql(query, user_id)
+            except ValueError:
+                return "Invalid cursor"
+            cursor.execute(sql, params)
+            return [self._task_fields(task) for task in cursor.fetchall()]
 
     def get_task(self, task_id: UUID, token: str) -> Task | str:
-        self.cursor.execute("SELECT * FROM tasks WHERE id = %s", (task_id,))
-        task = self.cursor.fetchone()
-        if task:
-            self.cursor.execute("SELECT * FROM users WHERE id = %s", (task[1],))
-            user = self.cursor.fetchone()
-            if user or token == root_token:
-                if token == root_token or token == user[2]:
-                    return Task(
-                        id=UUID(task[0]),
-                        user_id=task[1],
-                        text=task[2],
-                        created_at=task[3],
-                        updated_at=task[4],
-                        is_checked=task[5],
-                        is_important=task[6],
-                    )
-            return "Unauthorized"
-        return "Task not found"
+        owner_sql, owner_params = self._owner_condition(token)
+        with self._read_pool(token).cursor() as cursor:
+            cursor.execute(f"SELECT {TASK_COLUMNS} FROM tasks WHERE id = %s{owner_sql}", [task_id.bytes, *owner_params])
+            task = cursor.fetchone()
+            if task:
+                return self._task_from_row(task)
+            return self._missing_task_error(cursor, task_id)
 
     def create_task(self, task: TaskCreate, token: str) -> Task | str:
-        self.cursor.execute("SELECT * FROM users WHERE uuid = %s", (token,))
-        user = self.cursor.fetchone()
-        if user:
-            new_task = Task(
-                **task.model_dump(),
-                id=uuid4(),
-                user_id=user[0],
-                created_at=str(datetime.now()),
-                updated_at=str(datetime.now()),
-            )
-            self.cursor.execute(
-                "INSERT INTO tasks (id, user_id, text, created_at, updated_at, is_checked, is_important) VALUES (%s, %s, %s, %s, %s, %s, %s)",
-                (
-                    str(new_task.id),
-                    new_task.user_id,
-                    new_task.text,
-                    new_task.created_at,
-                    new_task.updated_at,
-                    new_task.is_checked,
-                    new_task.is_important,
-                ),
-            )
-            return new_task
-        return "Invalid token"
+        with self.pool.cursor() as cursor:
+            user_id = self._resolve_token(cursor, token)
+            if user_id:
+                now = datetime.now()
+                new_task = Task(
+                    **task.model_dump(),
+                    id=self.new_id(),
+                    user_id=user_id,
+                    created_at=str(now),
+                    updated_at=str(now),
+                )
+                try:
+                    cursor.execute(
+                        f"INSERT INTO tasks ({TASK_COLUMNS}) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                        (
+                            new_task.id.bytes,
+                            new_task.user_id,
+                            new_task.text,
+                            now,
+                            now,
+                            new_task.is_checked,
+                            new_task.is_important,
+                        ),
+                    )
+                except self.integrity_error:
+                    # The user was deleted after its token resolved
+                    self.token_cache.invalidate_user(user_id)
+                    return "Invalid token"
+                self.versions.bump(user_id)
+                return new_task
+            return "Invalid token"
+
+    def create_tasks(self, requests: list[tuple[TaskCreate, str]]) -> list[Task | str]:
+        results, rows = [], []
+        now = datetime.now()
+        sql = f"INSERT INTO tasks ({TASK_COLUMNS}) VALUES (%s, %s, %s, %s, %s, %s, %s)"
+        with self.pool.cursor() as cursor:
+            user_ids = self._resolve_tokens(cursor, {token for _, token in requests})
+            for task, token in requests:
+                user_id = user_ids[token]
+                if not user_id:
+                    results.append("Invalid token")
+                    continue
+                new_task = Task(**task.model_dump(), id=self.new_id(), user_id=user_id, created_at=str(now), updated_at=str(now))
+                results.append(new_task)
+                row = (new_task.id.bytes, user_id, task.text, now, now, task.is_checked, task.is_important)
+                rows.append((len(results) - 1, row))
+            if rows:
+                try:
+                    # One transaction, so one commit to disk for the whole batch
+                    cursor.execute("START TRANSACTION")
+                    cursor.executemany(sql, [row for _, row in rows])
+                    cursor.execute("COMMIT")
+                except self.integrity_error:
+                    # A user was deleted after its token resolved, the others' tasks still go in
+                    cursor.execute("ROLLBACK")
+                    for index, row in rows:
+                        try:
+                            cursor.execute(sql, row)
+                        except self.integrity_error:
+                            results[index] = "Invalid token"
+        self.versions.bump(*{task.user_id for task in results if type(task) is Task})
+        return results
 
     def delete_task(self, task_id: UUID, token: str) -> bool | str:
-        self.cursor.execute("SELECT * FROM tasks WHERE id = %s", (task_id,))
-        task = self.cursor.fetchone()
-        if task:
-            self.cursor.execute("SELECT * FROM users WHERE id = %s", (task[1],))
-            user = self.cursor.fetchone()
-            if user or token == root_token:
-                if token == root_token or token == user[2]:
-                    self.cursor.execute("DELETE FROM tasks WHERE id = %s", (str(task_id),))
-                    return True
-            return "Unauthorized"
-        return "Task not found"
+        owner_sql, owner_params = self._owner_condition(token)
+        with self.pool.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM tasks WHERE id = %s{owner_sql} RETURNING user_id", [task_id.bytes, *owner_params]
+            )
+            deleted = cursor.fetchone()
+            if deleted:
+                self.versions.bump(deleted[0])
+                return True
+            return self._missing_task_error(cursor, task_id)
 
     def update_task(self, task_id: UUID, token: str, task: TaskCreate) -> Task | str:
-        self.cursor.execute("SELECT * FROM tasks WHERE id = %s", (task_id,))
-        existing_task = self.cursor.fetchone()
-        if existing_task:
-            self.cursor.execute("SELECT * FROM users WHERE id = %s", (existing_task[1],))
-            user = self.cursor.fetchone()
-            if user or token == root_token:
-                if token == root_token or token == user[2]:
-                    self.cursor.execute(
-                        "UPDATE tasks SET text = %s, updated_at = %s, is_checked = %s, is_important = %s WHERE id = %s",
+        owner_sql, owner_params = self._owner_condition(token)
+        with self.pool.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE tasks SET text = %s, updated_at = %s, is_checked = %s, is_important = %s WHERE id = %s{owner_sql}",
+                [task.text, datetime.now(), task.is_checked, task.is_important, task_id.bytes, *owner_params],
+            )
+            if not cursor.rowcount:
+                return self._missing_task_error(cursor, task_id)
+            # MariaDB has no UPDATE ... RETURNING
+            cursor.execute(f"SELECT {TASK_COLUMNS} FROM tasks WHERE id = %s", (task_id.bytes,))
+            updated_task = self._task_from_row(cursor.fetchone())
+            self.versions.bump(updated_task.user_id)
+            return updated_task
+
+    def bulk_tasks(self, operations: list[TaskOperation], token: str) -> list[TaskOperationResult] | str:
+        results = [
+            TaskOperationResult(op=operation.op, id=operation.id, error=error)
+            for operation, error in zip(operations, validate_operations(operations))
+        ]
+        with self.pool.cursor() as cursor:
+            user_id = None
+            if token != root_token:
+                user_id = self._resolve_token(cursor, token)
+                if not user_id:
+                    return "Invalid token"
+
+            ids = [
+                operation.id.bytes
+                for operation, result in zip(operations, results)
+                if result.error is None and operation.op != "create"
+            ]
+            # All or nothing: if any statement fails the pool drops the connection, rolling it back.
+            # The rows are locked as they are read, so the updates start from what is there.
+            cursor.execute("START TRANSACTION")
+            existing = {}
+            if ids:
+                placeholders = ", ".join(["%s"] * len(ids))
+                cursor.execute(f"SELECT {TASK_COLUMNS} FROM tasks WHERE id IN ({placeholders}) FOR UPDATE", ids)
+                existing = {row[0]: row for row in cursor.fetchall()}
+
+            now = datetime.now()
+            inserts, updates, deletes = [], [], []
+            touched_users = set()
+            for operation, result in zip(operations, results):
+                if result.error:
+                    continue
+                if operation.op == "create":
+                    if user_id is None:
+                        result.error = "Invalid token"
+                        continue
+                    result.task = Task(
+                        **operation.task.model_dump(),
+                        id=self.new_id(),
+                        user_id=user_id,
+                        created_at=str(now),
+                        updated_at=str(now),
+                    )
+                    result.id = result.task.id
+                    touched_users.add(user_id)
+                    inserts.append(
                         (
-                            task.text,
-                            str(datetime.now()),
-                            task.is_checked,
-                            task.is_important,
-                            str(task_id),
-                        ),
+                            result.id.bytes,
+                            user_id,
+                            result.task.text,
+                            now,
+                            now,
+                            result.task.is_checked,
+                            result.task.is_important,
+                        )
                     )
-                    self.cursor.execute("SELECT * FROM tasks WHERE id = %s", (task_id,))
-                    updated_task = self.cursor.fetchone()
-                    return Task(
-                        id=UUID(updated_task[0]),
-                        user_id=updated_task[1],
-                        text=updated_task[2],
-                        created_at=updated_task[3],
-                        updated_at=updated_task[4],
-                        is_checked=updated_task[5],
-                        is_important=updated_task[6],
+                    continue
+                row = existing.get(operation.id.bytes)
+                if row is None:
+                    result.error = "Task not found"
+                elif user_id is not None and row[1] != user_id:
+                    result.error = "Unauthorized"
+                elif operation.op == "update":
+                    task = operation.task
+                    touched_users.add(row[1])
+                    updates.append((task.text, now, task.is_checked, task.is_important, operation.id.bytes))
+                    result.task = Task(
+                        **task.model_dump(),
+                        id=operation.id,
+                        user_id=row[1],
+                        created_at=str(row[3]),
+                        updated_at=str(now),
                     )
+                else:
+                    touched_users.add(row[1])
+                    deletes.append((operation.id.bytes,))
+
+            if inserts:
+                cursor.executemany(
+                    f"INSERT INTO tasks ({TASK_COLUMNS}) VALUES (%s, %s, %s, %s, %s, %s, %s)", inserts
+                )
+            if updates:
+                cursor.executemany(
+                    "UPDATE tasks SET text = %s, updated_at = %s, is_checked = %s, is_important = %s WHERE id = %s",
+                    updates,
+                )
+            if deletes:
+                cursor.executemany("DELETE FROM tasks WHERE id = %s", deletes)
+            cursor.execute("COMMIT")
+        self.versions.bump(*touched_users)
+        return results
+
+    def sync_tasks(self, token: str, since: str | None = None, limit: int = 1000) -> TaskSync | str:
+        try:
+            after = decode_sync_token(since)
+        except ValueError:
+            return "Invalid sync token"
+        with self.pool.cursor() as cursor:
+            owner_sql, owner_params = "", []
+            if token != root_token:
+                user_id = self._resolve_token(cursor, token)
+                if not user_id:
+                    return "Invalid token"
+                owner_sql, owner_params = "user_id = %s AND ", [user_id]
+            # Bounding both queries by the same settled seq keeps them consistent with each other
+            until = self._sync_until(cursor)
+            params = [*owner_params, after, until, limit]
+            cursor.execute(
+                f"SELECT {TASK_COLUMNS}, seq FROM tasks WHERE {owner_sql}seq > %s AND seq <= %s ORDER BY seq LIMIT %s",
+                params,
+            )
+            tasks = [(row[7], self._task_fields(row)) for row in cursor.fetchall()]
+            cursor.execute(
+                f"SELECT seq, id FROM tombstones WHERE {owner_sql}seq > %s AND seq <= %s ORDER BY seq LIMIT %s",
+                params,
+            )
+            deleted = [(row[0], UUID(bytes=row[1])) for row in cursor.fetchall()]
+            # Read after the tombstones: if pruning took any this sync needed, the horizon is already past after
+            cursor.execute("SELECT seq FROM sync_horizon")
+            if 0 < after < cursor.fetchone()[0]:
+                return "Sync token expired, sync from scratch"
+        return sync_page(tasks, deleted, limit, max(after, until))
+
+    def prune_tombstones(self, deleted_before: datetime) -> int:
+        with self.pool.cursor() as cursor:
+            cursor.execute("START TRANSACTION")
+            cursor.execute("SELECT MAX(seq) FROM tombstones WHERE deleted_at < %s", (deleted_before,))
+            horizon = cursor.fetchone()[0]
+            if horizon is None:
+                cursor.execute("COMMIT")
+                return 0
+            cursor.execute("UPDATE sync_horizon SET seq = %s WHERE seq < %s", (horizon, horizon))
+            cursor.execute("DELETE FROM tombstones WHERE seq <= %s", (horizon,))
+            pruned = cursor.rowcount
+            cursor.execute("COMMIT")
+        return pruned
+
+    @classmethod
+    def _search_sql(cls, terms: list[str], user_id: str | None) -> tuple[str, list]:
+        # Natural language mode: a task matching any of the words is a match, ranked by relevance
+        if user_id is None:
+            against = " ".join(terms)
+            sql = f"SELECT {TASK_COLUMNS}, MATCH (text) AGAINST (%s) AS score FROM tasks WHERE MATCH (text) AGAINST (%s)"
+            return sql, [against, against]
+        # The words keyed like the user's own in owner_text, so only those are looked up
+        against = " ".join(cls._owner_key(user_id) + term for term in terms)
+        sql = f"SELECT {TASK_COLUMNS}, MATCH (owner_text) AGAINST (%s) AS score FROM tasks WHERE MATCH (owner_text) AGAINST (%s) AND user_id = %s"
+        return sql, [against, against, user_id]
+
+    def search_tasks(self, token: str, q: str, limit: int = 100, after: str | None = None) -> TaskSearch | str:
+        matches = self._search_matches(token, q, limit, after)
+        if type(matches) is str:
+            return matches
+        return search_page(matches, limit)
+
+    def _search_matches(self, token: str, q: str, limit: int, after: str | None) -> list[tuple[float, Task]] | str:
+        # With their scores, which the sharded service merges by
+        try:
+            position = decode_search_cursor(after) if after else None
+        except ValueError:
+            return "Invalid cursor"
+        terms = search_terms(q)
+        with self._read_pool(token).cursor() as cursor:
+            if token == root_token:
+                user_id = None
+            else:
+                user_id = self._resolve_token(cursor, token)
+                if not user_id:
+                    return "Invalid token"
+            if not terms:
+                return []
+            sql, params = self._search_sql(terms, user_id)
+            sql = f"SELECT * FROM ({sql}) AS matches"
+            if position is not None:
+                # Scores depend on the whole table, a write between two pages can move a task across the cursor
+                score, task_id = position
+                sql += " WHERE score < %s OR (score = %s AND id > %s)"
+                params.extend([score, score, task_id.bytes])
+            sql += " ORDER BY score DESC, id LIMIT %s"
+            params.append(limit)
+            cursor.execute(sql, params)
+            return [(row[7], self._task_from_row(row)) for row in cursor.fetchall()]
+
+    @staticmethod
+    def _stats_from_row(row, user_id: str | None = None) -> TaskStats:
+        if row is None or row[0] is None:
+            return construct(TaskStats, {"user_id": user_id, "total": 0, "checked": 0, "important": 0, "last_updated_at": None})
+        return construct(
+            TaskStats,
+            {
+                "user_id": user_id,
+                "total": int(row[0]),
+                "checked": int(row[1]),
+                "important": int(row[2]),
+                "last_updated_at": str(row[3]) if row[3] is not None else None,
+            },
+        )
+
+    def get_stats(self, token: str, user_id: str | None = None) -> TaskStats | str:
+        with self._read_pool(token, user_id).cursor() as cursor:
+            if user_id is not None:
+                if token != root_token:
+                    return "Unauthorized"
+                # Joined to users so one query tells a user without tasks from one that doesn't exist
+                cursor.execute(
+                    "SELECT s.total, s.checked, s.important, s.last_updated_at FROM users u "
+                    "LEFT JOIN user_task_stats s ON s.user_id = u.id WHERE u.id = %s",
+                    (user_id,),
+                )
+                row = cursor.fetchone()
+                if row is None:
+                    return "User not found"
+                return self._stats_from_row(row, user_id)
+            if token == root_token:
+                cursor.execute("SELECT SUM(total), SUM(checked), SUM(important), MAX(last_updated_at) FROM task_stats")
+                return self._stats_from_row(cursor.fetchone())
+            user_id = self._resolve_token(cursor, token)
+            if not user_id:
+                return "Invalid token"
+            cursor.execute("SELECT total, checked, important, last_updated_at FROM user_task_stats WHERE user_id = %s", (user_id,))
+            return self._stats_from_row(cursor.fetchone(), user_id)
+
+    def recompute_stats(self, token: str) -> TaskStats | str:
+        # Rebuilds every counter from the tasks themselves. Writes to tasks wait until it commits.
+        if token != root_token:
             return "Unauthorized"
-        return "Task not found"
+        with self.pool.cursor() as cursor:
+            cursor.execute("START TRANSACTION")
+            self._recompute_stats(cursor)
+            cursor.execute("COMMIT")
+        return self.get_stats(token)
+
+    def data_version(self, token: str, user_id: str | None = None) -> tuple[str, str] | None:
+        # From the primary, which every worker reads alike. The stats rows get a new version in the same
+        # transaction as every write they count, so no committed change leaves the version as it was.
+        with self.pool.cursor() as cursor:
+            if token != root_token:
+                token_bytes = self._token_bytes(token)
+                if token_bytes is None:
+                    return None
+                cursor.execute(
+                    "SELECT s.user_id, s.version FROM users u JOIN user_task_stats s ON s.user_id = u.id WHERE u.uuid = %s",
+                    (token_bytes,),
+                )
+            elif user_id is not None:
+                cursor.execute("SELECT user_id, version FROM user_task_stats WHERE user_id = %s", (user_id,))
+            else:
+                cursor.execute("SELECT '*', SUM(version) FROM task_stats")
+            row = cursor.fetchone()
+        return (row[0], str(row[1])) if row else None
 
     def delete_data(self, token: str) -> bool:
         if token != root_token:
             return False
-        self.cursor.execute("DELETE FROM tasks")
-        self.cursor.execute("DELETE FROM users")
+        with self.pool.cursor() as cursor:
+            cursor.execute("DELETE FROM tasks")
+            cursor.execute("DELETE FROM users")
+            cursor.execute("DELETE FROM user_task_stats")
+        self.token_cache.clear()
+        self.versions.bump_all()
         return True
-        
+
+    def _delete_task_batches(self, user_id: str | None, batch_size: int) -> Iterator[int]:
+        # Every batch is its own short transaction, so no lock or undo log outlives it. The batch's rows
+        # are locked as they are picked, so the count it yields is what it deleted.
+        owner_sql, params = ("WHERE user_id = %s ", [user_id]) if user_id is not None else ("", [])
+        while True:
+            with self.pool.cursor() as cursor:
+                cursor.execute("START TRANSACTION")
+                cursor.execute(f"SELECT id FROM tasks {owner_sql}LIMIT %s FOR UPDATE", [*params, batch_size])
+                ids = [row[0] for row in cursor.fetchall()]
+                if ids:
+                    placeholders = ", ".join(["%s"] * len(ids))
+                    cursor.execute(f"DELETE FROM tasks WHERE id IN ({placeholders})", ids)
+                cursor.execute("COMMIT")
+            if ids:
+                if user_id is None:
+                    self.versions.bump_all()
+                else:
+                    self.versions.bump(user_id)
+                yield len(ids)
+            if len(ids) < batch_size:
+                return
+
+    def purge_user(self, user_id: str, token: str, batch_size: int = BATCH_SIZE) -> Iterator[int] | str:
+        if token != root_token:
+            return "Unauthorized"
+        with self.pool.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM users WHERE id = %s", (user_id,))
+            if not cursor.fetchone():
+                return "User not found"
+        return self._purge_user(user_id, batch_size)
+
+    def _purge_user(self, user_id: str, batch_size: int) -> Iterator[int]:
+        with self.pool.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM tasks WHERE user_id = %s", (user_id,))
+            total = cursor.fetchone()[0] + 1
+        yield total
+        yield from self._delete_task_batches(user_id, batch_size)
+        # Tasks created since the last batch go with the user, in one transaction
+        if self.delete_user(user_id, root_token) is True:
+            yield 1
+
+    def purge_data(self, token: str, batch_size: int = BATCH_SIZE) -> Iterator[int] | str:
+        if token != root_token:
+            return "Unauthorized"
+        return self._purge_data(batch_size)
+
+    def _purge_data(self, batch_size: int) -> Iterator[int]:
+        with self.pool.cursor() as cursor:
+            cursor.execute("SELECT (SELECT COUNT(*) FROM tasks) + (SELECT COUNT(*) FROM users)")
+            total = cursor.fetchone()[0]
+        yield total
+        yield from self._delete_task_batches(None, batch_size)
+        while True:
+            with self.pool.cursor() as cursor:
+                cursor.execute("SELECT id FROM users LIMIT %s", (batch_size,))
+                ids = [row[0] for row in cursor.fetchall()]
+                if ids:
+                    placeholders = ", ".join(["%s"] * len(ids))
+                    cursor.execute(f"DELETE FROM users WHERE id IN ({placeholders})", ids)
+            for user_id in ids:
+                self.token_cache.invalidate_user(user_id)
+            if ids:
+                yield len(ids)
+            if len(ids) < batch_size:
+                break
+        # Whatever was written while the batches ran
+        self.delete_data(root_token)
+
+    @staticmethod
+    def _job_from_row(job) -> Job:
+        return construct(
+            Job,
+            {
+                "id": UUID(bytes=job[0]),
+                "kind": job[1],
+                "target": job[2],
+                "status": job[3],
+                "total": job[4],
+                "deleted": job[5],
+                "batches": job[6],
+                "started_at": str(job[7]),
+                "finished_at": str(job[8]) if job[8] is not None else None,
+                "error": job[9],
+            },
+        )
+
+    def claim_job(self, job: Job, stale_before: datetime) -> Job:
+        key = job_key(job.kind, job.target)
+        now = datetime.now()
+        row = [job.id.bytes, job.kind, job.target, job.status, job.total, job.deleted, job.batches, job.started_at]
+        row += [job.finished_at, job.error, now, key]
+        with self.pool.cursor() as cursor:
+            cursor.execute(
+                "UPDATE jobs SET status = 'failed', error = %s, finished_at = %s, active_key = NULL WHERE active_key = %s AND heartbeat_at < %s",
+                (JOB_ABANDONED, now, key, stale_before),
+            )
+            placeholders = ", ".join(["%s"] * len(row))
+            while True:
+                try:
+                    cursor.execute(f"INSERT INTO jobs ({JOB_COLUMNS}, heartbeat_at, active_key) VALUES ({placeholders})", row)
+                    return job
+                except self.integrity_error:
+                    cursor.execute(f"SELECT {JOB_COLUMNS} FROM jobs WHERE active_key = %s", (key,))
+                    running = cursor.fetchone()
+                    # Otherwise it finished in between, try again
+                    if running is not None:
+                        return self._job_from_row(running)
+
+    def save_job(self, job: Job) -> bool:
+        # False once the job was given up on as abandoned, it no longer belongs to the caller
+        finished = "" if job.status == "running" else ", active_key = NULL"
+        with self.pool.cursor() as cursor:
+            cursor.execute(
+                f"""
+                    UPDATE jobs SET status = %s, total = %s, deleted = %s, batches = %s, finished_at = %s, error = %s,
+                        heartbeat_at = %s{finished}
+                    WHERE id = %s AND active_key IS NOT NULL
+                """,
+                (job.status, job.total, job.deleted, job.batches, job.finished_at, job.error, datetime.now(), job.id.bytes),
+            )
+            return cursor.rowcount > 0
+
+    def get_job(self, job_id: UUID) -> Job | None:
+        with self.pool.cursor() as cursor:
+            cursor.execute(f"SELECT {JOB_COLUMNS} FROM jobs WHERE id = %s", (job_id.bytes,))
+            row = cursor.fetchone()
+        return self._job_from_row(row) if row else None
+
+    def list_jobs(self, limit: int = 100) -> list[Job]:
+        with self.pool.cursor() as cursor:
+            cursor.execute(f"SELECT {JOB_COLUMNS} FROM jobs ORDER BY started_at DESC LIMIT %s", (limit,))
+            return [self._job_from_row(row) for row in cursor.fetchall()]
+
+    def prune_jobs(self, finished_before: datetime):
+        with self.pool.cursor() as cursor:
+            cursor.execute("DELETE FROM jobs WHERE active_key IS NULL AND finished_at < %s", (finished_before,))
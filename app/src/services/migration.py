@@ -0,0 +1,203 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from uuid import UUID
+
+from src.models.task import TaskOperation
+from src.services.backend import StorageBackend, root_token
+from src.services.bulk import MAX_OPERATIONS
+
+KINDS = ("users", "tasks")
+# What each kind is scanned and resumed by: users by their token, tasks by their id
+KEYS = {"users": "uuid", "tasks": "id"}
+LAST_UUID = 2**128 - 1
+DONE = "done"
+
+
+def key_ranges(count: int) -> list[tuple[UUID | None, UUID | None]]:
+    # Even slices of the id space. Ids are random, so each holds about the same number of rows.
+    # Sharded ids all start with their shard's index, migrate those shard by shard.
+    bounds = [UUID(int=i * (LAST_UUID + 1) // count) for i in range(1, count)]
+    return list(zip([None, *bounds], [*bounds, None]))
+
+
+def row_digest(kind: str, row: dict) -> int:
+    # The same for the same row whichever backend it was read from
+    if kind == "users":
+        values = (row["id"], row["password"], str(UUID(str(row["uuid"]))))
+    else:
+        values = (
+            str(UUID(str(row["id"]))),
+            row["user_id"],
+            row["text"],
+            str(datetime.fromisoformat(str(row["created_at"]))),
+            str(datetime.fromisoformat(str(row["updated_at"]))),
+            bool(row["is_checked"]),
+            bool(row["is_important"]),
+        )
+    return int.from_bytes(hashlib.blake2b(repr(values).encode(), digest_size=8).digest(), "big")
+
+
+class MigrationError(Exception):
+    pass
+
+
+# Copies users, then tasks, from one backend to another keeping ids, tokens and timestamps. The id space is cut
+# into ranges copied in parallel, batch by batch, so memory stays at one batch per worker. Every batch is an
+# upsert and is recorded in the checkpoint once written, a rerun picks up after the last recorded batch and
+# at worst writes one batch per range again.
+class Migration:
+    def __init__(
+        self,
+        source: StorageBackend,
+        target: StorageBackend,
+        checkpoint_path: str | None = None,
+        ranges: int = 64,
+        workers: int = 8,
+        batch_size: int = 5000,
+    ):
+        self.source = source
+        self.target = target
+        self.checkpoint_path = checkpoint_path
+        self.ranges = key_ranges(ranges)
+        self.workers = workers
+        self.batch_size = batch_size
+        self.copied = {kind: 0 for kind in KINDS}
+        self._lock = threading.Lock()
+        self.state = self._load()
+
+    def _load(self) -> dict:
+        # Per kind and range: None before its first batch, then where the next batch starts, then DONE
+        state = {"source": self.source.name, "target": self.target.name, "ranges": len(self.ranges)}
+        state |= {kind: [None] * len(self.ranges) for kind in KINDS}
+        if self.checkpoint_path is None or not os.path.exists(self.checkpoint_path):
+            return state
+        with open(self.checkpoint_path) as file:
+            saved = json.load(file)
+        if saved["ranges"] != len(self.ranges):
+            raise MigrationError(f"Checkpoint was made with {saved['ranges']} ranges, not {len(self.ranges)}")
+        return saved
+
+    def _save(self, kind: str, index: int, position: str, rows: int):
+        with self._lock:
+            self.state[kind][index] = position
+            self.copied[kind] += rows
+            if self.checkpoint_path is None:
+                return
+            # Written aside and renamed, so a crash mid-write leaves the previous checkpoint intact
+            with open(f"{self.checkpoint_path}.tmp", "w") as file:
+                json.dump(self.state, file)
+            os.replace(f"{self.checkpoint_path}.tmp", self.checkpoint_path)
+
+    def _parallel(self, fn, kind: str) -> list:
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="migrate") as executor:
+            return list(executor.map(lambda index: fn(kind, index), range(len(self.ranges))))
+
+    def _scan(self, service: StorageBackend, kind: str, start: UUID | None, end: UUID | None) -> list[dict]:
+        rows = getattr(service, f"scan_{kind}")(root_token, start, end, self.batch_size)
+        if type(rows) is str:
+            raise MigrationError(f"Reading {kind} from {service.name}: {rows}")
+        return rows
+
+    def _write(self, kind: str, rows: list[dict]):
+        res = getattr(self.target, f"import_{kind}")(root_token, rows)
+        if type(res) is str:
+            raise MigrationError(f"Writing {kind} to {self.target.name}: {res}")
+
+    def _batches(self, service: StorageBackend, kind: str, start: UUID | None, end: UUID | None):
+        # Keyset pages through [start, end), each with where the one after it starts, None after the last
+        while True:
+            rows = self._scan(service, kind, start, end)
+            last = UUID(rows[-1][KEYS[kind]]).int if rows else LAST_UUID
+            start = UUID(int=last + 1) if len(rows) == self.batch_size and last < LAST_UUID else None
+            yield rows, start
+            if start is None:
+                return
+
+    def _copy_range(self, kind: str, index: int):
+        position = self.state[kind][index]
+        if position == DONE:
+            return
+        start, end = self.ranges[index]
+        for rows, start in self._batches(self.source, kind, UUID(position) if position else start, end):
+            if rows:
+                self._write(kind, rows)
+            self._save(kind, index, DONE if start is None else start.hex, len(rows))
+
+    def run(self) -> dict:
+        started = time.perf_counter()
+        # Tasks need their users in place
+        for kind in KINDS:
+            self._parallel(self._copy_range, kind)
+        elapsed = time.perf_counter() - started
+        rows = sum(self.copied.values())
+        return {**self.copied, "seconds": round(elapsed, 3), "rows_per_second": round(rows / elapsed, 1) if elapsed else 0}
+
+    def _digests(self, service: StorageBackend, kind: str, index: int) -> dict:
+        start, end = self.ranges[index]
+        return {
+            row[KEYS[kind]]: row_digest(kind, row)
+            for rows, _ in self._batches(service, kind, start, end)
+            for row in rows
+        }
+
+    def _compare_range(self, kind: str, index: int) -> tuple[set, set]:
+        # Keys to copy again (missing or different on the target) and keys only the target has.
+        # Holds one range's keys at a time, use more ranges for bigger tables.
+        source = self._digests(self.source, kind, index)
+        target = self._digests(self.target, kind, index)
+        stale = {key for key, digest in source.items() if target.get(key) != digest}
+        return stale, target.keys() - source.keys()
+
+    def _repair_range(self, kind: str, index: int, stale: set, extra: set):
+        start, end = self.ranges[index]
+        if stale:
+            for rows, _ in self._batches(self.source, kind, start, end):
+                rows = [row for row in rows if row[KEYS[kind]] in stale]
+                if rows:
+                    self._write(kind, rows)
+        if not extra:
+            return
+        if kind == "users":
+            for rows, _ in self._batches(self.target, kind, start, end):
+                for row in rows:
+                    if row["uuid"] in extra:
+                        self.target.delete_user(row["id"], root_token)
+            return
+        ids = sorted(extra)
+        for i in range(0, len(ids), MAX_OPERATIONS):
+            operations = [TaskOperation(op="delete", id=UUID(id)) for id in ids[i : i + MAX_OPERATIONS]]
+            res = self.target.bulk_tasks(operations, root_token)
+            if type(res) is str:
+                raise MigrationError(f"Deleting tasks from {self.target.name}: {res}")
+
+    def verify(self, repair: bool = False) -> dict:
+        # Compares every row on both sides by content. With repair, rows that differ or are missing are copied
+        # again and rows the source doesn't have are deleted, range by range. While writes still go to the
+        # source, run it until it comes back clean.
+        report = {"ok": True}
+        for kind in KINDS:
+
+            def check(kind: str, index: int) -> int:
+                stale, extra = self._compare_range(kind, index)
+                if repair and (stale or extra):
+                    self._repair_range(kind, index, stale, extra)
+                return len(stale) + len(extra)
+
+            differences = self._parallel(check, kind)
+            report[kind] = {
+                "differences": sum(differences),
+                "ranges": [index for index, count in enumerate(differences) if count],
+            }
+            report["ok"] &= not report[kind]["differences"]
+        if repair:
+            self.target.recompute_stats(root_token)
+        stats = [service.get_stats(root_token) for service in (self.source, self.target)]
+        counts = [(res.total, res.checked, res.important) for res in stats]
+        report["stats"] = {"source": counts[0], "target": counts[1]}
+        report["ok"] &= counts[0] == counts[1]
+        return report
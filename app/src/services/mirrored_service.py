@@ -0,0 +1,212 @@
+import logging
+from collections.abc import Iterator
+from datetime import datetime
+from uuid import UUID
+
+from src.models.job import Job
+from src.models.task import Task, TaskCreate, TaskOperation, TaskOperationResult, TaskQuery, TaskSearch, TaskStats, TaskSync
+from src.models.user import User, UserLogin
+from src.services.backend import StorageBackend, root_token
+
+logger = logging.getLogger("src.mirror")
+
+# The mirror not having a row yet just means the backfill hasn't reached it
+MISSING = ("Task not found", "User not found")
+
+
+# Dual writes for moving to another database without downtime. The primary answers every call, and each write
+# that went through on it is repeated on the mirror under the same ids and timestamps. Mirror failures are
+# logged and counted, never returned: the migration's verify --repair brings the mirror back in line.
+class MirroredService:
+    def __init__(self, primary: StorageBackend, mirror: StorageBackend):
+        self.primary = primary
+        self.mirror = mirror
+        self.name = primary.name
+        self.token_cache = primary.token_cache
+        self.versions = primary.versions
+        self.instrumentation = primary.instrumentation
+        self.mirrored = 0
+        self.errors = 0
+
+    def _mirror(self, method: str, *args, drain: bool = False):
+        try:
+            res = getattr(self.mirror, method)(*args)
+            if drain and type(res) is not str:
+                res = sum(res)
+        except Exception as e:
+            res = repr(e)
+        if type(res) is str and res not in MISSING:
+            self.errors += 1
+            logger.warning("mirror %s on %s failed: %s", method, self.mirror.name, res)
+        else:
+            self.mirrored += 1
+
+    def _mirror_tasks(self, tasks: list[Task]):
+        if tasks:
+            self._mirror("import_tasks", root_token, [task.model_dump() for task in tasks])
+
+    def _then_mirror(self, batches: Iterator[int], method: str, *args) -> Iterator[int]:
+        # The mirror's share runs in one go once the primary's last batch is done
+        yield from batches
+        self._mirror(method, *args, drain=True)
+
+    def stats(self) -> dict:
+        return {"writes": self.mirrored, "errors": self.errors}
+
+    def init_db(self, force: bool = False):
+        self.primary.init_db(force)
+        self.mirror.init_db(force)
+
+    def is_alive(self) -> dict:
+        return {**self.primary.is_alive(), "mirror": self.mirror.is_alive()}
+
+    def get_users(self, token: str, limit: int | None = None, after: str | None = None) -> list[User] | str:
+        return self.primary.get_users(token, limit, after)
+
+    def get_user(self, user_id: str, token: str) -> User | str:
+        return self.primary.get_user(user_id, token)
+
+    def get_token(self, user: UserLogin) -> str | None:
+        return self.primary.get_token(user)
+
+    def create_user(self, user: UserLogin) -> User | str:
+        res = self.primary.create_user(user)
+        if type(res) is User:
+            self._mirror("import_users", root_token, [res.model_dump(exclude={"tasks"})])
+        return res
+
+    def delete_user(self, user_id: str, token: str) -> bool | str:
+        res = self.primary.delete_user(user_id, token)
+        if res is True:
+            self._mirror("delete_user", user_id, root_token)
+        return res
+
+    def update_user(self, user_id: str, token: str, user: UserLogin) -> UserLogin | str:
+        res = self.primary.update_user(user_id, token, user)
+        if type(res) is not str:
+            self._mirror("update_user", user_id, root_token, user)
+        return res
+
+    def export_users(self, token: str) -> Iterator[dict] | str:
+        return self.primary.export_users(token)
+
+    def export_tasks(self, token: str) -> Iterator[dict] | str:
+        return self.primary.export_tasks(token)
+
+    def scan_users(self, token: str, start: UUID | None, end: UUID | None, limit: int = 1000) -> list[dict] | str:
+        return self.primary.scan_users(token, start, end, limit)
+
+    def scan_tasks(self, token: str, start: UUID | None, end: UUID | None, limit: int = 1000) -> list[dict] | str:
+        return self.primary.scan_tasks(token, start, end, limit)
+
+    def import_users(self, token: str, users: list[dict]) -> int | str:
+        res = self.primary.import_users(token, users)
+        if type(res) is int:
+            self._mirror("import_users", token, users)
+        return res
+
+    def import_tasks(self, token: str, tasks: list[dict]) -> int | str:
+        res = self.primary.import_tasks(token, tasks)
+        if type(res) is int:
+            self._mirror("import_tasks", token, tasks)
+        return res
+
+    def get_tasks(self, token: str, query: TaskQuery | None = None) -> list[dict] | str:
+        return self.primary.get_tasks(token, query)
+
+    def get_task(self, task_id: UUID, token: str) -> Task | str:
+        return self.primary.get_task(task_id, token)
+
+    def create_task(self, task: TaskCreate, token: str) -> Task | str:
+        res = self.primary.create_task(task, token)
+        if type(res) is Task:
+            self._mirror_tasks([res])
+        return res
+
+    def create_tasks(self, requests: list[tuple[TaskCreate, str]]) -> list[Task | str]:
+        results = self.primary.create_tasks(requests)
+        self._mirror_tasks([task for task in results if type(task) is Task])
+        return results
+
+    def delete_task(self, task_id: UUID, token: str) -> bool | str:
+        res = self.primary.delete_task(task_id, token)
+        if res is True:
+            self._mirror("delete_task", task_id, root_token)
+        return res
+
+    def update_task(self, task_id: UUID, token: str, task: TaskCreate) -> Task | str:
+        res = self.primary.update_task(task_id, token, task)
+        if type(res) is Task:
+            self._mirror_tasks([res])
+        return res
+
+    def bulk_tasks(self, operations: list[TaskOperation], token: str) -> list[TaskOperationResult] | str:
+        results = self.primary.bulk_tasks(operations, token)
+        if type(results) is str:
+            return results
+        done = [result for result in results if result.error is None]
+        self._mirror_tasks([result.task for result in done if result.op != "delete"])
+        deleted = [TaskOperation(op="delete", id=result.id) for result in done if result.op == "delete"]
+        if deleted:
+            self._mirror("bulk_tasks", deleted, root_token)
+        return results
+
+    def sync_tasks(self, token: str, since: str | None = None, limit: int = 1000) -> TaskSync | str:
+        return self.primary.sync_tasks(token, since, limit)
+
+    def prune_tombstones(self, deleted_before: datetime) -> int:
+        pruned = self.primary.prune_tombstones(deleted_before)
+        self._mirror("prune_tombstones", deleted_before)
+        return pruned
+
+    def _search_matches(self, token: str, q: str, limit: int, after: str | None) -> list[tuple[float, Task]] | str:
+        return self.primary._search_matches(token, q, limit, after)
+
+    def search_tasks(self, token: str, q: str, limit: int = 100, after: str | None = None) -> TaskSearch | str:
+        return self.primary.search_tasks(token, q, limit, after)
+
+    def get_stats(self, token: str, user_id: str | None = None) -> TaskStats | str:
+        return self.primary.get_stats(token, user_id)
+
+    def data_version(self, token: str, user_id: str | None = None) -> tuple[str, str] | None:
+        return self.primary.data_version(token, user_id)
+
+    def recompute_stats(self, token: str) -> TaskStats | str:
+        res = self.primary.recompute_stats(token)
+        if type(res) is not str:
+            self._mirror("recompute_stats", root_token)
+        return res
+
+    def delete_data(self, token: str) -> bool:
+        res = self.primary.delete_data(token)
+        if res:
+            self._mirror("delete_data", root_token)
+        return res
+
+    def purge_user(self, user_id: str, token: str, batch_size: int = 1000) -> Iterator[int] | str:
+        batches = self.primary.purge_user(user_id, token, batch_size)
+        if type(batches) is str:
+            return batches
+        return self._then_mirror(batches, "purge_user", user_id, root_token, batch_size)
+
+    def purge_data(self, token: str, batch_size: int = 1000) -> Iterator[int] | str:
+        batches = self.primary.purge_data(token, batch_size)
+        if type(batches) is str:
+            return batches
+        return self._then_mirror(batches, "purge_data", root_token, batch_size)
+
+    # Jobs are the primary's own bookkeeping, the migration doesn't carry them over
+    def claim_job(self, job: Job, stale_before: datetime) -> Job:
+        return self.primary.claim_job(job, stale_before)
+
+    def save_job(self, job: Job) -> bool:
+        return self.primary.save_job(job)
+
+    def get_job(self, job_id: UUID) -> Job | None:
+        return self.primary.get_job(job_id)
+
+    def list_jobs(self, limit: int = 100) -> list[Job]:
+        return self.primary.list_jobs(limit)
+
+    def prune_jobs(self, finished_before: datetime):
+        self.primary.prune_jobs(finished_before)
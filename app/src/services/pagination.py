@@ -0,0 +1,75 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as DecodeError
+from uuid import UUID
+
+from src.models.task import Task, TaskSearch, TaskSync
+from src.models.user import User
+from src.services.serialization import construct
+
+
+# Cursors are opaque to clients, they only have to hand back what they got in X-Next-Cursor
+def encode_cursor(*parts: str) -> str:
+    return urlsafe_b64encode("\n".join(parts).encode()).decode()
+
+
+def decode_cursor(cursor: str, size: int) -> list[str]:
+    try:
+        parts = urlsafe_b64decode(cursor.encode()).decode().split("\n")
+    except (DecodeError, UnicodeDecodeError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    if len(parts) != size:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return parts
+
+
+def task_cursor(task: dict) -> str:
+    return encode_cursor(task["created_at"], str(task["id"]))
+
+
+def user_cursor(user: User) -> str:
+    return encode_cursor(user.id)
+
+
+def decode_sync_token(token: str | None) -> int:
+    # No token means a first sync, everything from the start of the change sequence
+    if not token:
+        return 0
+    (seq,) = decode_cursor(token, 1)
+    try:
+        return int(seq)
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {token}")
+
+
+def sync_page(tasks: list[tuple[int, dict]], deleted: list[tuple[int, UUID]], limit: int, until: int) -> TaskSync:
+    # Both lists come sorted by seq with at most limit entries each, the page is the first limit of the two merged
+    changes = sorted([*tasks, *deleted], key=lambda change: change[0])[:limit]
+    has_more = len(tasks) == limit or len(deleted) == limit
+    # With nothing left the client can jump straight to until, past changes to other users' tasks
+    last = changes[-1][0] if has_more else until
+    return construct(
+        TaskSync,
+        {
+            "changes": [change for _, change in changes if type(change) is dict],
+            "deleted": [change for _, change in changes if type(change) is UUID],
+            "next": encode_cursor(str(last)),
+            "has_more": has_more,
+        },
+    )
+
+
+def decode_search_cursor(cursor: str) -> tuple[float, UUID]:
+    score, task_id = decode_cursor(cursor, 2)
+    try:
+        return float(score), UUID(task_id)
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+def search_page(matches: list[tuple[float, Task]], limit: int) -> TaskSearch:
+    # Matches come best first, a full page is followed by the ones ranked below its last
+    next = None
+    if matches and len(matches) == limit:
+        score, task = matches[-1]
+        next = encode_cursor(repr(score), str(task.id))
+    return construct(TaskSearch, {"tasks": [task for _, task in matches], "next": next})
@@ -0,0 +1,179 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class PoolTimeout(TimeoutError):
+    pass
+
+
+class ConnectionPool:
+    def __init__(
+        self,
+        connect,
+        min_size: int = 1,
+        max_size: int = 10,
+        acquire_timeout: float = 5.0,
+        health_check_after: float = 30.0,
+        max_lifetime: float = 3600.0,
+        wrap_cursor=None,
+    ):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f"Invalid pool size: min={min_size} max={max_size}")
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.health_check_after = health_check_after
+        self.max_lifetime = max_lifetime
+        self.wrap_cursor = wrap_cursor
+
+        self._cond = threading.Condition()
+        # Each idle entry is (connection, created_at, last_used)
+        self._idle = deque()
+        self._created_at = {}
+        self._size = 0
+        self._waiting = 0
+        self._acquired = 0
+        self._timeouts = 0
+        self._recycled = 0
+        self._acquire_time = 0.0
+        self._acquire_time_max = 0.0
+
+    def fill(self):
+        # Nothing connects on construction, this opens connections up to min_size ahead of the first requests
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                now = time.monotonic()
+                self._created_at[id(conn)] = now
+                self._idle.append((conn, now, now))
+                self._cond.notify()
+
+    def _discard(self, conn):
+        with self._cond:
+            self._size -= 1
+            self._created_at.pop(id(conn), None)
+            self._cond.notify()
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_usable(self, conn, created_at: float, last_used: float) -> bool:
+        now = time.monotonic()
+        if now - created_at > self.max_lifetime:
+            self._recycled += 1
+            return False
+        if now - last_used > self.health_check_after:
+            try:
+                conn.ping()
+            except Exception:
+                self._recycled += 1
+                return False
+        return True
+
+    def acquire(self):
+        start = time.monotonic()
+        deadline = start + self.acquire_timeout
+        while True:
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(f"No connection available after {self.acquire_timeout}s")
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+                entry = self._idle.pop() if self._idle else None
+                if entry is None:
+                    # Reserve the slot before connecting outside the lock
+                    self._size += 1
+            if entry is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._created_at[id(conn)] = time.monotonic()
+                break
+            conn = entry[0]
+            if self._is_usable(*entry):
+                break
+            self._discard(conn)
+
+        elapsed = time.monotonic() - start
+        with self._cond:
+            self._acquired += 1
+            self._acquire_time += elapsed
+            self._acquire_time_max = max(self._acquire_time_max, elapsed)
+        return conn
+
+    def release(self, conn):
+        with self._cond:
+            created_at = self._created_at.get(id(conn))
+            if created_at is not None:
+                self._idle.append((conn, created_at, time.monotonic()))
+                self._cond.notify()
+                return
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except BaseException:
+            # The connection may be half way through a result set or dead, don't hand it out again.
+            # BaseException so an abandoned streaming generator (GeneratorExit) doesn't leak it.
+            self._discard(conn)
+            raise
+        self.release(conn)
+
+    @contextmanager
+    def cursor(self, **kwargs):
+        with self.connection() as conn:
+            cursor = conn.cursor(**kwargs)
+            try:
+                yield self.wrap_cursor(cursor) if self.wrap_cursor else cursor
+            finally:
+                cursor.close()
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+        for conn, _, _ in idle:
+            self._discard(conn)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "waiting": self._waiting,
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "acquired": self._acquired,
+                "timeouts": self._timeouts,
+                "recycled": self._recycled,
+                "acquire_ms_avg": self._acquire_time / self._acquired * 1000 if self._acquired else 0.0,
+                "acquire_ms_max": self._acquire_time_max * 1000,
+            }
@@ -0,0 +1,73 @@
+import threading
+import time
+from contextvars import ContextVar
+
+from src.services.pool import ConnectionPool
+
+# When the client behind the current request last wrote, from the cookie the HTTP middleware hands out
+# on writes. Unlike Versions it reaches every worker, whichever one the write went through.
+client_wrote_at: ContextVar[float | None] = ContextVar("client_wrote_at", default=None)
+
+
+def client_wrote_within(seconds: float) -> bool:
+    wrote_at = client_wrote_at.get()
+    return wrote_at is not None and time.time() - wrote_at < seconds
+
+
+class Replica:
+    def __init__(self, name: str, pool: ConnectionPool):
+        self.name = name
+        self.pool = pool
+        # Seconds behind the primary at the last check, None while it is down or not replicating
+        self.lag = None
+        self.checked_at = float("-inf")
+        self.checking = False
+        self.reads = 0
+
+
+class ReplicaSet:
+    # Spreads reads over the replicas that are close enough behind the primary. Lag is checked on the
+    # read path at most every check_every seconds per replica, one thread at a time, no background thread.
+    def __init__(self, replicas: list[tuple[str, ConnectionPool]], measure_lag, max_lag: float = 5.0, check_every: float = 1.0):
+        self.replicas = [Replica(name, pool) for name, pool in replicas]
+        self.measure_lag = measure_lag
+        self.max_lag = max_lag
+        self.check_every = check_every
+        self._lock = threading.Lock()
+        self._next = 0
+        self.fallbacks = 0
+
+    def _refresh(self, replica: Replica):
+        with self._lock:
+            if replica.checking or time.monotonic() - replica.checked_at < self.check_every:
+                return
+            replica.checking = True
+        try:
+            lag = self.measure_lag(replica.pool)
+        except Exception:
+            lag = None
+        with self._lock:
+            replica.lag = lag
+            replica.checked_at = time.monotonic()
+            replica.checking = False
+
+    def pick(self) -> ConnectionPool | None:
+        # Round robin over the usable replicas, None sends the read to the primary
+        for _ in range(len(self.replicas)):
+            with self._lock:
+                replica = self.replicas[self._next]
+                self._next = (self._next + 1) % len(self.replicas)
+            self._refresh(replica)
+            if replica.lag is not None and replica.lag <= self.max_lag:
+                replica.reads += 1
+                return replica.pool
+        self.fallbacks += 1
+        return None
+
+    def stats(self) -> dict:
+        stats = {"fallbacks": self.fallbacks}
+        for i, replica in enumerate(self.replicas):
+            stats[f"{i}_reads"] = replica.reads
+            # -1 while it can't be read from at all
+            stats[f"{i}_lag_seconds"] = -1 if replica.lag is None else replica.lag
+        return stats
@@ -0,0 +1,10 @@
+import re
+
+
+# Every backend has its own query syntax, clients only get to send words
+WORD = re.compile(r"\w+")
+MAX_TERMS = 16
+
+
+def search_terms(q: str) -> list[str]:
+    return WORD.findall(q)[:MAX_TERMS]
@@ -0,0 +1,29 @@
+from typing import TypeVar
+
+import orjson
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+M = TypeVar("M", bound=BaseModel)
+
+
+def construct(model: type[M], fields: dict) -> M:
+    # Skips validation, only for rows from our own schema, already in the field types
+    return model.model_construct(**fields)
+
+
+def _default(value):
+    # Models from the services are already valid, their fields are written out directly
+    if isinstance(value, BaseModel):
+        return value.__dict__
+    raise TypeError
+
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content, default=_default)
+
+
+class FastJSONResponse(JSONResponse):
+    # Returned straight from a handler it also skips FastAPI's response_model validation pass
+    def render(self, content) -> bytes:
+        return dumps(content)
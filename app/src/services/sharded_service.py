@@ -0,0 +1,298 @@
+import contextvars
+import hashlib
+from collections.abc import Iterator
+from datetime import datetime
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import chain
+from uuid import UUID, uuid4
+
+from src.models.job import Job
+from src.models.task import Task, TaskCreate, TaskOperation, TaskOperationResult, TaskQuery, TaskSearch, TaskStats, TaskSync
+from src.models.user import User, UserLogin
+from src.services.backend import StorageBackend, root_token
+from src.services.cache import TokenCache, Versions
+from src.services.instrumentation import Instrumentation
+from src.services.pagination import decode_cursor, encode_cursor, search_page
+from src.services.serialization import construct
+
+
+def shard_uuid(shard: int) -> UUID:
+    # A random UUID whose first two bytes name the shard that made it, so a token or a task id
+    # leads straight to its shard without asking the others
+    return UUID(bytes=shard.to_bytes(2, "big") + uuid4().bytes[2:])
+
+
+def uuid_shard(value: UUID) -> int:
+    return int.from_bytes(value.bytes[:2], "big")
+
+
+def user_shard(user_id: str, shards: int) -> int:
+    # Stable across processes and restarts, unlike hash(). Changing the number of shards moves most users.
+    return int.from_bytes(hashlib.blake2b(user_id.encode(), digest_size=8).digest(), "big") % shards
+
+
+# Users and their tasks live on the shard their id hashes to. Calls for one user or task go to that shard,
+# root calls over everything go to all of them in parallel and their results are merged.
+class ShardedService:
+    name = "sharded"
+
+    def __init__(
+        self,
+        shards: list[StorageBackend],
+        token_cache: TokenCache,
+        instrumentation: Instrumentation,
+        versions: Versions,
+        max_workers: int | None = None,
+    ):
+        self.shards = shards
+        self.token_cache = token_cache
+        self.instrumentation = instrumentation
+        self.versions = versions
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or 4 * len(shards), thread_name_prefix="shard")
+
+    def _submit(self, fn, *args) -> Future:
+        # Each call gets its own copy of the caller's context, so its queries count towards the request
+        return self.executor.submit(contextvars.copy_context().run, fn, *args)
+
+    def _fan_out(self, method: str, *args) -> list:
+        futures = [self._submit(getattr(shard, method), *args) for shard in self.shards]
+        return [future.result() for future in futures]
+
+    def _user_shard(self, user_id: str) -> StorageBackend:
+        return self.shards[user_shard(user_id, len(self.shards))]
+
+    def _uuid_index(self, value: UUID | str) -> int:
+        # Anything that isn't one of our UUIDs goes to the first shard, which answers it as not found
+        try:
+            index = uuid_shard(value if type(value) is UUID else UUID(value))
+        except ValueError:
+            return 0
+        return index if index < len(self.shards) else 0
+
+    def _uuid_shard(self, value: UUID | str) -> StorageBackend:
+        return self.shards[self._uuid_index(value)]
+
+    def init_db(self, force: bool = False):
+        self._fan_out("init_db", force)
+
+    def is_alive(self) -> dict:
+        shards = self._fan_out("is_alive")
+        return {"is_alive": all(shard["is_alive"] for shard in shards), "db": self.name, "shards": shards}
+
+    def get_users(self, token: str, limit: int | None = None, after: str | None = None) -> list[User] | str:
+        if token != root_token:
+            return self.shards[0].get_users(token, limit, after)
+        # Every shard's page starts after the same id, the merged page is the lowest limit of them
+        results = self._fan_out("get_users", token, limit, after)
+        for res in results:
+            if type(res) is str:
+                return res
+        users = sorted(chain.from_iterable(results), key=lambda user: user.id)
+        return users[:limit] if limit else users
+
+    def get_user(self, user_id: str, token: str) -> User | str:
+        return self._user_shard(user_id).get_user(user_id, token)
+
+    def get_token(self, user: UserLogin) -> str | None:
+        return self._user_shard(user.id).get_token(user)
+
+    def create_user(self, user: UserLogin) -> User | str:
+        return self._user_shard(user.id).create_user(user)
+
+    def delete_user(self, user_id: str, token: str) -> bool | str:
+        return self._user_shard(user_id).delete_user(user_id, token)
+
+    def update_user(self, user_id: str, token: str, user: UserLogin) -> UserLogin | str:
+        shard = self._user_shard(user_id)
+        # The token and the task ids name the shard, so a user can't move off it
+        if self._user_shard(user.id) is not shard:
+            return "User id belongs to another shard"
+        return shard.update_user(user_id, token, user)
+
+    def export_users(self, token: str) -> Iterator[dict] | str:
+        if token != root_token:
+            return self.shards[0].export_users(token)
+        return chain.from_iterable(shard.export_users(token) for shard in self.shards)
+
+    def export_tasks(self, token: str) -> Iterator[dict] | str:
+        if token != root_token:
+            return self.shards[0].export_tasks(token)
+        return chain.from_iterable(shard.export_tasks(token) for shard in self.shards)
+
+    def get_tasks(self, token: str, query: TaskQuery | None = None) -> list[dict] | str:
+        if token != root_token:
+            return self._uuid_shard(token).get_tasks(token, query)
+        query = query or TaskQuery()
+        results = self._fan_out("get_tasks", token, query)
+        for res in results:
+            if type(res) is str:
+                return res
+        # Same order as the backends' ORDER BY created_at, id, the id compared as bytes
+        tasks = sorted(
+            chain.from_iterable(results),
+            key=lambda task: (task["created_at"], task["id"].bytes),
+            reverse=query.order == "desc",
+        )
+        return tasks[: query.limit] if query.limit else tasks
+
+    def get_task(self, task_id: UUID, token: str) -> Task | str:
+        return self._uuid_shard(task_id).get_task(task_id, token)
+
+    def create_task(self, task: TaskCreate, token: str) -> Task | str:
+        return self._uuid_shard(token).create_task(task, token)
+
+    def create_tasks(self, requests: list[tuple[TaskCreate, str]]) -> list[Task | str]:
+        groups = {}
+        for i, (_, token) in enumerate(requests):
+            groups.setdefault(self._uuid_index(token), []).append(i)
+        futures = {
+            index: self._submit(self.shards[index].create_tasks, [requests[i] for i in positions])
+            for index, positions in groups.items()
+        }
+        results = [None] * len(requests)
+        for index, positions in groups.items():
+            for i, result in zip(positions, futures[index].result()):
+                results[i] = result
+        return results
+
+    def delete_task(self, task_id: UUID, token: str) -> bool | str:
+        return self._uuid_shard(task_id).delete_task(task_id, token)
+
+    def update_task(self, task_id: UUID, token: str, task: TaskCreate) -> Task | str:
+        return self._uuid_shard(task_id).update_task(task_id, token, task)
+
+    def bulk_tasks(self, operations: list[TaskOperation], token: str) -> list[TaskOperationResult] | str:
+        if token != root_token:
+            return self._uuid_shard(token).bulk_tasks(operations, token)
+        # Root's operations go to the shards of the tasks they name, each shard's share is all or
+        # nothing but the shards commit independently
+        groups = {}
+        for i, operation in enumerate(operations):
+            index = self._uuid_index(operation.id) if operation.id is not None else 0
+            groups.setdefault(index, []).append(i)
+        futures = {
+            index: self._submit(self.shards[index].bulk_tasks, [operations[i] for i in positions], token)
+            for index, positions in groups.items()
+        }
+        results = [None] * len(operations)
+        for index, positions in groups.items():
+            res = futures[index].result()
+            if type(res) is str:
+                return res
+            for i, result in zip(positions, res):
+                results[i] = result
+        return results
+
+    def sync_tasks(self, token: str, since: str | None = None, limit: int = 1000) -> TaskSync | str:
+        if token != root_token:
+            return self._uuid_shard(token).sync_tasks(token, since, limit)
+        # Root's sync token holds one sync token per shard, a page holds up to limit changes from each
+        try:
+            tokens = decode_cursor(since, len(self.shards)) if since else [None] * len(self.shards)
+        except ValueError:
+            return "Invalid sync token"
+        futures = [self._submit(shard.sync_tasks, token, shard_since, limit) for shard, shard_since in zip(self.shards, tokens)]
+        results = [future.result() for future in futures]
+        for res in results:
+            if type(res) is str:
+                return res
+        return construct(
+            TaskSync,
+            {
+                "changes": [task for res in results for task in res.changes],
+                "deleted": [task_id for res in results for task_id in res.deleted],
+                "next": encode_cursor(*(res.next for res in results)),
+                "has_more": any(res.has_more for res in results),
+            },
+        )
+
+    def prune_tombstones(self, deleted_before: datetime) -> int:
+        return sum(self._fan_out("prune_tombstones", deleted_before))
+
+    def _search_matches(self, token: str, q: str, limit: int, after: str | None) -> list[tuple[float, Task]] | str:
+        if token != root_token:
+            return self._uuid_shard(token)._search_matches(token, q, limit, after)
+        # Each shard ranks against its own word statistics, close enough to compare across shards
+        results = self._fan_out("_search_matches", token, q, limit, after)
+        for res in results:
+            if type(res) is str:
+                return res
+        matches = sorted(chain.from_iterable(results), key=lambda match: (-match[0], match[1].id.bytes))
+        return matches[:limit]
+
+    def search_tasks(self, token: str, q: str, limit: int = 100, after: str | None = None) -> TaskSearch | str:
+        matches = self._search_matches(token, q, limit, after)
+        if type(matches) is str:
+            return matches
+        return search_page(matches, limit)
+
+    def get_stats(self, token: str, user_id: str | None = None) -> TaskStats | str:
+        if user_id is not None:
+            return self._user_shard(user_id).get_stats(token, user_id)
+        if token != root_token:
+            return self._uuid_shard(token).get_stats(token)
+        results = self._fan_out("get_stats", token)
+        for res in results:
+            if type(res) is str:
+                return res
+        latest = [res.last_updated_at for res in results if res.last_updated_at is not None]
+        return construct(
+            TaskStats,
+            {
+                "user_id": None,
+                "total": sum(res.total for res in results),
+                "checked": sum(res.checked for res in results),
+                "important": sum(res.important for res in results),
+                "last_updated_at": max(latest, default=None),
+            },
+        )
+
+    def data_version(self, token: str, user_id: str | None = None) -> tuple[str, str] | None:
+        if token != root_token:
+            return self._uuid_shard(token).data_version(token)
+        if user_id is not None:
+            return self._user_shard(user_id).data_version(token, user_id)
+        # Changes whenever any shard's does
+        return "*", ".".join(version for _, version in self._fan_out("data_version", token))
+
+    def recompute_stats(self, token: str) -> TaskStats | str:
+        if token != root_token:
+            return self.shards[0].recompute_stats(token)
+        for res in self._fan_out("recompute_stats", token):
+            if type(res) is str:
+                return res
+        return self.get_stats(token)
+
+    def delete_data(self, token: str) -> bool:
+        return all(self._fan_out("delete_data", token))
+
+    def purge_user(self, user_id: str, token: str, batch_size: int = 1000) -> Iterator[int] | str:
+        return self._user_shard(user_id).purge_user(user_id, token, batch_size)
+
+    def purge_data(self, token: str, batch_size: int = 1000) -> Iterator[int] | str:
+        if token != root_token:
+            return self.shards[0].purge_data(token, batch_size)
+        return self._purge_data([shard.purge_data(token, batch_size) for shard in self.shards])
+
+    @staticmethod
+    def _purge_data(batches: list[Iterator[int]]) -> Iterator[int]:
+        # One shard after the other, so the job's throttle paces the whole run as it would a single database
+        yield sum(next(shard_batches) for shard_batches in batches)
+        for shard_batches in batches:
+            yield from shard_batches
+
+    # Jobs span shards, their records all live on the first one
+    def claim_job(self, job: Job, stale_before: datetime) -> Job:
+        return self.shards[0].claim_job(job, stale_before)
+
+    def save_job(self, job: Job) -> bool:
+        return self.shards[0].save_job(job)
+
+    def get_job(self, job_id: UUID) -> Job | None:
+        return self.shards[0].get_job(job_id)
+
+    def list_jobs(self, limit: int = 100) -> list[Job]:
+        return self.shards[0].list_jobs(limit)
+
+    def prune_jobs(self, finished_before: datetime):
+        self.shards[0].prune_jobs(finished_before)
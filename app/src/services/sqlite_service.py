@@ -0,0 +1,305 @@
+import sqlite3
+from datetime import datetime
+from uuid import uuid4
+
+from src.services.cache import TokenCache, Versions
+from src.services.instrumentation import Instrumentation, InstrumentedCursor
+from src.services.mariadb_service import SCHEMA_VERSION, TASK_COLUMNS, MariaDBService
+from src.services.pool import ConnectionPool
+
+# Stored as text in the same format str(datetime) produces, which sorts chronologically
+sqlite3.register_adapter(datetime, str)
+
+
+class SQLiteCursor:
+    # The MariaDB service's SQL runs unchanged apart from the placeholder style
+    def __init__(self, cursor: sqlite3.Cursor):
+        self._cursor = cursor
+
+    @staticmethod
+    def _translate(sql: str) -> str:
+        # Transactions take the write lock up front, which makes row locks (FOR UPDATE) redundant
+        return sql.replace("%s", "?").replace("START TRANSACTION", "BEGIN IMMEDIATE").replace(" FOR UPDATE", "")
+
+    def execute(self, sql: str, params=()):
+        return self._cursor.execute(self._translate(sql), params)
+
+    def executemany(self, sql: str, params):
+        return self._cursor.executemany(self._translate(sql), params)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class SQLiteConnection:
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+
+    def cursor(self, **kwargs) -> SQLiteCursor:
+        # sqlite3 cursors step through results lazily, so buffered=False needs no equivalent
+        return SQLiteCursor(self._conn.cursor())
+
+    def ping(self):
+        self._conn.execute("SELECT 1")
+
+    def close(self):
+        self._conn.close()
+
+
+class SQLiteService(MariaDBService):
+    name = "sqlite"
+    integrity_error = sqlite3.IntegrityError
+    # A single writer, there is no row lock to spread
+    stats_slots = 1
+    new_version = "(random() & 1099511627775)"
+
+    def __init__(
+        self,
+        path: str = ":memory:",
+        pool_max: int = 4,
+        token_cache: TokenCache | None = None,
+        instrumentation: Instrumentation | None = None,
+        versions: Versions | None = None,
+        new_id=uuid4,
+    ):
+        self.token_cache = token_cache or TokenCache()
+        self.versions = versions or Versions()
+        self.instrumentation = instrumentation or Instrumentation()
+        self.new_id = new_id
+        # Embedded, every connection reads the same file
+        self.replicas = None
+        self._keeper = None
+        if path == ":memory:":
+            # A private shared-cache database, kept alive by one connection the pool never touches.
+            # Shared cache locks whole tables, so the pool gets a single connection.
+            path = f"file:tasks-{uuid4().hex}?mode=memory&cache=shared"
+            self._keeper = sqlite3.connect(path, uri=True, check_same_thread=False)
+            pool_max = 1
+        self.path = path
+        self.pool = ConnectionPool(
+            self._connect,
+            min_size=1,
+            max_size=pool_max,
+            wrap_cursor=lambda cursor: InstrumentedCursor(cursor, self.instrumentation, self.name),
+        )
+
+    def _connect(self) -> SQLiteConnection:
+        conn = sqlite3.connect(self.path, uri=True, check_same_thread=False, isolation_level=None, timeout=30)
+        conn.execute("PRAGMA foreign_keys = ON")
+        if self._keeper is None:
+            conn.execute("PRAGMA journal_mode = WAL")
+        return SQLiteConnection(conn)
+
+    def init_db(self, force: bool = False):
+        self.pool.fill()
+        with self.pool.cursor() as cursor:
+            if not force and self._schema_version(cursor) == SCHEMA_VERSION:
+                return
+            # Takes the database's write lock, workers starting at the same time wait here
+            cursor.execute("BEGIN IMMEDIATE")
+            if force or self._schema_version(cursor) != SCHEMA_VERSION:
+                self._create_schema(cursor)
+                cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            cursor.execute("COMMIT")
+
+    @staticmethod
+    def _column_types(cursor, table: str) -> dict:
+        cursor.execute(f"PRAGMA table_info({table})")
+        return {column[1]: column[2].lower() for column in cursor.fetchall()}
+
+    @staticmethod
+    def _schema_version(cursor) -> int:
+        cursor.execute("PRAGMA user_version")
+        return cursor.fetchone()[0]
+
+    def _create_schema(self, cursor):
+        cursor.execute(
+            """
+                CREATE TABLE IF NOT EXISTS users (
+                    id TEXT PRIMARY KEY,
+                    password TEXT NOT NULL,
+                    uuid BLOB NOT NULL
+                );
+            """
+        )
+
+        cursor.execute(
+            """
+                CREATE TABLE IF NOT EXISTS tasks (
+                    id BLOB PRIMARY KEY,
+                    user_id TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    is_checked BOOLEAN NOT NULL,
+                    is_important BOOLEAN NOT NULL,
+                    seq INTEGER NOT NULL DEFAULT 0,
+                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE ON UPDATE CASCADE
+                );
+            """
+        )
+
+        cursor.execute("PRAGMA table_info(tasks)")
+        if "seq" not in [column[1] for column in cursor.fetchall()]:
+            cursor.execute("ALTER TABLE tasks ADD COLUMN seq INTEGER NOT NULL DEFAULT 0")
+            cursor.execute(
+                """
+                    UPDATE tasks SET seq = ranked.seq
+                    FROM (SELECT rowid, ROW_NUMBER() OVER (ORDER BY created_at, id) AS seq FROM tasks) AS ranked
+                    WHERE tasks.rowid = ranked.rowid
+                """
+            )
+        self._create_change_log(cursor)
+        self._create_stats(cursor)
+        self._create_search(cursor)
+        self._create_jobs(cursor)
+
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS users_uuid ON users (uuid)")
+        # SQLite appends the rowid, not the primary key, to secondary indexes, so id is spelled out
+        cursor.execute("CREATE INDEX IF NOT EXISTS tasks_user_created ON tasks (user_id, created_at, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS tasks_created ON tasks (created_at, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS tasks_user_seq ON tasks (user_id, seq)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS tasks_seq ON tasks (seq)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS tombstones_user_seq ON tombstones (user_id, seq)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS tombstones_deleted ON tombstones (deleted_at)")
+
+    def _create_stats(self, cursor):
+        self._stats_tables(cursor)
+        latest = "MAX(COALESCE(last_updated_at, NEW.updated_at), NEW.updated_at)"
+        version = f"version = {self.new_version}"
+        added = f"total = total + 1, checked = checked + NEW.is_checked, important = important + NEW.is_important, last_updated_at = {latest}, {version}"
+        changed = f"checked = checked + NEW.is_checked - OLD.is_checked, important = important + NEW.is_important - OLD.is_important, last_updated_at = {latest}, {version}"
+        removed = f"total = total - 1, checked = checked - OLD.is_checked, important = important - OLD.is_important, {version}"
+        # Only the columns the counters depend on, so stamping seq or cascading a user rename doesn't fire it
+        triggers = {
+            "INSERT": f"""
+                INSERT INTO user_task_stats (user_id, total, checked, important, last_updated_at, version)
+                    VALUES (NEW.user_id, 1, NEW.is_checked, NEW.is_important, NEW.updated_at, {self.new_version})
+                    ON CONFLICT (user_id) DO UPDATE SET {added};
+                UPDATE task_stats SET {added};
+            """,
+            "UPDATE OF is_checked, is_important, updated_at": f"UPDATE user_task_stats SET {changed} WHERE user_id = NEW.user_id; UPDATE task_stats SET {changed};",
+            "DELETE": f"UPDATE user_task_stats SET {removed} WHERE user_id = OLD.user_id; UPDATE task_stats SET {removed};",
+        }
+        for event, body in triggers.items():
+            name = event.split()[0].lower()
+            # Replaced, triggers from before the versions don't set them
+            cursor.execute(f"DROP TRIGGER IF EXISTS tasks_stats_{name}")
+            cursor.execute(f"CREATE TRIGGER tasks_stats_{name} AFTER {event} ON tasks BEGIN {body} END")
+        cursor.execute(
+            f"""
+                CREATE TRIGGER IF NOT EXISTS users_stats_insert AFTER INSERT ON users BEGIN
+                    INSERT INTO user_task_stats (user_id, version) VALUES (NEW.id, {self.new_version})
+                        ON CONFLICT (user_id) DO UPDATE SET {version};
+                END
+            """
+        )
+        cursor.execute(
+            f"""
+                CREATE TRIGGER IF NOT EXISTS users_stats_update AFTER UPDATE ON users BEGIN
+                    UPDATE user_task_stats SET {version} WHERE user_id = OLD.id;
+                    UPDATE task_stats SET {version} WHERE NEW.id <> OLD.id;
+                END
+            """
+        )
+
+    def _create_search(self, cursor):
+        # FTS5 over the tasks table itself, keyed by rowid, so the text isn't stored twice.
+        # Rowids of a table without an INTEGER PRIMARY KEY only change on VACUUM, which nothing here runs.
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'tasks_fts'")
+        exists = cursor.fetchone() is not None
+        cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(text, content = 'tasks', content_rowid = 'rowid')")
+        if not exists:
+            cursor.execute("INSERT INTO tasks_fts (tasks_fts) VALUES ('rebuild')")
+        add = "INSERT INTO tasks_fts (rowid, text) VALUES (NEW.rowid, NEW.text)"
+        remove = "INSERT INTO tasks_fts (tasks_fts, rowid, text) VALUES ('delete', OLD.rowid, OLD.text)"
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS tasks_search_insert AFTER INSERT ON tasks BEGIN {add}; END")
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS tasks_search_update AFTER UPDATE OF text ON tasks BEGIN {remove}; {add}; END")
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS tasks_search_delete AFTER DELETE ON tasks BEGIN {remove}; END")
+
+    def _rekey_search(self, cursor, user_id: str):
+        # tasks_fts holds the text alone, nothing in it names the owner
+        pass
+
+    @staticmethod
+    def _search_sql(terms: list[str], user_id: str | None) -> tuple[str, list]:
+        # Quoted so every word is taken literally, OR so any of them matches like on MariaDB.
+        # bm25() is lower for better matches, negated so both backends rank by score descending.
+        columns = ", ".join(f"tasks.{column}" for column in TASK_COLUMNS.split(", "))
+        sql = f"SELECT {columns}, -bm25(tasks_fts) AS score FROM tasks_fts JOIN tasks ON tasks.rowid = tasks_fts.rowid WHERE tasks_fts MATCH %s"
+        params = [" OR ".join(f'"{term}"' for term in terms)]
+        if user_id is not None:
+            sql += " AND tasks.user_id = %s"
+            params.append(user_id)
+        return sql, params
+
+    @staticmethod
+    def _upsert_sql(table: str, columns: str, key: str) -> str:
+        names = columns.split(", ")
+        updates = ", ".join(f"{name} = excluded.{name}" for name in names if name != key)
+        placeholders = ", ".join("%s" for _ in names)
+        return f"INSERT INTO {table} ({columns}) VALUES ({placeholders}) ON CONFLICT ({key}) DO UPDATE SET {updates}"
+
+    def _create_jobs(self, cursor):
+        cursor.execute(
+            """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id BLOB PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    target TEXT,
+                    status TEXT NOT NULL,
+                    total INTEGER NOT NULL,
+                    deleted INTEGER NOT NULL,
+                    batches INTEGER NOT NULL,
+                    started_at TEXT NOT NULL,
+                    finished_at TEXT,
+                    error TEXT,
+                    heartbeat_at TEXT NOT NULL,
+                    active_key TEXT UNIQUE
+                );
+            """
+        )
+
+    def _create_change_log(self, cursor):
+        # SQLite has a single writer, so a plain counter gives seqs in commit order
+        cursor.execute("CREATE TABLE IF NOT EXISTS change_seq (value BIGINT NOT NULL)")
+        cursor.execute("SELECT 1 FROM change_seq")
+        if not cursor.fetchone():
+            cursor.execute("INSERT INTO change_seq (value) SELECT COALESCE(MAX(seq), 0) FROM tasks")
+        cursor.execute(
+            """
+                CREATE TABLE IF NOT EXISTS tombstones (
+                    seq INTEGER PRIMARY KEY,
+                    id BLOB NOT NULL,
+                    user_id TEXT NOT NULL,
+                    deleted_at TEXT NOT NULL
+                );
+            """
+        )
+        # BEFORE triggers can't assign to NEW, the row is stamped right after it is written instead
+        next_seq = "UPDATE change_seq SET value = value + 1"
+        stamp = "UPDATE tasks SET seq = (SELECT value FROM change_seq) WHERE rowid = NEW.rowid"
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS tasks_seq_insert AFTER INSERT ON tasks BEGIN {next_seq}; {stamp}; END")
+        cursor.execute(
+            f"""
+                CREATE TRIGGER IF NOT EXISTS tasks_seq_update
+                AFTER UPDATE OF user_id, text, created_at, updated_at, is_checked, is_important ON tasks
+                BEGIN {next_seq}; {stamp}; END
+            """
+        )
+        cursor.execute(
+            f"""
+                CREATE TRIGGER IF NOT EXISTS tasks_tombstone AFTER DELETE ON tasks
+                BEGIN
+                    {next_seq};
+                    INSERT INTO tombstones (seq, id, user_id, deleted_at)
+                        SELECT value, OLD.id, OLD.user_id, strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime') FROM change_seq;
+                END
+            """
+        )
+        self._create_sync_horizon(cursor)
+
+    def _sync_until(self, cursor) -> int:
+        # Every seq up to the counter's committed value belongs to a finished write
+        cursor.execute("SELECT value FROM change_seq")
+        return cursor.fetchone()[0]
@@ -0,0 +1,62 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger("src.startup")
+
+
+class Startup:
+    # Connects and migrates in the background with capped exponential backoff, so the server answers
+    # liveness checks straight away and a database that isn't up yet doesn't crash the worker
+    def __init__(self, retries: int = 10, backoff: float = 0.5, max_backoff: float = 10.0):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.started_at = time.monotonic()
+        self.ready = False
+        self.failed = False
+        self.attempts = 0
+        self.error = None
+        self.startup_seconds = None
+        self._done = asyncio.Event()
+
+    async def run(self, db_service):
+        self.started_at = time.monotonic()
+        self.ready = self.failed = False
+        self.attempts = 0
+        self.error = self.startup_seconds = None
+        self._done.clear()
+        delay = self.backoff
+        while True:
+            self.attempts += 1
+            try:
+                await db_service.init_db()
+                break
+            except Exception as e:
+                self.error = repr(e)
+                if self.attempts >= self.retries:
+                    logger.error("giving up on the database after %d attempts: %s", self.attempts, self.error)
+                    self.failed = True
+                    self._done.set()
+                    return
+                logger.warning("database not ready (attempt %d), retrying in %.1fs: %s", self.attempts, delay, self.error)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+        self.ready = True
+        self.error = None
+        self.startup_seconds = time.monotonic() - self.started_at
+        self._done.set()
+
+    async def wait(self):
+        await self._done.wait()
+        if self.failed:
+            raise RuntimeError(f"Startup failed: {self.error}")
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "failed": self.failed,
+            "attempts": self.attempts,
+            "error": self.error,
+            "startup_seconds": self.startup_seconds,
+        }
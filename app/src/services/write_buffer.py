@@ -0,0 +1,68 @@
+import asyncio
+import contextvars
+
+
+class WriteBuffer:
+    # Coalesces concurrent writes into one flush(items) call. A batch goes out once it holds max_items
+    # or max_delay seconds after its first item arrived, and every caller waits for its own batch.
+    def __init__(self, flush, max_items: int = 100, max_delay: float = 0.005):
+        self._flush = flush
+        self.max_items = max_items
+        self.max_delay = max_delay
+        self._pending = []
+        self._timer = None
+        self._flushes = set()
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_items:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._start_flush)
+        return await future
+
+    def _start_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        # A fresh context, so the batch's queries aren't charged to whichever request happened to fill it
+        flush = asyncio.get_running_loop().create_task(self._run(batch), context=contextvars.Context())
+        self._flushes.add(flush)
+        flush.add_done_callback(self._flushes.discard)
+
+    async def _run(self, batch: list):
+        self.batches += 1
+        self.items += len(batch)
+        try:
+            results = await self._flush([item for item, _ in batch])
+        except BaseException as e:
+            # Cancelled at shutdown or worse, callers mustn't wait forever for it either
+            for _, future in batch:
+                if future.done():
+                    continue
+                if isinstance(e, asyncio.CancelledError):
+                    future.cancel()
+                else:
+                    future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+            return
+        for (_, future), result in zip(batch, results):
+            # Callers that went away (client disconnects) leave a cancelled future behind
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "batches": self.batches,
+            "items": self.items,
+            "batch_size_avg": self.items / self.batches if self.batches else 0,
+        }